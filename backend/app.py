@@ -4,11 +4,13 @@ import threading
 from flask import Flask, request, g, current_app, jsonify, send_file
 from flask_cors import CORS
 import os
-from PIL import Image
+import json
 from datetime import datetime
 
 from config import config
 from models.album import Album
+from models.metadata import parse_date
+from models.settings import AlbumSettings
 from utils.utils import convert_results, synchronized
 from utils.logger import setup_logger
 
@@ -40,7 +42,8 @@ def get_album_instance():
         dump_path=current_app.config['DUMP_PATH'],
         backup_path=current_app.config['BACKUP_PATH'],
         max_workers=current_app.config.get("MAX_WORKERS", 4),
-        lang=current_app.config["ALBUM_LANGUAGE"]
+        lang=current_app.config["ALBUM_LANGUAGE"],
+        settings=AlbumSettings.from_config(current_app.config),
     )
     
     # 同时设置到g对象中
@@ -113,6 +116,67 @@ def create_app(config_name='default'):
     def internal_error(error):
         app.logger.error(f"Internal server error: {error}")
         return jsonify({'error': 'Internal server error'}), 500
+
+    def get_filters(data):
+        """读取元数据过滤条件，multipart 表单中以JSON字符串提交"""
+        filters = data.get('filters')
+        if isinstance(filters, str):
+            filters = json.loads(filters) if filters.strip() else None
+        if filters is not None and not isinstance(filters, dict):
+            raise ValueError('Filters must be an object')
+        if not filters:
+            return filters
+        # 范围条件转换为数字，格式错误时返回400而不是在检索中出错
+        filters = dict(filters)
+        for key, value in filters.items():
+            if value is None or value == '':
+                continue
+            if key.startswith(('min_', 'max_')):
+                if isinstance(value, bool):
+                    raise ValueError(f'Filter {key} must be a number')
+                try:
+                    filters[key] = float(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f'Filter {key} must be a number')
+            elif key in ('date_from', 'date_to'):
+                try:
+                    filters[key] = parse_date(value, end_of_day=key == 'date_to')
+                except (TypeError, ValueError, OverflowError):
+                    raise ValueError(f'Filter {key} must be a date or timestamp')
+        return filters
+
+    def get_image_index(data):
+        """读取图片行号，不是整数时抛出 ValueError"""
+        index = data.get('index')
+        if index is None:
+            return None
+        try:
+            return int(index)
+        except (TypeError, ValueError):
+            raise ValueError('Image index must be an integer')
+
+    def page_response(album, cursor_id, offset, limit, **extra):
+        """返回游标中的一页结果，只为本页图片生成缩略图"""
+        page = album.get_page(cursor_id, offset, limit)
+        if page is None:
+            return jsonify({
+                'success': False,
+                'error': 'Cursor expired or index updated, please search again'
+            }), 410
+        paths, scores, total = page
+        results = convert_results(paths, scores)
+        next_offset = offset + len(results)
+        return jsonify({
+            'success': True,
+            'data': results,
+            'total_results': len(results),
+            'cursor': cursor_id,
+            'offset': offset,
+            'next_offset': next_offset,
+            'total_candidates': total,
+            'has_more': next_offset < total,
+            **extra
+        })
     
     @app.route('/api/test/log', methods=['GET'])
     def test_log_levels():
@@ -166,6 +230,50 @@ def create_app(config_name='default'):
                 'error': str(e)
             }), 500
     
+    @app.route('/api/images/walk', methods=['POST'])
+    def random_walk():
+        """随机漫游：返回图片的近邻和随机选出的下一张图片（有k近邻图时无需扫描全库）"""
+        album = get_album_instance()
+        try:
+            data = request.get_json() or {}
+            image_path = data.get('path')
+            image_index = get_image_index(data)
+            if image_path is None and image_index is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Image path or index is required'
+                }), 400
+
+            count = min(max(int(data.get('count', 12)), 1), 50)
+            exclude = data.get('exclude') or []
+            include_images = data.get('include_images', True)
+            result = album.walk(path=image_path, index=image_index, count=count, exclude=exclude)
+            if result is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Image is not indexed'
+                }), 404
+
+            paths, similarities, next_path = result
+            return jsonify({
+                'success': True,
+                'data': convert_results(paths, similarities, include_images=include_images),
+                'next': next_path,
+                'total_results': len(paths)
+            })
+
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            app.logger.error(f"Error in random_walk: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+
     @app.route('/api/images/search/text', methods=['POST'])
     def text_search():
         """文本搜索"""
@@ -187,8 +295,19 @@ def create_app(config_name='default'):
             threshold = data.get('threshold', app.config['DEFAULT_THRESHOLD'])
             k = min(max(k, 1), 50)
             threshold = max(min(threshold, 1.0), 0.0)
+            filters = get_filters(data)
+            score_mode = data.get('score_mode') or None
+
+            # 指定 page_size 时返回分页游标，后续页通过 /api/images/search/page 获取
+            if data.get('page_size') is not None:
+                page_size = min(max(int(data['page_size']), 1), app.config['MAX_RESULTS'])
+                cursor_id, total = album.text_search_cursor(query, threshold=threshold, filters=filters,
+                                                            score_mode=score_mode)
+                app.logger.info(f"Text search cursor {cursor_id} with {total} candidates for query: '{query}'")
+                return page_response(album, cursor_id, 0, page_size, query=query)
             
-            paths, scores = album.text_search([query], k=k, threshold=threshold)
+            paths, scores = album.text_search([query], k=k, threshold=threshold, filters=filters,
+                                              score_mode=score_mode)
             results = convert_results(paths, scores)
 
             app.logger.info(f"Text search found {len(results)} results for query: '{query}'")
@@ -199,6 +318,12 @@ def create_app(config_name='default'):
                 'total_results': len(results)
             })
             
+        except ValueError as e:
+            app.logger.warning(f"Invalid parameters in text_search: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
         except Exception as e:
             app.logger.error(f"Error in text_search: {e}")
             return jsonify({
@@ -232,14 +357,20 @@ def create_app(config_name='default'):
             threshold = request.form.get('threshold', app.config['DEFAULT_THRESHOLD'], type=float)
             k = min(max(k, 1), 50)
             threshold = max(min(threshold, 1.0), 0.0)
+            filters = get_filters(request.form)
+            score_mode = request.form.get('score_mode') or None
+
+            page_size = request.form.get('page_size', type=int)
+            if page_size is not None:
+                page_size = min(max(page_size, 1), app.config['MAX_RESULTS'])
+                cursor_id, total = album.image_search_cursor(file.read(), threshold=threshold, filters=filters,
+                                                             score_mode=score_mode)
+                app.logger.info(f"Image search cursor {cursor_id} with {total} candidates")
+                return page_response(album, cursor_id, 0, page_size)
             
-            # 处理上传的图片
-            image = Image.open(file.stream)
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # 搜索相似图片
-            paths, scores = album.image_search(image, k=k, threshold=threshold)
+            # 搜索相似图片（按内容指纹复用已有特征，未命中时才解码编码）
+            paths, scores = album.image_search_data(file.read(), k=k, threshold=threshold, filters=filters,
+                                                    score_mode=score_mode)
             results = convert_results(paths, scores)
             
             app.logger.info(f"Image search found {len(results)} results for query")
@@ -249,6 +380,12 @@ def create_app(config_name='default'):
                 'total_results': len(results)
             })
             
+        except ValueError as e:
+            app.logger.warning(f"Invalid parameters in image_search: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
         except Exception as e:
             app.logger.error(f"Error in image_search: {e}")
             return jsonify({
@@ -256,6 +393,305 @@ def create_app(config_name='default'):
                 'error': str(e)
             }), 500
     
+    @app.route('/api/images/search/similar', methods=['POST'])
+    def similar_search():
+        """以相册中已索引的图片搜索相似图片"""
+        album = get_album_instance()
+        try:
+            data = request.get_json() or {}
+            image_path = data.get('path')
+            image_index = get_image_index(data)
+
+            if image_path is None and image_index is None:
+                app.logger.warning("Similar search called without path or index")
+                return jsonify({
+                    'success': False,
+                    'error': 'Image path or index is required'
+                }), 400
+
+            # 限制参数范围
+            k = int(data.get('k', 8))
+            threshold = float(data.get('threshold', app.config['DEFAULT_THRESHOLD']))
+            k = min(max(k, 1), 50)
+            threshold = max(min(threshold, 1.0), 0.0)
+            filters = get_filters(data)
+            score_mode = data.get('score_mode') or None
+
+            if data.get('page_size') is not None:
+                page_size = min(max(int(data['page_size']), 1), app.config['MAX_RESULTS'])
+                cursor = album.similar_search_cursor(path=image_path, index=image_index, threshold=threshold,
+                                                    filters=filters, score_mode=score_mode)
+                if cursor is None:
+                    return jsonify({
+                        'success': False,
+                        'error': 'Image is not indexed'
+                    }), 404
+                return page_response(album, cursor[0], 0, page_size)
+
+            result = album.similar_search(path=image_path, index=image_index, k=k, threshold=threshold,
+                                         filters=filters, score_mode=score_mode)
+            if result is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Image is not indexed'
+                }), 404
+
+            paths, scores = result
+            results = convert_results(paths, scores)
+            app.logger.info(f"Similar search found {len(results)} results for {image_path or image_index}")
+            return jsonify({
+                'success': True,
+                'data': results,
+                'total_results': len(results)
+            })
+
+        except ValueError as e:
+            app.logger.warning(f"Invalid parameters in similar_search: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            app.logger.error(f"Error in similar_search: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+
+    @app.route('/api/images/search/batch', methods=['POST'])
+    def batch_search():
+        """批量搜索：一次请求提交多个文本和图像查询"""
+        album = get_album_instance()
+        try:
+            if request.content_type and 'application/json' in request.content_type:
+                data = request.get_json() or {}
+                queries = data.get('queries', [])
+                files = []
+            else:
+                data = request.form
+                queries = request.form.getlist('queries')
+                # 兼容以JSON数组字符串提交的 queries 字段
+                if len(queries) == 1 and queries[0].startswith('['):
+                    queries = json.loads(queries[0])
+                files = request.files.getlist('images')
+
+            queries = [q for q in queries if isinstance(q, str) and q.strip()]
+            if not queries and not files:
+                app.logger.warning("Batch search called without queries or images")
+                return jsonify({
+                    'success': False,
+                    'error': 'At least one query or image is required'
+                }), 400
+
+            max_queries = app.config['MAX_BATCH_QUERIES']
+            if len(queries) + len(files) > max_queries:
+                return jsonify({
+                    'success': False,
+                    'error': f'Too many queries, at most {max_queries} per request'
+                }), 400
+
+            # 限制参数范围
+            k = int(data.get('k', 8))
+            threshold = float(data.get('threshold', app.config['DEFAULT_THRESHOLD']))
+            include_images = str(data.get('include_images', 'false')).lower() == 'true'
+            k = min(max(k, 1), 50)
+            threshold = max(min(threshold, 1.0), 0.0)
+            filters = get_filters(data)
+            score_mode = data.get('score_mode') or None
+
+            image_data = [file.read() for file in files]
+
+            app.logger.info(f"Batch search with {len(queries)} text queries and {len(image_data)} images")
+            results = album.batch_search(queries, image_data, k=k, threshold=threshold, filters=filters,
+                                         score_mode=score_mode)
+
+            items = [{'type': 'text', 'query': q} for q in queries] + \
+                    [{'type': 'image', 'filename': f.filename} for f in files]
+            for item, (paths, scores) in zip(items, results):
+                item['results'] = convert_results(paths, scores, include_images=include_images)
+                item['total_results'] = len(item['results'])
+
+            return jsonify({
+                'success': True,
+                'data': items,
+                'total_queries': len(items)
+            })
+
+        except ValueError as e:
+            app.logger.warning(f"Invalid parameters in batch_search: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            app.logger.error(f"Error in batch_search: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+
+    @app.route('/api/images/search/compose', methods=['POST'])
+    def compose_search():
+        """组合搜索：加权的正负文本和图片条件合成一次检索"""
+        album = get_album_instance()
+        try:
+            if request.content_type and 'application/json' in request.content_type:
+                data = request.get_json() or {}
+                terms = data.get('terms', [])
+                files = []
+            else:
+                data = request.form
+                terms = json.loads(request.form.get('terms') or '[]')
+                files = request.files.getlist('images')
+
+            if not isinstance(terms, list) or not terms:
+                app.logger.warning("Compose search called without terms")
+                return jsonify({
+                    'success': False,
+                    'error': 'At least one term is required'
+                }), 400
+
+            max_terms = app.config['MAX_COMPOSE_TERMS']
+            if len(terms) > max_terms:
+                return jsonify({
+                    'success': False,
+                    'error': f'Too many terms, at most {max_terms} per request'
+                }), 400
+
+            # 限制参数范围
+            k = int(data.get('k', 8))
+            threshold = float(data.get('threshold', app.config['DEFAULT_THRESHOLD']))
+            k = min(max(k, 1), 50)
+            threshold = max(min(threshold, 1.0), 0.0)
+            filters = get_filters(data)
+            score_mode = data.get('score_mode') or None
+
+            image_data = [file.read() for file in files]
+            app.logger.info(f"Compose search with {len(terms)} terms and {len(image_data)} uploaded images")
+
+            if data.get('page_size') is not None:
+                page_size = min(max(int(data['page_size']), 1), app.config['MAX_RESULTS'])
+                cursor_id, _ = album.compose_search_cursor(terms, image_data, threshold=threshold,
+                                                           filters=filters, score_mode=score_mode)
+                return page_response(album, cursor_id, 0, page_size, terms=terms)
+
+            paths, scores = album.compose_search(terms, image_data, k=k, threshold=threshold,
+                                                 filters=filters, score_mode=score_mode)
+            results = convert_results(paths, scores)
+            return jsonify({
+                'success': True,
+                'data': results,
+                'terms': terms,
+                'total_results': len(results)
+            })
+
+        except ValueError as e:
+            app.logger.warning(f"Invalid parameters in compose_search: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            app.logger.error(f"Error in compose_search: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+
+    @app.route('/api/images/search/page', methods=['GET'])
+    def search_page():
+        """按游标获取分页检索的后续结果"""
+        album = get_album_instance()
+        try:
+            cursor_id = request.args.get('cursor', '')
+            if not cursor_id:
+                return jsonify({
+                    'success': False,
+                    'error': 'Cursor is required'
+                }), 400
+
+            offset = max(request.args.get('offset', 0, type=int), 0)
+            limit = request.args.get('limit', 20, type=int)
+            limit = min(max(limit, 1), app.config['MAX_RESULTS'])
+            return page_response(album, cursor_id, offset, limit)
+
+        except Exception as e:
+            app.logger.error(f"Error in search_page: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+
+    @app.route('/api/images/facets', methods=['GET'])
+    def get_facets():
+        """获取可用于过滤的目录和扩展名"""
+        album = get_album_instance()
+        try:
+            return jsonify({
+                'success': True,
+                'data': album.get_facets()
+            })
+        except Exception as e:
+            app.logger.error(f"Error in get_facets: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+
+    @app.route('/api/albums', methods=['GET'])
+    def get_auto_albums():
+        """获取自动相册（特征空间聚类）列表及封面"""
+        album = get_album_instance()
+        try:
+            representatives = min(max(request.args.get('representatives', 4, type=int), 0), 12)
+            include_images = request.args.get('include_images', 'true').lower() == 'true'
+            albums = [{
+                'id': cluster,
+                'size': size,
+                'images': convert_results(paths, [0] * len(paths), include_images=include_images)
+            } for cluster, size, paths in album.get_auto_albums(representatives)]
+            return jsonify({
+                'success': True,
+                'data': albums,
+                'total_albums': len(albums)
+            })
+        except Exception as e:
+            app.logger.error(f"Error in get_auto_albums: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+
+    @app.route('/api/albums/<int:album_id>', methods=['GET'])
+    def get_auto_album(album_id):
+        """分页获取自动相册中的图片，分数为与聚类中心的余弦相似度"""
+        album = get_album_instance()
+        try:
+            offset = max(request.args.get('offset', 0, type=int), 0)
+            limit = min(max(request.args.get('limit', 20, type=int), 1), app.config['MAX_RESULTS'])
+            include_images = request.args.get('include_images', 'true').lower() == 'true'
+            result = album.get_auto_album(album_id, offset, limit)
+            if result is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Album not found'
+                }), 404
+
+            paths, sims, total = result
+            return jsonify({
+                'success': True,
+                'data': convert_results(paths, sims, include_images=include_images),
+                'offset': offset,
+                'total': total,
+                'has_more': offset + len(paths) < total
+            })
+        except Exception as e:
+            app.logger.error(f"Error in get_auto_album: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+
     @app.route('/api/images/stats', methods=['GET'])
     def get_stats():
         """获取统计信息"""
@@ -272,12 +708,118 @@ def create_app(config_name='default'):
                 'error': str(e)
             }), 500
     
+    @app.route('/api/index/recall', methods=['GET'])
+    def get_ann_recall():
+        """评估ANN索引召回率"""
+        album = get_album_instance()
+        try:
+            k = request.args.get('k', 20, type=int)
+            n_queries = request.args.get('queries', 100, type=int)
+            nprobes = request.args.get('nprobe', '1,4,16,64')
+            nprobes = [int(n) for n in nprobes.split(',') if n.strip()]
+            k = min(max(k, 1), 200)
+            n_queries = min(max(n_queries, 1), 1000)
+
+            report = album.database.evaluate_ann_recall(k=k, nprobes=nprobes, n_queries=n_queries)
+            return jsonify({
+                'success': True,
+                'data': {
+                    'backend': 'ivf' if album.index.ann is not None else 'exact',
+                    'k': k,
+                    'report': report
+                }
+            })
+        except Exception as e:
+            app.logger.error(f"Error in get_ann_recall: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+
+    @app.route('/api/duplicates/scan', methods=['POST'])
+    def start_duplicate_scan():
+        """在后台启动近似重复检测，中断过的任务会从检查点继续"""
+        album = get_album_instance()
+        try:
+            data = request.get_json(silent=True) or {}
+            threshold = data.get('threshold')
+            block_size = data.get('block_size')
+            started = album.find_duplicates(
+                threshold=float(threshold) if threshold is not None else None,
+                block_size=int(block_size) if block_size is not None else None,
+            )
+            if not started:
+                return jsonify({
+                    'success': False,
+                    'error': 'Duplicate detection is already running'
+                }), 409
+
+            app.logger.info("Started duplicate detection")
+            return jsonify({
+                'success': True,
+                'message': 'Duplicate detection started',
+                'data': album.duplicates.status(album.index.version)
+            }), 202
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            app.logger.error(f"Error in start_duplicate_scan: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+
+    @app.route('/api/duplicates/stop', methods=['POST'])
+    def stop_duplicate_scan():
+        """停止近似重复检测，进度保存为检查点"""
+        album = get_album_instance()
+        album.duplicates.stop()
+        return jsonify({
+            'success': True,
+            'message': 'Stop requested'
+        })
+
+    @app.route('/api/duplicates', methods=['GET'])
+    def get_duplicates():
+        """获取近似重复检测状态和重复组"""
+        album = get_album_instance()
+        try:
+            offset = max(request.args.get('offset', 0, type=int), 0)
+            limit = request.args.get('limit', 20, type=int)
+            limit = min(max(limit, 1), 100)
+            include_images = request.args.get('include_images', 'true').lower() == 'true'
+
+            status, clusters, total = album.get_duplicates(offset, limit)
+            groups = [{
+                'size': len(cluster['paths']),
+                'max_similarity': cluster['max_similarity'],
+                'images': convert_results(cluster['paths'], [cluster['max_similarity']] * len(cluster['paths']),
+                                          include_images=include_images)
+            } for cluster in clusters]
+            return jsonify({
+                'success': True,
+                'status': status,
+                'data': groups,
+                'offset': offset,
+                'total_groups': total
+            })
+        except Exception as e:
+            app.logger.error(f"Error in get_duplicates: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+
     @app.route('/api/album/scan', methods=['POST'])
     def scan_album():
         """扫描相册更新"""
         album = get_album_instance()
         try:
-            ret = album.database.update_db()
+            data = request.get_json(silent=True) or {}
+            ret = album.database.update_db(full=bool(data.get('full')))
             if ret is not None:
                 msg = f"update {ret} images"
             else:
@@ -477,7 +1019,9 @@ def create_app(config_name='default'):
                 'root_path': album.database.root_path,
                 'dump_path': album.database.dump_path,
                 'max_results': app.config['MAX_RESULTS'],
-                'default_threshold': app.config['DEFAULT_THRESHOLD']
+                'default_threshold': app.config['DEFAULT_THRESHOLD'],
+                'score_mode': album.score_mode,
+                'search_backend': 'ivf' if album.index.ann is not None else 'exact'
             }
         })
     
@@ -502,10 +1046,19 @@ def create_app(config_name='default'):
                 'endpoints': {
                     'health': '/api/health',
                     'random_images': '/api/images/random',
+                    'walk': '/api/images/walk',
                     'text_search': '/api/images/search/text',
                     'image_search': '/api/images/search/image',
+                    'similar_search': '/api/images/search/similar',
+                    'batch_search': '/api/images/search/batch',
+                    'compose_search': '/api/images/search/compose',
+                    'search_page': '/api/images/search/page',
+                    'facets': '/api/images/facets',
                     'stats': '/api/images/stats',
                     'scan_album': '/api/album/scan',
+                    'duplicates': '/api/duplicates',
+                    'auto_albums': '/api/albums',
+                    'ann_recall': '/api/index/recall',
                     'config': '/api/config',
                     'open_folder': '/api/images/open-folder'
                 }
@@ -0,0 +1,47 @@
+"""建库流水线基准测试：对比不同批大小下的图片特征提取吞吐量
+
+用法（在 backend 目录下运行）:
+    python -m benchmarks.bench_indexing <图片目录> [图片数] [解码线程数] [解码进程数]
+"""
+import sys
+import time
+import functools
+import torch
+from PIL import Image
+
+from models.model import get_model
+from models.database import load_image
+from models.pipeline import EmbeddingPipeline
+from models.utils import glob_all_images, get_device
+
+BATCH_SIZES = [1, 16, 32, 64, 128]
+
+
+def main():
+    root_path = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    processes = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+    paths = glob_all_images(root_path)[:count]
+    device = get_device()
+    model, preprocess = get_model(device)
+
+    load = functools.partial(load_image, preprocess=preprocess)
+    sample_shape = preprocess(Image.new('RGB', (256, 256))).shape
+
+    def encode(batch):
+        with torch.no_grad():
+            return model.encode_image(batch.to(device)).float().cpu()
+
+    print(f"images={len(paths)}, device={device}, decode_workers={workers}, decode_processes={processes}")
+    print(f"{'batch':>6} | {'images/s':>9}")
+    for batch_size in BATCH_SIZES:
+        pipeline = EmbeddingPipeline(load, encode, batch_size=batch_size, workers=workers,
+                                     processes=processes, sample_shape=sample_shape)
+        start_time = time.perf_counter()
+        done = sum(len(batch_paths) for batch_paths, _, _ in pipeline.run(paths))
+        print(f"{batch_size:>6} | {done / (time.perf_counter() - start_time):>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""分片并行扫描基准测试：对比单次矩阵乘与分片扫描在并发请求下的延迟
+
+用法（在 backend 目录下运行）:
+    python -m benchmarks.bench_scan [分片大小] [扫描线程数]
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import torch
+
+from models.index import SearchIndex
+from models.scan import ShardedScanner, DEFAULT_SHARD_SIZE
+
+N = 1_000_000
+DIM = 512
+K = 50
+CONCURRENCY = [1, 4, 16]
+REQUESTS = 32
+
+
+def latencies(index, queries, concurrency):
+    def one(query):
+        start_time = time.perf_counter()
+        index.search(query, K)
+        return (time.perf_counter() - start_time) * 1000
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        result = sorted(pool.map(one, queries))
+    return result[len(result) // 2], result[int(len(result) * 0.95) - 1]
+
+
+def main():
+    shard_size = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SHARD_SIZE
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    torch.manual_seed(0)
+    features = torch.nn.functional.normalize(torch.randn(N, DIM), dim=-1)
+    paths = [str(i) for i in range(N)]
+    queries = [torch.nn.functional.normalize(torch.randn(1, DIM), dim=-1) for _ in range(REQUESTS)]
+
+    single = SearchIndex(features, paths, normalized=True)
+    rows = [('single', c, *latencies(single, queries, c)) for c in CONCURRENCY]
+
+    scanner = ShardedScanner(shard_size, workers)
+    sharded = SearchIndex(features, paths, normalized=True, scanner=scanner)
+    rows += [('sharded', c, *latencies(sharded, queries, c)) for c in CONCURRENCY]
+
+    print(f"N={N}, dim={DIM}, k={K}, shard_size={scanner.shard_size}, workers={scanner.workers}, "
+          f"intra_op_threads={scanner.intra_op_threads}")
+    print(f"{'mode':>8} | {'concurrency':>11} | {'p50 (ms)':>9} | {'p95 (ms)':>9}")
+    for mode, concurrency, p50, p95 in rows:
+        print(f"{mode:>8} | {concurrency:>11} | {p50:>9.2f} | {p95:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
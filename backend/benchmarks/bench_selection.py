@@ -0,0 +1,61 @@
+"""top-k选择基准测试：对比 argsort 全排序与部分选择、分块流式选择，以及分片扫描时的堆合并
+
+用法（在 backend 目录下运行）:
+    python -m benchmarks.bench_selection
+"""
+import time
+import torch
+
+from models import selection
+
+SIZES = [10_000, 100_000, 1_000_000]
+K = 50
+SHARD_SIZE = 65536
+REPEAT = 5
+
+
+def timeit(func, repeat=REPEAT):
+    func()
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start_time) / repeat * 1000
+
+
+def legacy_topk(probs, k):
+    return torch.argsort(probs, dim=-1, descending=True)[0][:k]
+
+
+def sharded_topk(scores, k, shard_size=SHARD_SIZE):
+    """与 ShardedScanner 相同：各分片局部top-k，再用堆合并"""
+    shards = [selection.topk(scores[:, start:start + shard_size], k)
+              for start in range(0, scores.shape[-1], shard_size)]
+    starts = range(0, scores.shape[-1], shard_size)
+    return selection.merge_topk([values for values, _ in shards],
+                                [indices + start for (_, indices), start in zip(shards, starts)], k)
+
+
+def main():
+    torch.manual_seed(0)
+    print(f"{'N':>10} | {'argsort top-k':>14} | {'topk':>8} | {'chunked':>8} | {'sharded':>8}  (ms)")
+    for n in SIZES:
+        db_features = torch.nn.functional.normalize(torch.randn(n, 512), dim=-1)
+        query = torch.nn.functional.normalize(torch.randn(1, 512), dim=-1)
+        scores = query @ db_features.T
+
+        row = [
+            timeit(lambda: legacy_topk(scores, K)),
+            timeit(lambda: selection.topk(scores, K)),
+            timeit(lambda: selection.chunked_topk(lambda start, end: scores[:, start:end], n, K, SHARD_SIZE)),
+            timeit(lambda: sharded_topk(scores, K)),
+        ]
+        print(f"{n:>10} | {row[0]:>14.2f} | {row[1]:>8.2f} | {row[2]:>8.2f} | {row[3]:>8.2f}")
+
+        assert torch.equal(selection.topk(scores, K)[1][0], legacy_topk(scores, K))
+        assert torch.equal(sharded_topk(scores, K)[1][0], legacy_topk(scores, K))
+        assert torch.equal(selection.chunked_topk(lambda start, end: scores[:, start:end], n, K, SHARD_SIZE)[1][0],
+                           legacy_topk(scores, K))
+
+
+if __name__ == "__main__":
+    main()
@@ -29,6 +29,37 @@ class Config:
     DUMP_PATH = os.environ.get('DUMP_PATH', 'db.pt')
     BACKUP_PATH = os.environ.get('BACKUP_PATH', 'backup')
     ALBUM_LANGUAGE = os.environ.get("ALBUM_LANG", "en")
+    # 建库流水线: 每次前向计算的图片数与解码队列容量（0 表示批大小的4倍）
+    INDEX_BATCH_SIZE = int(os.environ.get('INDEX_BATCH_SIZE', 64))
+    INDEX_QUEUE_SIZE = int(os.environ.get('INDEX_QUEUE_SIZE', 0))
+    # 解码进程数，与 MAX_WORKERS（上限为8）无关，0 表示在线程中解码
+    INDEX_DECODE_PROCESSES = int(os.environ.get('INDEX_DECODE_PROCESSES', 0))
+    # 扫描图片目录时并行遍历子目录的线程数
+    WALK_WORKERS = int(os.environ.get('WALK_WORKERS', 8))
+    # 目录监视: off/auto/inotify/poll，轮询间隔（秒）与合并连续事件的等待时长（秒）
+    WATCH_MODE = os.environ.get('WATCH_MODE', 'off')
+    WATCH_POLL_INTERVAL = float(os.environ.get('WATCH_POLL_INTERVAL', 5))
+    WATCH_DEBOUNCE = float(os.environ.get('WATCH_DEBOUNCE', 1.0))
+    # 变更日志: 超过特征库大小的该比例、且不小于 JOURNAL_COMPACT_MIN_MB 时在后台合并
+    JOURNAL_COMPACT_RATIO = float(os.environ.get('JOURNAL_COMPACT_RATIO', 0.5))
+    JOURNAL_COMPACT_MIN_MB = float(os.environ.get('JOURNAL_COMPACT_MIN_MB', 64))
+    # 共享推理服务: 每次前向计算最多合并的样本数、等待合并的最长时间（毫秒）；
+    # INFERENCE_THREADS 为进程的算子内线程数，启动时设置一次，推理与分片扫描共用（0 表示PyTorch默认值）
+    INFERENCE_MAX_BATCH = int(os.environ.get('INFERENCE_MAX_BATCH', 64))
+    INFERENCE_MAX_DELAY_MS = float(os.environ.get('INFERENCE_MAX_DELAY_MS', 5))
+    INFERENCE_THREADS = int(os.environ.get('INFERENCE_THREADS', 0))
+
+    # 检索后端配置: exact 为暴力检索, ivf 为倒排索引近似检索（可选PQ压缩）
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'exact')
+    ANN_NLIST = int(os.environ.get('ANN_NLIST', 1024))
+    ANN_NPROBE = int(os.environ.get('ANN_NPROBE', 32))
+    ANN_PQ_M = int(os.environ.get('ANN_PQ_M', 0))  # 0 表示不压缩残差
+    ANN_MIN_SIZE = int(os.environ.get('ANN_MIN_SIZE', 20000))  # 少于该数量时仍使用精确检索
+    # 常驻内存的特征精度: fp32 / fp16 / int8，压缩时候选结果会用磁盘上的原始特征重新打分
+    FEATURE_PRECISION = os.environ.get('FEATURE_PRECISION', 'fp32')
+    # 分片并行扫描: 每个分片的行数与扫描线程数（0 表示 CPU核数 / INFERENCE_THREADS 设置的算子内线程数）
+    SCAN_SHARD_SIZE = int(os.environ.get('SCAN_SHARD_SIZE', 65536))
+    SCAN_WORKERS = int(os.environ.get('SCAN_WORKERS', 0))
     
     # HuggingFace镜像配置
     HF_ENDPOINT = os.environ.get('HF_ENDPOINT', 'https://hf-mirror.com')
@@ -38,6 +69,32 @@ class Config:
     API_VERSION = 'v1.3'
     MAX_RESULTS = int(os.environ.get('MAX_RESULTS', 50))
     DEFAULT_THRESHOLD = float(os.environ.get('DEFAULT_THRESHOLD', 0.))
+    # 分数模式: softmax 为全库softmax概率，cosine 为余弦相似度（阈值不随相册大小变化）
+    SCORE_MODE = os.environ.get('SCORE_MODE', 'softmax')
+    MAX_BATCH_QUERIES = int(os.environ.get('MAX_BATCH_QUERIES', 4096))
+    MAX_COMPOSE_TERMS = int(os.environ.get('MAX_COMPOSE_TERMS', 32))
+    # 分页检索: 首次检索保存的候选数、游标有效期（秒）和最多同时保存的游标数
+    SEARCH_CURSOR_DEPTH = int(os.environ.get('SEARCH_CURSOR_DEPTH', 2000))
+    SEARCH_CURSOR_TTL = int(os.environ.get('SEARCH_CURSOR_TTL', 600))
+    SEARCH_MAX_CURSORS = int(os.environ.get('SEARCH_MAX_CURSORS', 1000))
+
+    # 近似重复检测: 余弦相似度阈值与分块自相似度计算的块大小
+    DUPLICATE_THRESHOLD = float(os.environ.get('DUPLICATE_THRESHOLD', 0.95))
+    DUPLICATE_BLOCK_SIZE = int(os.environ.get('DUPLICATE_BLOCK_SIZE', 4096))
+    # k近邻图: 每张图片保存的近邻数（0 表示不构建）与构建时分块计算的块大小
+    KNN_K = int(os.environ.get('KNN_K', 0))
+    KNN_BLOCK_SIZE = int(os.environ.get('KNN_BLOCK_SIZE', 4096))
+    # 自动相册: 聚类数（0 表示不构建）与 mini-batch k-means 每批的图片数
+    AUTO_ALBUM_CLUSTERS = int(os.environ.get('AUTO_ALBUM_CLUSTERS', 0))
+    AUTO_ALBUM_BATCH_SIZE = int(os.environ.get('AUTO_ALBUM_BATCH_SIZE', 1024))
+    # 检索粗路由: 每个查询只扫描最相关的若干个自动相册，0 表示扫描全库
+    SEARCH_ROUTE_CLUSTERS = int(os.environ.get('SEARCH_ROUTE_CLUSTERS', 0))
+
+    # 文本特征缓存配置
+    TEXT_CACHE_SIZE = int(os.environ.get('TEXT_CACHE_SIZE', 10000))
+    TEXT_CACHE_PERSIST = os.environ.get('TEXT_CACHE_PERSIST', 'True').lower() == 'true'
+    # 上传图片特征缓存条数（按内容指纹）
+    IMAGE_CACHE_SIZE = int(os.environ.get('IMAGE_CACHE_SIZE', 2000))
     
     @staticmethod
     def init_app(app):
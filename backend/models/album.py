@@ -1,100 +1,404 @@
 import os
+import io
 import random
+from PIL import Image
 import torch
 from loguru import logger
 
-from models.utils import get_indices_by_threshold, get_topk_indices, get_device
-from models.model import get_model, get_tokenizer
+from models.utils import get_device
+from models.model import get_model_name
 from models.database import get_database, DataBase
+from models.index import SearchIndex, SCORE_MODES
+from models.cache import EmbeddingCache, normalize_query
+from models.fingerprint import fingerprint_bytes
+from models.cursor import CursorStore
+from models.duplicates import DuplicateFinder
+from models.settings import AlbumSettings
+
+# 批量检索时每次参与矩阵乘的查询数，限制 [Q, N] 相似度矩阵的临时内存
+SEARCH_QUERY_BLOCK = 64
+# 批量编码时每次前向计算的最大样本数
+ENCODE_BATCH_SIZE = 256
 
 
 class Album:
-    def __init__(self, root_path, dump_path=None, backup_path="backup", max_workers=4, lang="en"):
+    def __init__(self, root_path, dump_path=None, backup_path="backup", max_workers=4, lang="en", settings=None):
+        settings = settings or AlbumSettings()
         self.database: DataBase = get_database(
             root_path=root_path,
             dump_path=dump_path,
             backup_path= backup_path,
             max_workers=max_workers,
-            lang=lang
+            lang=lang,
+            settings=settings,
         )
-        self.db_paths = self.database.get_paths()
-        self.db_features = self.database.get_features()
 
         self.device = get_device()
         logger.info(f"使用设备: {self.device}")
 
-        self.model, self.preprocess = get_model(self.device, lang=lang)
-        self.tokenizer = get_tokenizer(lang=lang)
-    
-    def query_clip_features(self, query_feature: torch.Tensor):
-        """查询特征相似度"""
-        query_feature /= query_feature.norm(dim=-1, keepdim=True)
-        # 使用归一化的数据库特征
-        db_features_norm = self.db_features / self.db_features.norm(dim=-1, keepdim=True)
-        similarity = query_feature @ db_features_norm.T
-    
-        probs = (100.0 * similarity).softmax(dim=-1)
-        return probs
+        # 与建库共用数据库的推理服务，并发的查询会被合并为同一批前向计算
+        self.inference = self.database.inference
+        self.preprocess = self.inference.preprocess
+
+        # 文本特征缓存，键为 (模型, 语言, 规范化后的查询文本)
+        self.lang = lang
+        self.model_name = get_model_name(lang)
+        cache_path = None
+        if settings.text_cache_persist and dump_path:
+            cache_path = os.path.splitext(dump_path)[0] + '.textcache.pt'
+        self.text_cache = EmbeddingCache(max_size=settings.text_cache_size, persist_path=cache_path)
+        # 上传图片特征缓存，键为 (模型, 内容指纹)；与相册中文件内容相同时直接复用已存储的特征
+        self.image_cache = EmbeddingCache(max_size=settings.image_cache_size)
+        self.image_album_hits = 0
+        # 分页检索游标：首次检索保存前 cursor_depth 个候选，翻页时不再重新编码和扫描
+        self.cursor_depth = settings.search_cursor_depth
+        self.cursors = CursorStore(max_size=settings.search_max_cursors, ttl=settings.search_cursor_ttl)
+        # 默认分数模式（softmax / cosine），单次检索可以覆盖
+        if settings.score_mode not in SCORE_MODES:
+            raise ValueError(f"Unsupported score mode: {settings.score_mode}")
+        self.score_mode = settings.score_mode
+        # 近似重复检测任务，结果和检查点保存在数据库文件旁边
+        self.duplicates = DuplicateFinder(dump_path or 'db.pt', settings.duplicate_threshold,
+                                           settings.duplicate_block_size)
+        # 大于 0 时检索只在最相关的 route_clusters 个自动相册上计算相似度
+        self.route_clusters = settings.search_route_clusters
+
+    @property
+    def index(self) -> SearchIndex:
+        return self.database.get_search_index()
+
+    @property
+    def db_paths(self):
+        return self.index.paths
+
+    @property
+    def db_features(self):
+        return self.index.features
     
-    def get_feature_search_result(self, features, k=20, threshold=0.0):
-        probs = self.query_clip_features(features)
-        
-        # 获取结果
-        if threshold > 0:
-            indices = get_indices_by_threshold(probs, threshold)
-            k = min(len(indices), k)
-            indices = indices[:k]
-        else:
-            indices = get_topk_indices(probs, k)
-        
-        # 返回结果
-        paths = [self.db_paths[i] for i in indices if i < len(self.db_paths)]
-        scores = [probs[0][i].item() for i in indices if i < len(self.db_paths)]
-        return paths, scores
+    def get_feature_search_result(self, features, k=20, threshold=0.0, index=None, filters=None, score_mode=None):
+        """单个查询的检索结果（只取第一行特征）"""
+        return self.get_feature_search_results(features[:1], k, threshold, index, filters, score_mode)[0]
+
+    def get_feature_search_results(self, features, k=20, threshold=0.0, index=None, filters=None, score_mode=None):
+        """批量检索，返回每个查询的 (paths, scores) 列表
+
+        filters 为元数据过滤条件（见 MetadataIndex.filter），只在符合条件的图片上计算相似度；
+        score_mode 为空时使用相册默认的分数模式。
+        """
+        # 固定本次查询使用的索引版本，避免路径与特征不一致
+        if index is None:
+            index = self.index
+        rows = index.filter_rows(filters)
+        score_mode = score_mode or self.score_mode
+        results = []
+        for start in range(0, len(features), SEARCH_QUERY_BLOCK):
+            probs, indices = index.search(features[start:start + SEARCH_QUERY_BLOCK], k, threshold, rows, score_mode,
+                                          route=self.route_clusters)
+            for row_probs, row_indices in zip(probs.tolist(), indices.tolist()):
+                results.append(self.to_paths(index, row_probs, row_indices))
+        return results
+
+    def encode_texts(self, queries):
+        """批量编码文本，返回 [Q, D] 归一化特征；命中缓存的查询不再经过文本编码器"""
+        keys = [(self.model_name, self.lang, normalize_query(q)) for q in queries]
+        features = [self.text_cache.get(key) for key in keys]
+
+        # 同一批次中重复的查询只编码一次
+        missing = list(dict.fromkeys(key for key, feature in zip(keys, features) if feature is None))
+        encoded = {}
+        for start in range(0, len(missing), ENCODE_BATCH_SIZE):
+            batch = missing[start:start + ENCODE_BATCH_SIZE]
+            batch_features = self.inference.encode_texts([key[2] for key in batch])
+            batch_features /= batch_features.norm(dim=-1, keepdim=True)
+            for key, feature in zip(batch, batch_features):
+                encoded[key] = feature
+                self.text_cache.put(key, feature)
+
+        features = [feature if feature is not None else encoded[key] for key, feature in zip(keys, features)]
+        return torch.stack(features)
+
+    def encode_images(self, images):
+        """批量编码图像，返回 [Q, D] 特征"""
+        features = []
+        for start in range(0, len(images), ENCODE_BATCH_SIZE):
+            image_tensor = torch.stack([self.preprocess(image) for image in images[start:start + ENCODE_BATCH_SIZE]])
+            features.append(self.inference.encode_images(image_tensor))
+        return torch.cat(features)
     
-    def text_search(self, queries, k=20, threshold=0.0):
-        """文本搜索"""
+    def text_search(self, queries, k=20, threshold=0.0, filters=None, score_mode=None):
+        """文本搜索（多个查询时只返回第一个查询的结果，批量检索请使用 batch_search）"""
         try:
             # 编码文本
-            text_tokens = self.tokenizer(queries)
-            with torch.no_grad():
-                text_features = self.model.encode_text(text_tokens)
-            paths, scores = self.get_feature_search_result(text_features, k, threshold)
+            text_features = self.encode_texts(queries[:1])
+            paths, scores = self.get_feature_search_result(text_features, k, threshold,
+                                                           filters=filters, score_mode=score_mode)
             return paths, scores
+        except ValueError:
+            raise
         except Exception as e:
             logger.error(f"Error in text search: {e}")
             return [], []
     
-    def image_search(self, image, k=20, threshold=0.0):
-        """图像搜索"""
+    def encode_image_data(self, image_data):
+        """批量编码上传的图片原始字节，返回 [Q, D] 归一化特征
+
+        依次查找上传缓存和相册中内容相同的图片，都未命中时才解码并经过图像编码器。
+        """
+        index = self.index
+        keys = [(self.model_name, fingerprint_bytes(data)) for data in image_data]
+        features = [self.image_cache.get(key) for key in keys]
+
+        missing = {}
+        for i, (key, feature) in enumerate(zip(keys, features)):
+            if feature is not None:
+                continue
+            path = self.database.get_path_by_fingerprint(key[1])
+            stored, _ = index.get_feature(path=path) if path is not None else (None, -1)
+            if stored is not None:
+                features[i] = stored
+                self.image_album_hits += 1
+                self.image_cache.put(key, stored)
+            else:
+                missing.setdefault(key, i)
+
+        if missing:
+            images = []
+            for i in missing.values():
+                image = Image.open(io.BytesIO(image_data[i]))
+                images.append(image.convert('RGB') if image.mode != 'RGB' else image)
+            encoded = self.encode_images(images)
+            encoded /= encoded.norm(dim=-1, keepdim=True)
+            for key, feature in zip(missing, encoded):
+                self.image_cache.put(key, feature)
+            encoded = dict(zip(missing, encoded))
+            features = [feature if feature is not None else encoded[key] for key, feature in zip(keys, features)]
+        return torch.stack(features)
+
+    def image_search_data(self, image_data, k=20, threshold=0.0, filters=None, score_mode=None):
+        """以上传图片的原始字节搜索，重复上传的图片不会重复编码"""
         try:
-            # 提取图像特征
-            image_tensor = self.preprocess(image).unsqueeze(0)
-            with torch.no_grad():
-                image_features = self.model.encode_image(image_tensor)
-            paths, scores = self.get_feature_search_result(image_features, k, threshold)
+            image_features = self.encode_image_data([image_data])
+            paths, scores = self.get_feature_search_result(image_features, k, threshold,
+                                                           filters=filters, score_mode=score_mode)
             return paths, scores
+        except ValueError:
+            raise
         except Exception as e:
             logger.error(f"Error in image search: {e}")
             return [], []
+
+    def similar_search(self, path=None, index=None, k=20, threshold=0.0, filters=None, score_mode=None):
+        """以相册中已索引的图片检索相似图片，直接使用已存储的特征，无需重新编码
+
+        没有过滤条件且k不超过近邻图容量时直接从k近邻图读取结果，不扫描全库。图片不在索引中时返回 None。
+        """
+        search_index = self.index
+        feature, row = search_index.get_feature(path=path, index=index)
+        if feature is None:
+            return None
+        if not filters:
+            result = search_index.neighbors(row, k, threshold, score_mode or self.score_mode)
+            if result is not None:
+                scores, indices = result
+                return self.to_paths(search_index, scores[0].tolist(), indices[0].tolist())
+        return self.get_feature_search_result(feature.unsqueeze(0), k, threshold, index=search_index,
+                                              filters=filters, score_mode=score_mode)
+
+    def walk(self, path=None, index=None, count=12, exclude=()):
+        """随机漫游的一步：返回图片的近邻 (paths, similarities) 和随机选出的下一张图片
+
+        分数为余弦相似度；下一张图片从不在 exclude（已访问过的图片）中的近邻里按相似度加权抽取。
+        有k近邻图时直接查表，否则退化为一次全库扫描。图片不在索引中时返回 None。
+        """
+        search_index = self.index
+        feature, row = search_index.get_feature(path=path, index=index)
+        if feature is None:
+            return None
+        result = search_index.neighbors(row, count + 1, score_mode='cosine')
+        if result is None:
+            result = search_index.search(feature.unsqueeze(0), count + 1, score_mode='cosine')
+        scores, indices = result
+        # 去掉自身
+        neighbors = [(i, s) for i, s in zip(indices[0].tolist(), scores[0].tolist()) if i >= 0 and i != row]
+        paths, similarities = self.to_paths(search_index, [s for _, s in neighbors[:count]],
+                                            [i for i, _ in neighbors[:count]])
+
+        exclude = set(exclude)
+        candidates = [(p, s) for p, s in zip(paths, similarities) if p not in exclude] or list(zip(paths, similarities))
+        next_path = None
+        if candidates:
+            weights = [max(s, 0.0) + 1e-6 for _, s in candidates]
+            next_path = random.choices([p for p, _ in candidates], weights=weights)[0]
+        return paths, similarities, next_path
+
+    @staticmethod
+    def to_paths(search_index, scores, indices):
+        """将行号转换为路径，跳过无效位置"""
+        paths, kept = [], []
+        for score, i in zip(scores, indices):
+            if 0 <= i < len(search_index.paths):
+                paths.append(search_index.paths[i])
+                kept.append(score)
+        return paths, kept
+
+    def batch_search(self, queries=(), image_data=(), k=20, threshold=0.0, filters=None, score_mode=None):
+        """批量检索：文本和图像各做一次批量编码，再与索引做一次矩阵乘
+
+        image_data 为上传图片的原始字节。返回的结果按先文本后图像的顺序与输入一一对应。
+        """
+        features = []
+        if queries:
+            features.append(self.encode_texts(list(queries)))
+        if image_data:
+            features.append(self.encode_image_data(list(image_data)))
+        if not features:
+            return []
+        return self.get_feature_search_results(torch.cat(features), k, threshold, filters=filters, score_mode=score_mode)
     
+    def compose_query(self, terms, image_data=()):
+        """将加权的文本和图片条件合成为一个查询向量
+
+        terms 中每项包含 text / path / index / image 之一以及可选的 weight（默认1，负数表示排除），
+        image 为 image_data 中上传图片的下标。各条件特征均已归一化，加权和与逐项余弦相似度加权求和的排序一致，
+        因此只需对全库扫描一次。文本和上传图片分别批量编码。
+        """
+        if not terms:
+            raise ValueError('At least one term is required')
+        index = self.index
+        texts, images, stored, weights = [], [], [], []
+        for term in terms:
+            if not isinstance(term, dict):
+                raise ValueError('Each term must be an object')
+            weight = float(term.get('weight', 1.0))
+            if 'text' in term:
+                texts.append((str(term['text']), weight))
+            elif 'image' in term:
+                i = int(term['image'])
+                if not 0 <= i < len(image_data):
+                    raise ValueError(f"Image term refers to missing upload {i}")
+                images.append((image_data[i], weight))
+            elif 'path' in term or 'index' in term:
+                feature, _ = index.get_feature(path=term.get('path'), index=term.get('index'))
+                if feature is None:
+                    raise ValueError(f"Image is not indexed: {term.get('path', term.get('index'))}")
+                stored.append(feature)
+                weights.append(weight)
+            else:
+                raise ValueError('Each term needs one of text, image, path or index')
+
+        features = list(stored)
+        if texts:
+            features.extend(self.encode_texts([text for text, _ in texts]))
+            weights.extend(weight for _, weight in texts)
+        if images:
+            features.extend(self.encode_image_data([data for data, _ in images]))
+            weights.extend(weight for _, weight in images)
+        features = torch.stack([feature.to(torch.float32) for feature in features])
+        query = (torch.tensor(weights).unsqueeze(-1) * features).sum(dim=0)
+        if query.norm() < 1e-6:
+            raise ValueError('Terms cancel out, the combined query is empty')
+        return query / query.norm()
+
+    def compose_search(self, terms, image_data=(), k=20, threshold=0.0, filters=None, score_mode=None):
+        """组合检索：多个加权的正负文本、图片条件合成一次检索"""
+        query = self.compose_query(terms, image_data)
+        return self.get_feature_search_result(query.unsqueeze(0), k, threshold,
+                                              filters=filters, score_mode=score_mode)
+
+    def compose_search_cursor(self, terms, image_data=(), threshold=0.0, filters=None, score_mode=None):
+        """分页组合检索，返回 (游标ID, 候选总数)"""
+        return self.open_cursor(self.compose_query(terms, image_data).unsqueeze(0), threshold, filters, score_mode)
+
+    def open_cursor(self, features, threshold=0.0, filters=None, score_mode=None):
+        """检索前 cursor_depth 个候选并保存为游标，返回 (游标ID, 候选总数)"""
+        index = self.index
+        paths, scores = self.get_feature_search_result(features, self.cursor_depth, threshold, index, filters, score_mode)
+        return self.cursors.create(paths, scores, index.version), len(paths)
+
+    def get_page(self, cursor_id, offset=0, limit=20):
+        """读取游标的一页结果，返回 (paths, scores, total)
+
+        游标不存在、已过期或索引版本已变化时返回 None，调用方应重新检索。
+        """
+        cursor = self.cursors.get(cursor_id)
+        if cursor is None or cursor.index_version != self.index.version:
+            return None
+        paths, scores = cursor.page(max(offset, 0), max(limit, 0))
+        return paths, scores, len(cursor)
+
+    def text_search_cursor(self, query, threshold=0.0, filters=None, score_mode=None):
+        """分页文本搜索，返回 (游标ID, 候选总数)"""
+        return self.open_cursor(self.encode_texts([query]), threshold, filters, score_mode)
+
+    def image_search_cursor(self, image_data, threshold=0.0, filters=None, score_mode=None):
+        """以上传图片的原始字节分页搜索，返回 (游标ID, 候选总数)"""
+        return self.open_cursor(self.encode_image_data([image_data]), threshold, filters, score_mode)
+
+    def similar_search_cursor(self, path=None, index=None, threshold=0.0, filters=None, score_mode=None):
+        """以相册中已索引的图片分页搜索，图片不在索引中时返回 None"""
+        feature, _ = self.index.get_feature(path=path, index=index)
+        if feature is None:
+            return None
+        return self.open_cursor(feature.unsqueeze(0), threshold, filters, score_mode)
+
+    def get_facets(self):
+        """可用于过滤的目录和扩展名"""
+        index = self.index
+        if index.metadata is None:
+            return {'folders': {}, 'extensions': {}}
+        return index.metadata.facets()
+
+    def find_duplicates(self, threshold=None, block_size=None):
+        """在后台启动近似重复检测（使用已存储的特征），已有任务在运行时返回 False"""
+        return self.duplicates.start(self.index, threshold, block_size)
+
+    def get_duplicates(self, offset=0, limit=20):
+        """获取重复检测状态和分页的重复组，返回 (status, clusters, total)"""
+        index = self.index
+        status = self.duplicates.status(index.version)
+        # 结果过期时去掉已从相册删除的图片
+        valid_paths = index.path_to_index if status.get('stale') else None
+        clusters, total = self.duplicates.get_clusters(offset, limit, valid_paths)
+        return status, clusters, total
+
+    def get_auto_albums(self, representatives=4):
+        """自动相册列表，返回 [(相册ID, 图片数, 封面路径列表)]，按图片数从多到少排列"""
+        index = self.index
+        if index.clusters is None:
+            return []
+        return [(cluster, size, [index.paths[i] for i in index.clusters.members(cluster)[:representatives]])
+                for cluster, size in index.clusters.summary()]
+
+    def get_auto_album(self, cluster, offset=0, limit=20):
+        """分页获取自动相册中的图片，按与聚类中心的相似度排列，返回 (paths, sims, total)；相册不存在时返回 None"""
+        index = self.index
+        if index.clusters is None:
+            return None
+        members = index.clusters.members(cluster)
+        if members is None:
+            return None
+        rows = members[offset:offset + limit]
+        return [index.paths[i] for i in rows], index.clusters.sims[rows].tolist(), len(members)
+
     def get_random_images(self, count=12):
         """获取随机图片"""
-        if not self.db_paths:
+        db_paths = self.db_paths
+        if not db_paths:
             return [], []
         
-        random_paths = random.sample(self.db_paths, min(count, len(self.db_paths)))
+        random_paths = random.sample(db_paths, min(count, len(db_paths)))
         return random_paths
     
     def get_stats(self):
         """获取统计信息"""
-        total_images = len(self.db_paths)
-        feature_count = self.db_features.shape[0] if self.db_features.shape[0] > 0 else 0
-        feature_dim = self.db_features.shape[1] if self.db_features.ndim > 1 else 0
+        index = self.index
+        total_images = len(index.paths)
+        feature_count = index.features.shape[0] if index.features.shape[0] > 0 else 0
+        feature_dim = index.features.shape[1] if index.features.ndim > 1 else 0
         
         # 计算总大小
         total_size = 0
-        for path in self.db_paths:
+        for path in index.paths:
             if os.path.exists(path):
                 try:
                     total_size += os.path.getsize(path)
@@ -107,6 +411,11 @@ class Album:
             'feature_dim': feature_dim,
             'total_size_mb': round(total_size / (1024 * 1024), 1),
             'total_size_gb': round(total_size / (1024 * 1024 * 1024), 1),
+            'index_version': index.version,
+            'text_cache': self.text_cache.stats(),
+            'image_cache': dict(self.image_cache.stats(), album_hits=self.image_album_hits),
+            'inference': self.inference.stats(),
+            'watcher': self.database.watcher.stats() if self.database.watcher is not None else None,
         }
     
 if __name__ == "__main__":
@@ -0,0 +1,290 @@
+import os
+import time
+import torch
+from loguru import logger
+
+from models import selection
+
+# 训练时最多采样的向量数，避免在超大相册上训练过慢
+MAX_TRAIN_SAMPLES = 100_000
+# 每个聚类中心至少需要的训练样本数
+MIN_POINTS_PER_CENTROID = 39
+
+
+def _assign(x, centroids, spherical=True, chunk_size=65536):
+    """将向量分配到最近的聚类中心，返回 (labels, scores)"""
+    labels = torch.empty(len(x), dtype=torch.long)
+    scores = torch.empty(len(x))
+    bias = None if spherical else (centroids * centroids).sum(-1) / 2
+    for start in range(0, len(x), chunk_size):
+        sim = x[start:start + chunk_size] @ centroids.T
+        if bias is not None:
+            sim -= bias
+        scores[start:start + chunk_size], labels[start:start + chunk_size] = sim.max(dim=-1)
+    return labels, scores
+
+
+def kmeans(x, n_clusters, n_iter=20, spherical=True, seed=0):
+    """k-means聚类；spherical=True 时使用内积并归一化聚类中心（适用于已归一化的特征）"""
+    generator = torch.Generator().manual_seed(seed)
+    n_clusters = min(n_clusters, len(x))
+    centroids = x[torch.randperm(len(x), generator=generator)[:n_clusters]].clone()
+
+    for _ in range(n_iter):
+        labels, _ = _assign(x, centroids, spherical)
+        sums = torch.zeros_like(centroids).index_add_(0, labels, x)
+        counts = torch.bincount(labels, minlength=n_clusters)
+
+        # 空簇用随机样本重新初始化
+        empty = counts == 0
+        if empty.any():
+            reseed = torch.randint(len(x), (int(empty.sum()),), generator=generator)
+            sums[empty] = x[reseed]
+            counts[empty] = 1
+
+        centroids = sums / counts.unsqueeze(-1)
+        if spherical:
+            centroids = torch.nn.functional.normalize(centroids, dim=-1)
+    return centroids
+
+
+class ProductQuantizer:
+    """乘积量化：将向量切分为m个子空间，每个子空间用256个码字编码为1字节"""
+    def __init__(self, dim, m=16, n_iter=15):
+        if dim % m != 0:
+            raise ValueError(f"feature dim {dim} is not divisible by pq_m={m}")
+        self.dim = dim
+        self.m = m
+        self.sub_dim = dim // m
+        self.n_iter = n_iter
+        self.codebooks = None  # [m, 256, sub_dim]
+
+    def train(self, x):
+        codebooks = []
+        for j in range(self.m):
+            sub = x[:, j * self.sub_dim:(j + 1) * self.sub_dim].contiguous()
+            codebook = kmeans(sub, 256, n_iter=self.n_iter, spherical=False, seed=j)
+            if len(codebook) < 256:
+                codebook = torch.cat([codebook, codebook.new_zeros(256 - len(codebook), self.sub_dim)])
+            codebooks.append(codebook)
+        self.codebooks = torch.stack(codebooks)
+
+    def encode(self, x):
+        codes = torch.empty(len(x), self.m, dtype=torch.uint8)
+        for j in range(self.m):
+            sub = x[:, j * self.sub_dim:(j + 1) * self.sub_dim]
+            labels, _ = _assign(sub, self.codebooks[j], spherical=False)
+            codes[:, j] = labels.to(torch.uint8)
+        return codes
+
+    def inner_product_table(self, query):
+        """查询向量与各子空间码字的内积表，形状为 [m, 256]"""
+        sub_queries = query.view(self.m, 1, self.sub_dim)
+        return (sub_queries * self.codebooks).sum(-1)
+
+    def score(self, table, codes):
+        """利用内积表计算查询与已编码向量的近似内积"""
+        return table[torch.arange(self.m).unsqueeze(0), codes.long()].sum(-1)
+
+    def state_dict(self):
+        return {'m': self.m, 'codebooks': self.codebooks}
+
+    @classmethod
+    def from_state_dict(cls, dim, state):
+        pq = cls(dim, m=state['m'])
+        pq.codebooks = state['codebooks']
+        return pq
+
+
+class IVFIndex:
+    """倒排文件索引（IVF），可选PQ压缩残差，并对候选集做精确重排
+
+    行号与数据库中的特征行一一对应；数据库追加或删除行时通过 add / remove 增量维护。
+    """
+    def __init__(self, dim, nlist=1024, nprobe=32, pq_m=0, rerank_factor=10):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.rerank_factor = rerank_factor
+
+        self.centroids = None
+        self.pq = None
+        self.list_ids = []
+        self.list_codes = []
+        self.ntotal = 0
+        self.trained_size = 0
+        # 保存时对应的数据库版本，加载时用于判断是否与特征库的当前代一致
+        self.index_version = None
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def train(self, features):
+        """在（采样后的）特征上训练聚类中心和PQ码本"""
+        start_time = time.time()
+        if len(features) > MAX_TRAIN_SAMPLES:
+            sample = features[torch.randperm(len(features))[:MAX_TRAIN_SAMPLES]]
+        else:
+            sample = features[:]
+        nlist = max(1, min(self.nlist, len(sample) // MIN_POINTS_PER_CENTROID))
+        self.centroids = kmeans(sample, nlist)
+        self.list_ids = [torch.empty(0, dtype=torch.long) for _ in range(nlist)]
+        self.list_codes = [torch.empty((0, self.pq_m), dtype=torch.uint8) for _ in range(nlist)]
+        self.ntotal = 0
+        self.trained_size = len(features)
+
+        if self.pq_m > 0:
+            labels, _ = _assign(sample, self.centroids)
+            self.pq = ProductQuantizer(self.dim, m=self.pq_m)
+            self.pq.train(sample - self.centroids[labels])
+        logger.info(f"Trained IVF index with {nlist} lists (pq_m={self.pq_m}) in {time.time() - start_time:.2f}s")
+
+    def add(self, features, start_id=None):
+        """追加特征，行号从 start_id（默认为当前总数）开始连续编号"""
+        if len(features) == 0:
+            return
+        if start_id is None:
+            start_id = self.ntotal
+        features = features.to(torch.float32)
+        labels, _ = _assign(features, self.centroids)
+        ids = torch.arange(start_id, start_id + len(features))
+        codes = self.pq.encode(features - self.centroids[labels]) if self.pq is not None else None
+
+        order = torch.argsort(labels, stable=True)
+        counts = torch.bincount(labels, minlength=len(self.centroids)).tolist()
+        offset = 0
+        for list_no, count in enumerate(counts):
+            if count == 0:
+                continue
+            sel = order[offset:offset + count]
+            offset += count
+            self.list_ids[list_no] = torch.cat([self.list_ids[list_no], ids[sel]])
+            if codes is not None:
+                self.list_codes[list_no] = torch.cat([self.list_codes[list_no], codes[sel]])
+        self.ntotal += len(features)
+
+    def remove(self, indices):
+        """删除若干行，并将剩余行号重新映射为删除后的连续编号"""
+        if len(indices) == 0:
+            return
+        removed = torch.as_tensor(sorted(indices), dtype=torch.long)
+        for list_no, ids in enumerate(self.list_ids):
+            keep = ~torch.isin(ids, removed)
+            ids = ids[keep]
+            self.list_ids[list_no] = ids - torch.searchsorted(removed, ids)
+            if self.pq is not None:
+                self.list_codes[list_no] = self.list_codes[list_no][keep]
+        self.ntotal -= len(removed)
+
+    def needs_retrain(self, ntotal):
+        """数据量相比训练时增长过多时，聚类中心会失衡，需要重新训练"""
+        return not self.is_trained or ntotal > 4 * max(self.trained_size, 1)
+
+    def search(self, query_features, k, features=None, nprobe=None, logit_scale=None):
+        """检索最相似的k行
+
+        返回 (values, indices)，形状为 [Q, k]，不足k个时索引为 -1。
+        传入 features 时对候选集做精确重排；无PQ时必须传入 features。
+        logit_scale 不为空时额外返回每个查询在候选集上的 logsumexp，用于计算softmax概率。
+        """
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        query_features = query_features.to(torch.float32)
+        coarse = query_features @ self.centroids.T
+        _, probes = selection.topk(coarse, nprobe)
+
+        all_values = torch.full((len(query_features), k), float('-inf'))
+        all_indices = torch.full((len(query_features), k), -1, dtype=torch.long)
+        lse = torch.full((len(query_features),), float('-inf'))
+        for qi, query in enumerate(query_features):
+            lists = probes[qi].tolist()
+            ids = torch.cat([self.list_ids[l] for l in lists])
+            if len(ids) == 0:
+                continue
+
+            if self.pq is not None:
+                table = self.pq.inner_product_table(query)
+                base = torch.cat([coarse[qi, l].expand(len(self.list_ids[l])) for l in lists])
+                codes = torch.cat([self.list_codes[l] for l in lists])
+                scores = base + self.pq.score(table, codes)
+                if features is not None:
+                    # 先用近似分数筛出候选，再用原始特征精确重排
+                    _, shortlist = selection.topk(scores, k * self.rerank_factor)
+                    ids = ids[shortlist[0]]
+                    scores = features[ids].to(torch.float32) @ query
+            else:
+                scores = features[ids].to(torch.float32) @ query
+
+            values, order = selection.topk(scores, k)
+            n = values.shape[-1]
+            all_values[qi, :n] = values[0]
+            all_indices[qi, :n] = ids[order[0]]
+            if logit_scale is not None:
+                lse[qi] = torch.logsumexp(logit_scale * scores, dim=-1)
+
+        if logit_scale is not None:
+            return all_values, all_indices, lse
+        return all_values, all_indices
+
+    def save(self, path, index_version=None):
+        torch.save({
+            'index_version': index_version,
+            'dim': self.dim,
+            'nlist': self.nlist,
+            'nprobe': self.nprobe,
+            'pq_m': self.pq_m,
+            'rerank_factor': self.rerank_factor,
+            'centroids': self.centroids,
+            'pq': self.pq.state_dict() if self.pq is not None else None,
+            'list_ids': self.list_ids,
+            'list_codes': self.list_codes,
+            'ntotal': self.ntotal,
+            'trained_size': self.trained_size,
+        }, path)
+        self.index_version = index_version
+        logger.info(f"Saved IVF index to {path}")
+
+    @classmethod
+    def load(cls, path):
+        data = torch.load(path, map_location='cpu')
+        index = cls(data['dim'], nlist=data['nlist'], nprobe=data['nprobe'],
+                    pq_m=data['pq_m'], rerank_factor=data['rerank_factor'])
+        index.centroids = data['centroids']
+        if data['pq'] is not None:
+            index.pq = ProductQuantizer.from_state_dict(data['dim'], data['pq'])
+        index.list_ids = data['list_ids']
+        index.list_codes = data['list_codes']
+        index.ntotal = data['ntotal']
+        index.trained_size = data['trained_size']
+        index.index_version = data.get('index_version')
+        return index
+
+
+def get_ann_path(dump_path):
+    """ANN索引保存在数据库文件旁边"""
+    return os.path.splitext(dump_path)[0] + '.ivf.pt'
+
+
+def evaluate_recall(index, features, k=20, nprobes=(1, 4, 16, 64), n_queries=100, seed=0):
+    """以精确检索为基准评估不同nprobe下的召回率和平均耗时"""
+    generator = torch.Generator().manual_seed(seed)
+    n_queries = min(n_queries, len(features))
+    query_ids = torch.randperm(len(features), generator=generator)[:n_queries]
+    # 在数据库向量上加入少量噪声作为查询，避免查询点自身总排在第一
+    queries = features[query_ids].to(torch.float32)
+    queries = torch.nn.functional.normalize(queries + 0.05 * torch.randn(queries.shape, generator=generator), dim=-1)
+
+    _, truth = selection.topk(queries @ features.to(torch.float32).T, k)
+    report = []
+    for nprobe in nprobes:
+        start_time = time.time()
+        _, found = index.search(queries, k, features=features, nprobe=nprobe)
+        elapsed = (time.time() - start_time) / n_queries * 1000
+        hits = sum(len(set(found[i].tolist()) & set(truth[i].tolist())) for i in range(n_queries))
+        report.append({
+            'nprobe': min(nprobe, len(index.centroids)),
+            'recall': round(hits / (n_queries * truth.shape[-1]), 4),
+            'latency_ms': round(elapsed, 3),
+        })
+    return report
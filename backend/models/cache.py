@@ -0,0 +1,104 @@
+import os
+import atexit
+import threading
+from collections import OrderedDict
+import torch
+from loguru import logger
+
+# 每新增多少条记录自动持久化一次
+PERSIST_EVERY = 200
+
+
+def normalize_query(query):
+    """规范化查询文本：去掉首尾空白、合并连续空白并转为小写（CLIP分词器本身不区分大小写）"""
+    return ' '.join(query.split()).lower()
+
+
+class EmbeddingCache:
+    """线程安全的有界LRU嵌入缓存，可选持久化到磁盘"""
+    def __init__(self, max_size=10000, persist_path=None):
+        self.max_size = max_size
+        self.persist_path = persist_path
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.unsaved = 0
+
+        if persist_path:
+            self.load()
+            atexit.register(self.save)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value.detach().cpu()
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            self.unsaved += 1
+            should_save = self.persist_path and self.unsaved >= PERSIST_EVERY
+        if should_save:
+            self.save()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+    def save(self):
+        if not self.persist_path:
+            return
+        with self.lock:
+            if self.unsaved == 0:
+                return
+            keys = list(self.entries.keys())
+            values = torch.stack(list(self.entries.values())) if keys else torch.empty(0)
+            self.unsaved = 0
+        try:
+            tmp_path = self.persist_path + '.tmp'
+            torch.save({'keys': keys, 'values': values}, tmp_path)
+            os.replace(tmp_path, self.persist_path)
+            logger.debug(f"Saved {len(keys)} cached embeddings to {self.persist_path}")
+        except Exception as e:
+            logger.error(f"Error saving embedding cache: {e}")
+
+    def load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            data = torch.load(self.persist_path, map_location='cpu')
+            with self.lock:
+                # 按保存时的LRU顺序恢复，超出容量时保留最近使用的部分
+                for key, value in list(zip(data['keys'], data['values']))[-self.max_size:]:
+                    self.entries[tuple(key)] = value
+            logger.info(f"Loaded {len(self.entries)} cached embeddings from {self.persist_path}")
+        except Exception as e:
+            logger.error(f"Error loading embedding cache: {e}")
@@ -0,0 +1,184 @@
+import os
+import time
+import threading
+import numpy as np
+import torch
+from loguru import logger
+
+from models import selection
+from models.ann import _assign
+
+# 自动相册（聚类）数
+DEFAULT_CLUSTERS = 64
+# 每个聚类至少包含的平均图片数，相册较小时相应减少聚类数
+MIN_CLUSTER_SIZE = 10
+# mini-batch k-means 每批的图片数与初次训练时遍历全库的次数
+DEFAULT_BATCH_SIZE = 1024
+DEFAULT_EPOCHS = 3
+# 图片数增长到上次训练时的该倍数后重新训练，避免聚类中心失衡
+REFIT_GROWTH = 4
+
+
+def get_clusters_path(dump_path):
+    """自动相册保存在数据库文件旁边"""
+    return os.path.splitext(dump_path)[0] + '.clusters.npz'
+
+
+def partial_fit(centroids, counts, batch):
+    """用一批特征更新聚类中心（每个中心的学习率为 1 / 累计样本数），返回该批的 (labels, sims)"""
+    labels, sims = _assign(batch, centroids)
+    batch_counts = torch.bincount(labels, minlength=len(centroids))
+    sums = torch.zeros_like(centroids).index_add_(0, labels, batch)
+    counts += batch_counts
+    updated = batch_counts > 0
+    eta = (batch_counts[updated] / counts[updated]).unsqueeze(-1)
+    means = sums[updated] / batch_counts[updated].unsqueeze(-1)
+    centroids[updated] += eta * (means - centroids[updated])
+    centroids[updated] = torch.nn.functional.normalize(centroids[updated], dim=-1)
+    return labels, sims
+
+
+def minibatch_kmeans(features, n_clusters, batch_size=DEFAULT_BATCH_SIZE, epochs=DEFAULT_EPOCHS, seed=0):
+    """流式 mini-batch 球面k-means，每次只读取一批特征，返回 (centroids, counts)"""
+    generator = torch.Generator().manual_seed(seed)
+    n = len(features)
+    init = torch.randperm(n, generator=generator)[:n_clusters].sort().values
+    centroids = torch.nn.functional.normalize(features[init].to(torch.float32), dim=-1)
+    counts = torch.zeros(len(centroids), dtype=torch.float32)
+    for _ in range(epochs):
+        order = torch.randperm(n, generator=generator)
+        for start in range(0, n, batch_size):
+            # 排序后的行号对内存映射的特征更友好
+            rows = order[start:start + batch_size].sort().values
+            partial_fit(centroids, counts, features[rows].to(torch.float32))
+    return centroids, counts
+
+
+class AutoAlbums:
+    """基于特征空间聚类的自动相册
+
+    聚类中心由 mini-batch k-means 训练；新增图片按批分配到最近的中心并增量更新中心，无需重新训练，
+    图片数增长过多时才整体重新训练。每张图片记录所属聚类及与中心的相似度，离中心最近的图片作为相册封面。
+    聚类中心同时可作为检索的粗路由层：查询只在最相关的几个聚类上计算相似度。
+    每次修改都返回新的对象，正在使用旧版本的查询不受影响。
+    """
+    def __init__(self, n_clusters=DEFAULT_CLUSTERS, batch_size=DEFAULT_BATCH_SIZE, centroids=None, counts=None,
+                 labels=None, sims=None, fitted_size=0):
+        self.n_clusters = n_clusters
+        self.batch_size = batch_size
+        self.centroids = centroids
+        self.counts = counts
+        self.labels = labels if labels is not None else np.empty(0, dtype=np.int32)
+        self.sims = sims if sims is not None else np.empty(0, dtype=np.float32)
+        self.fitted_size = fitted_size
+        self.index_version = None
+        self.lock = threading.Lock()
+        self.member_order = None
+        self.member_starts = None
+
+    @property
+    def count(self):
+        return len(self.labels)
+
+    def __len__(self):
+        return self.count
+
+    def _copy(self, centroids, counts, labels, sims, fitted_size):
+        return AutoAlbums(self.n_clusters, self.batch_size, centroids, counts, labels, sims, fitted_size)
+
+    def needs_update(self, n):
+        return self.count != n
+
+    def update(self, features):
+        """为 features 中超出当前行数的新行分配聚类并增量更新中心，返回新的对象"""
+        n, start = len(features), self.count
+        if start > n:
+            raise ValueError(f"Auto albums have {start} rows but only {n} features are given")
+        start_time = time.time()
+        if self.centroids is None or n > REFIT_GROWTH * max(self.fitted_size, 1):
+            if n == 0:
+                return self._copy(None, None, np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32), 0)
+            n_clusters = max(1, min(self.n_clusters, n // MIN_CLUSTER_SIZE))
+            centroids, counts = minibatch_kmeans(features, n_clusters, self.batch_size)
+            labels, sims = [], []
+            for row_start in range(0, n, self.batch_size * 16):
+                batch_labels, batch_sims = _assign(features[row_start:row_start + self.batch_size * 16]
+                                                   .to(torch.float32), centroids)
+                labels.append(batch_labels)
+                sims.append(batch_sims)
+            logger.info(f"Trained {n_clusters} auto albums over {n} images in {time.time() - start_time:.2f}s")
+            return self._copy(centroids, counts, torch.cat(labels).numpy().astype(np.int32),
+                              torch.cat(sims).numpy(), n)
+
+        centroids, counts = self.centroids.clone(), self.counts.clone()
+        labels, sims = [self.labels], [self.sims]
+        for row_start in range(start, n, self.batch_size):
+            batch_labels, batch_sims = partial_fit(
+                centroids, counts, features[row_start:row_start + self.batch_size].to(torch.float32))
+            labels.append(batch_labels.numpy().astype(np.int32))
+            sims.append(batch_sims.numpy())
+        logger.info(f"Assigned {n - start} new images to auto albums in {time.time() - start_time:.2f}s")
+        return self._copy(centroids, counts, np.concatenate(labels), np.concatenate(sims), self.fitted_size)
+
+    def remove(self, indices):
+        """删除给定行，返回新的对象；被删除的图片从所属聚类的累计样本数中扣除"""
+        removed = np.zeros(self.count, dtype=bool)
+        removed[np.asarray(indices, dtype=np.int64)] = True
+        counts = None
+        if self.counts is not None:
+            removed_counts = np.bincount(self.labels[removed], minlength=len(self.centroids))
+            counts = (self.counts - torch.from_numpy(removed_counts).float()).clamp_min(1.0)
+        return self._copy(self.centroids, counts, self.labels[~removed], self.sims[~removed], self.fitted_size)
+
+    def build_members(self):
+        """按聚类分组的行号（CSR），组内按与中心的相似度从高到低排列"""
+        with self.lock:
+            if self.member_order is None:
+                n_clusters = len(self.centroids) if self.centroids is not None else 0
+                self.member_order = np.lexsort((-self.sims, self.labels))
+                starts = np.zeros(n_clusters + 1, dtype=np.int64)
+                np.cumsum(np.bincount(self.labels, minlength=n_clusters), out=starts[1:])
+                self.member_starts = starts
+        return self.member_order, self.member_starts
+
+    def members(self, cluster):
+        """聚类中的行号，按与中心的相似度从高到低排列；聚类不存在时返回 None"""
+        order, starts = self.build_members()
+        if not 0 <= cluster < len(starts) - 1:
+            return None
+        return order[starts[cluster]:starts[cluster + 1]]
+
+    def summary(self):
+        """非空聚类的 (聚类ID, 图片数)，按图片数从多到少排列"""
+        _, starts = self.build_members()
+        sizes = np.diff(starts)
+        clusters = [(cluster, int(size)) for cluster, size in enumerate(sizes.tolist()) if size > 0]
+        clusters.sort(key=lambda cluster: -cluster[1])
+        return clusters
+
+    def route(self, query_feature, n_probe):
+        """粗路由：返回与查询最相关的 n_probe 个聚类中的所有行号（有序）"""
+        order, starts = self.build_members()
+        _, probes = selection.topk(query_feature.to(torch.float32) @ self.centroids.T, n_probe)
+        rows = [order[starts[c]:starts[c + 1]] for c in probes[0].tolist()]
+        return np.sort(np.concatenate(rows)) if rows else np.empty(0, dtype=np.int64)
+
+    def save(self, path, index_version):
+        tmp_path = path + '.tmp.npz'
+        centroids = self.centroids.numpy() if self.centroids is not None else np.empty((0, 0), dtype=np.float32)
+        counts = self.counts.numpy() if self.counts is not None else np.empty(0, dtype=np.float32)
+        np.savez(tmp_path, n_clusters=self.n_clusters, index_version=index_version, fitted_size=self.fitted_size,
+                 centroids=centroids, counts=counts, labels=self.labels, sims=self.sims)
+        os.replace(tmp_path, path)
+        self.index_version = index_version
+        logger.info(f"Saved {len(centroids)} auto albums to {path}")
+
+    @classmethod
+    def load(cls, path, batch_size=DEFAULT_BATCH_SIZE):
+        data = np.load(path)
+        centroids = torch.from_numpy(data['centroids']) if len(data['centroids']) > 0 else None
+        counts = torch.from_numpy(data['counts']) if centroids is not None else None
+        albums = cls(int(data['n_clusters']), batch_size, centroids, counts, data['labels'], data['sims'],
+                     int(data['fitted_size']))
+        albums.index_version = int(data['index_version'])
+        return albums
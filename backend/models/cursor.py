@@ -0,0 +1,59 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+
+class SearchCursor:
+    """一次检索的排序候选列表，后续翻页只在列表上切片"""
+    def __init__(self, paths, scores, index_version):
+        self.paths = paths
+        self.scores = scores
+        self.index_version = index_version
+        self.last_access = time.time()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def page(self, offset, limit):
+        return self.paths[offset:offset + limit], self.scores[offset:offset + limit]
+
+
+class CursorStore:
+    """线程安全的检索游标存储，按最近访问淘汰，超过 ttl 秒未访问的游标自动失效"""
+    def __init__(self, max_size=1000, ttl=600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.cursors = OrderedDict()
+
+    def __len__(self):
+        return len(self.cursors)
+
+    def create(self, paths, scores, index_version):
+        """保存候选列表，返回游标ID"""
+        cursor_id = uuid.uuid4().hex
+        with self.lock:
+            self._expire()
+            self.cursors[cursor_id] = SearchCursor(paths, scores, index_version)
+            while len(self.cursors) > self.max_size:
+                self.cursors.popitem(last=False)
+        return cursor_id
+
+    def get(self, cursor_id):
+        """获取游标，不存在或已过期时返回 None"""
+        with self.lock:
+            self._expire()
+            cursor = self.cursors.get(cursor_id)
+            if cursor is not None:
+                cursor.last_access = time.time()
+                self.cursors.move_to_end(cursor_id)
+            return cursor
+
+    def _expire(self):
+        deadline = time.time() - self.ttl
+        while self.cursors:
+            cursor_id, cursor = next(iter(self.cursors.items()))
+            if cursor.last_access >= deadline:
+                break
+            del self.cursors[cursor_id]
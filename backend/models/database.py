@@ -1,42 +1,131 @@
 import os
+import io
 import time
+import numpy as np
 from PIL import Image
-from models.utils import glob_all_images, get_device
+from models.utils import get_device
 import torch
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 import threading
-from contextlib import contextmanager
 from loguru import logger
 import functools
-from models.model import get_model
+from models.inference import get_inference_service
+from models.index import SearchIndex
+from models.ann import IVFIndex, get_ann_path, evaluate_recall
+from models.store import FeatureStore, LiveFeatures, get_store_path, CHUNK_ROWS
+from models.journal import apply_record
+from models.quantize import quantize_features
+from models.scan import get_scanner
+from models.pipeline import EmbeddingPipeline
+from models.knn import KnnGraph, get_knn_path
+from models.walker import DirectoryWalker, get_dir_cache_path
+from models.diff import diff_snapshot, ADDED, REMOVED, MODIFIED
+from models.watcher import FolderWatcher
+from models.clusters import AutoAlbums, get_clusters_path
+from models.metadata import (MetadataIndex, METADATA_FIELDS, METADATA_DTYPES, METADATA_MTIME, METADATA_SIZE,
+                             image_metadata, read_image_metadata)
+from models.fingerprint import fingerprint_bytes, fingerprint_file, DIGEST_SIZE
+from models.settings import AlbumSettings
+
+def load_image(image_path, preprocess):
+    """读取、解码并预处理单张图片，返回 (图像张量, (内容指纹, 元数据))
+
+    定义在模块级别，以便传给解码进程。
+    """
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    image = Image.open(io.BytesIO(data))
+    metadata = image_metadata(image_path, image, len(data))
+    return preprocess(image), (fingerprint_bytes(data), metadata)
+
 
 @functools.lru_cache(maxsize=1)
-def get_database(root_path, dump_path=None, backup_path="backup", max_workers=4, lang="en"):
+def get_database(root_path, dump_path=None, backup_path="backup", max_workers=4, lang="en", settings=None):
     return DataBase(
         root_path=root_path,
         dump_path=dump_path,
         backup_path=backup_path,
         max_workers=max_workers,
         lang=lang,
+        settings=settings,
     )
 
 
 class DataBase:
-    def __init__(self, root_path, dump_path=None, backup_path="backup", max_workers=4, lang="en"):
+    def __init__(self, root_path, dump_path=None, backup_path="backup", max_workers=4, lang="en", settings=None):
+        settings = settings or AlbumSettings()
         self.root_path = root_path
         self.dump_path = dump_path
         self.backup_path = backup_path
         self.set_max_workers(max_workers)
         self.database_lang = lang
+        # 建库时每次前向计算的图片数，以及解码队列的容量（0 表示批大小的4倍）
+        self.index_batch_size = settings.index_batch_size
+        self.index_queue_size = settings.index_queue_size
+        # 解码进程数（不受 max_workers 的上限限制），0 表示在线程中解码
+        self.index_decode_processes = max(0, settings.index_decode_processes)
+        # 单次遍历的目录扫描器，记录各目录的修改时间，未变化的目录在下次扫描时不再重新列出
+        self.walker = DirectoryWalker(workers=settings.walk_workers, cache_path=get_dir_cache_path(self.dump_path))
+        # 目录监视配置，watch_mode 为 off 时只在启动和手动扫描时更新
+        self.watch_mode = settings.watch_mode
+        self.watch_poll_interval = settings.watch_poll_interval
+        self.watch_debounce = settings.watch_debounce
+        self.watcher = None
+        # 变更日志超过特征库大小的该比例（且不小于 journal_compact_min_mb MB）时在后台合并为新的一代
+        self.journal_compact_ratio = settings.journal_compact_ratio
+        self.journal_compact_min_mb = settings.journal_compact_min_mb
+        self.compacting = False
+
+        # 检索后端配置
+        self.search_backend = settings.search_backend
+        self.ann_nlist = settings.ann_nlist
+        self.ann_nprobe = settings.ann_nprobe
+        self.ann_pq_m = settings.ann_pq_m
+        self.ann_min_size = settings.ann_min_size
+        self.ann_index = None
+        self.feature_precision = settings.feature_precision
+        # 与行对齐的压缩特征，随增删增量更新，只在首次构建检索索引时量化全库
+        self.quantized = None
+        self.scan_shard_size = settings.scan_shard_size
+        self.scan_workers = settings.scan_workers
+        # k近邻图配置，knn_k 为 0 时不构建
+        self.knn_k = settings.knn_k
+        self.knn_block_size = settings.knn_block_size
+        self.knn_graph = None
+        # 自动相册（mini-batch k-means 聚类）配置，auto_album_clusters 为 0 时不构建
+        self.auto_album_clusters = settings.auto_album_clusters
+        self.auto_album_batch_size = settings.auto_album_batch_size
+        self.auto_albums = None
 
         self.device = get_device()
         logger.info(f"使用设备: {self.device}")
+        # 算子内线程数是进程级设置，只在这里设置一次；推理服务直接使用，分片扫描器据此确定并发的分片数
+        if settings.inference_threads > 0:
+            torch.set_num_threads(settings.inference_threads)
+        # 与检索共用的推理服务，唯一持有模型
+        self.inference = get_inference_service(self.device, lang, settings.inference_max_batch,
+                                               settings.inference_max_delay_ms)
 
         self.img_paths = []
+        self.path_to_index = {}
+        self.index_to_path = {}
         self.ignore_paths = set()
-        self.db_features = torch.empty(0)
-        self.thread_local = threading.local()
+        # 已写入特征库（含日志）的忽略路径，日志只记录新增的部分
+        self.saved_ignore_paths = set()
+        # 图片内容指纹（路径 -> 16字节摘要），在提取特征时顺带计算
+        self.fingerprints = {}
+        self.fingerprint_to_path = {}
+        # 图片元数据（路径 -> 按 METADATA_FIELDS 排列的元组），用于检索前过滤
+        self.metadata = {}
+        # 与行对齐的元数据列（见 metadata_columns），随每次更新增量维护
+        self.metadata_table = None
+        # 特征库当前代的内存映射特征加上之后的变更，见 LiveFeatures
+        self.db_features = LiveFeatures(torch.empty(0))
+        self.index_version = 0
+        self.search_index = SearchIndex(self.db_features, self.img_paths, self.index_version)
         self.ignore_paths_lock = threading.Lock()
+        # 手动扫描与目录监视不能同时修改数据库
+        self.update_lock = threading.RLock()
 
         self.allow_cleanup_invalid_paths = True
         self.allow_update_new_paths = True
@@ -46,10 +135,20 @@ class DataBase:
             os.makedirs(self.backup_path, exist_ok=True)
         
         # 加载现有数据库
-        if os.path.exists(self.dump_path):
+        if FeatureStore(get_store_path(self.dump_path)).exists() or os.path.exists(self.dump_path):
             self.load_db_features(self.dump_path)
 
-        self.update_db()
+        # 启动时完整检查一次，覆盖停机期间原地修改的文件
+        self.update_db(full=True)
+        # 数据库没有变化时 update_db 不会刷新ANN索引、近邻图和自动相册，首次启用时在这里构建
+        ann_changed = self.refresh_ann_index()
+        knn_changed = self.refresh_knn_graph()
+        albums_changed = self.refresh_auto_albums()
+        if ann_changed or knn_changed or albums_changed:
+            self.rebuild_search_index()
+            self.persist_derived()
+        if self.watch_mode != "off":
+            self.start_watcher()
 
     def get_paths(self):
         return self.img_paths
@@ -57,96 +156,352 @@ class DataBase:
     def get_features(self):
         return self.db_features
 
-    @contextmanager
-    def thread_model(self):
-        """上下文管理器用于线程模型管理"""
-        thread_id = threading.get_ident()
-        if not hasattr(self.thread_local, 'model'):
-            # 初始化线程本地模型
-            model, preprocess = get_model(device=self.device, lang=self.database_lang)
-            self.thread_local.model = model
-            self.thread_local.preprocess = preprocess
-            logger.debug(f"Initialized model for thread {thread_id}")
-        
+    def get_search_index(self):
+        """获取当前版本的检索索引"""
+        return self.search_index
+
+    def rebuild_search_index(self):
+        """根据当前特征重新构建检索索引"""
+        ann = self.ann_index if self.ann_index is not None and self.ann_index.ntotal == len(self.img_paths) else None
+        if ann is not None:
+            # 使用ANN索引时不需要常驻的压缩特征
+            self.quantized = None
+        elif self.quantized is None or len(self.quantized) != len(self.img_paths):
+            # 数据库中的特征在加载和提取时均已归一化
+            self.quantized = quantize_features(self.db_features, self.feature_precision)
+        if self.metadata_table is None or len(self.metadata_table[METADATA_FIELDS[0]]) != len(self.img_paths):
+            self.metadata_table = self.metadata_columns()
+        self.search_index = SearchIndex(self.db_features, self.img_paths, self.index_version,
+                                        ann=ann, quantized=self.quantized, normalized=True,
+                                        scanner=get_scanner(self.scan_shard_size, self.scan_workers),
+                                        metadata=MetadataIndex(self.img_paths, self.metadata_table),
+                                        path_to_index=self.path_to_index,
+                                        knn=self.knn_graph if self.knn_graph is not None
+                                        and not self.knn_graph.needs_update(len(self.img_paths)) else None,
+                                        clusters=self.auto_albums if self.auto_albums is not None
+                                        and self.auto_albums.centroids is not None
+                                        and not self.auto_albums.needs_update(len(self.img_paths)) else None)
+        logger.info(f"Built search index v{self.index_version} with {len(self.search_index)} images"
+                    f"{' (ivf)' if ann is not None else ''}")
+
+    def refresh_ann_index(self):
+        """按需训练或重建ANN索引；相册较小时使用精确检索"""
+        if self.search_backend != "ivf" or len(self.img_paths) < self.ann_min_size:
+            self.ann_index = None
+            return False
+        if self.ann_index is not None and not self.ann_index.needs_retrain(len(self.img_paths)) \
+                and self.ann_index.ntotal == len(self.img_paths):
+            return False
+
+        self.ann_index = IVFIndex(
+            dim=self.db_features.shape[1],
+            nlist=self.ann_nlist,
+            nprobe=self.ann_nprobe,
+            pq_m=self.ann_pq_m,
+        )
+        self.ann_index.train(self.db_features)
+        # 分块添加，避免把内存映射的特征整体读入内存
+        for start in range(0, len(self.db_features), CHUNK_ROWS):
+            self.ann_index.add(self.db_features[start:start + CHUNK_ROWS], start_id=start)
+        return True
+
+    def load_ann_index(self):
+        """加载数据库旁边保存的ANN索引，与数据库版本不一致时丢弃并重新训练"""
+        ann_path = get_ann_path(self.dump_path)
+        if self.search_backend != "ivf" or not os.path.exists(ann_path):
+            return
         try:
-            yield self.thread_local.model, self.thread_local.preprocess
-        finally:
-            # 可选的清理代码
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
+            index = IVFIndex.load(ann_path)
+            if index.index_version == self.index_version and index.ntotal == len(self.img_paths):
+                index.nprobe = self.ann_nprobe
+                self.ann_index = index
+                logger.info(f"Loaded IVF index with {index.ntotal} vectors")
+            else:
+                logger.info("Discarding IVF index from a different database version")
+        except Exception as e:
+            logger.error(f"Error loading IVF index: {e}")
 
-    def get_invalid_indices_multi_thread(self):
-        invalid_indices = []
-        total_paths = len(self.img_paths)
-        
-        def check_path_exists(args):
-            idx, img_path = args
-            exists = os.path.exists(img_path)
-            return idx, img_path, exists
-        
-        check_tasks = [(idx, img_path) for idx, img_path in enumerate(self.img_paths)]
-        
-        with ThreadPoolExecutor(max_workers=min(self.max_workers, 8)) as executor:
-            futures = [executor.submit(check_path_exists, task) for task in check_tasks]
-            
-            completed = 0
-            for future in as_completed(futures):
-                try:
-                    idx, img_path, exists = future.result()
-                    if not exists:
-                        invalid_indices.append(idx)
-                    
-                    completed += 1
-                    if completed % 10000 == 0:
-                        logger.info(f"Path validation progress: {completed}/{total_paths}")
-                        
-                except Exception as e:
-                    logger.error(f"Error checking path {img_path}: {e}")
-        return invalid_indices
-
-    def get_invalid_indices(self):
-        logger.info("Checking for invalid paths in database...")
-        
-        if not self.img_paths:
-            return []
-        if len(self.img_paths) < 1e4:
-            invalid_indices = []
-            for idx, img_path in enumerate(self.img_paths):
-                if not os.path.exists(img_path):
-                    invalid_indices.append(idx)
-        else:
-            invalid_indices = self.get_invalid_indices_multi_thread()
-        return invalid_indices
-
-    def cleanup_invalid_paths(self):
-        """清理数据库中已不存在的文件路径"""            
-        invalid_indices = self.get_invalid_indices()        
-        if invalid_indices:
-            invalid_indices.sort(reverse=True)
-            logger.info(f"Found {len(invalid_indices)} invalid paths, removing...")
-            
-            # 从大到小排序索引，以便从后往前删除
-            invalid_indices.sort(reverse=True)
-            
-            # 更新图片路径列表
-            self.img_paths = [self.img_paths[i] for i in range(len(self.img_paths)) if i not in invalid_indices]
-            
-            # 更新特征张量
-            if len(self.db_features) > 0:
-                valid_features = []
-                for i in range(len(self.db_features)):
-                    if i not in invalid_indices:
-                        valid_features.append(self.db_features[i].unsqueeze(0))
-                
-                if valid_features:
-                    self.db_features = torch.cat(valid_features, dim=0)
-                else:
-                    self.db_features = torch.empty(0)
-                logger.debug(f"valid features={self.db_features.shape}, valid_paths={len(self.img_paths)}, invalid_paths={len(invalid_indices)}, invalid_indices={invalid_indices}")
-            
-            logger.info(f"Removed {len(invalid_indices)} invalid paths from database")
+    def refresh_knn_graph(self):
+        """增量更新k近邻图（新增的行和待修复的行），参数变化或行数不一致时重新构建"""
+        if self.knn_k <= 0:
+            self.knn_graph = None
+            return False
+        n = len(self.img_paths)
+        if self.knn_graph is None or self.knn_graph.k != self.knn_k or self.knn_graph.count > n:
+            logger.info(f"Building k-NN graph (k={self.knn_k}) over {n} images...")
+            self.knn_graph = KnnGraph(self.knn_k, block_size=self.knn_block_size)
+        elif not self.knn_graph.needs_update(n):
+            return False
+        self.knn_graph = self.knn_graph.update(self.db_features if n > 0 else torch.empty((0, 0)))
+        return True
+
+    def load_knn_graph(self):
+        """加载数据库旁边保存的k近邻图，与数据库版本不一致时丢弃并重新构建"""
+        knn_path = get_knn_path(self.dump_path)
+        if self.knn_k <= 0 or not os.path.exists(knn_path):
+            return
+        try:
+            graph = KnnGraph.load(knn_path, self.knn_block_size)
+            if graph.index_version == self.index_version and graph.count == len(self.img_paths):
+                self.knn_graph = graph
+                logger.info(f"Loaded k-NN graph with {graph.count} rows")
+            else:
+                logger.info("Discarding k-NN graph from a different database version")
+        except Exception as e:
+            logger.error(f"Error loading k-NN graph: {e}")
+
+    def save_knn_graph(self):
+        if self.knn_graph is None:
+            return
+        try:
+            self.knn_graph.save(get_knn_path(self.dump_path), self.index_version)
+        except Exception as e:
+            logger.error(f"Error saving k-NN graph: {e}")
+
+    def refresh_auto_albums(self):
+        """将新增的图片增量分配到自动相册，参数变化或行数不一致时重新训练"""
+        if self.auto_album_clusters <= 0:
+            self.auto_albums = None
+            return False
+        n = len(self.img_paths)
+        if self.auto_albums is None or self.auto_albums.n_clusters != self.auto_album_clusters \
+                or self.auto_albums.count > n:
+            self.auto_albums = AutoAlbums(self.auto_album_clusters, self.auto_album_batch_size)
+        elif not self.auto_albums.needs_update(n):
+            return False
+        self.auto_albums = self.auto_albums.update(self.db_features if n > 0 else torch.empty((0, 0)))
+        return True
+
+    def load_auto_albums(self):
+        """加载数据库旁边保存的自动相册，与数据库版本不一致时丢弃并重新训练"""
+        clusters_path = get_clusters_path(self.dump_path)
+        if self.auto_album_clusters <= 0 or not os.path.exists(clusters_path):
+            return
+        try:
+            albums = AutoAlbums.load(clusters_path, self.auto_album_batch_size)
+            if albums.index_version == self.index_version and albums.count == len(self.img_paths):
+                self.auto_albums = albums
+                logger.info(f"Loaded auto albums for {albums.count} images")
+            else:
+                logger.info("Discarding auto albums from a different database version")
+        except Exception as e:
+            logger.error(f"Error loading auto albums: {e}")
+
+    def save_auto_albums(self):
+        if self.auto_albums is None:
+            return
+        try:
+            self.auto_albums.save(get_clusters_path(self.dump_path), self.index_version)
+        except Exception as e:
+            logger.error(f"Error saving auto albums: {e}")
+
+    def save_ann_index(self):
+        if self.ann_index is None:
+            return
+        try:
+            self.ann_index.save(get_ann_path(self.dump_path), self.index_version)
+        except Exception as e:
+            logger.error(f"Error saving IVF index: {e}")
+
+    def save_derived(self):
+        """保存ANN索引、k近邻图和自动相册；它们只随特征库的一代保存，之后的变更由重放日志补上"""
+        self.save_ann_index()
+        self.save_knn_graph()
+        self.save_auto_albums()
+
+    def persist_derived(self):
+        """重新构建的ANN索引、k近邻图或自动相册与当前代不一致：日志为空时直接保存，否则在后台合并为新的一代"""
+        store = FeatureStore(get_store_path(self.dump_path))
+        if not store.exists():
+            return
+        if store.journal().size() == 0:
+            self.save_derived()
         else:
+            self.schedule_compaction(force=True)
+
+    def remove_derived_rows(self, indices, old_features):
+        """从ANN索引、压缩特征、k近邻图和自动相册中删除给定行，old_features 为删除前的特征；行数不一致的结构直接丢弃"""
+        n = len(old_features)
+        if self.quantized is not None:
+            self.quantized = self.quantized.remove(indices) if len(self.quantized) == n else None
+        if self.ann_index is not None:
+            if self.ann_index.ntotal == n:
+                self.ann_index.remove(indices)
+            else:
+                self.ann_index = None
+        if self.knn_graph is not None:
+            if self.knn_graph.count == n:
+                # 需要删除前的特征计算被删除图片对softmax分母的贡献
+                self.knn_graph = self.knn_graph.remove(indices, old_features)
+            else:
+                self.knn_graph = None
+        if self.auto_albums is not None:
+            if self.auto_albums.count == n:
+                self.auto_albums = self.auto_albums.remove(indices)
+            else:
+                self.auto_albums = None
+
+    def replay_derived(self, removed, old_features):
+        """把重放的一条日志记录应用到已加载的ANN索引、k近邻图和自动相册：先删除行，再加入追加的行"""
+        if removed:
+            self.remove_derived_rows(removed, old_features)
+        n = len(self.img_paths)
+        if self.ann_index is not None and self.ann_index.ntotal < n:
+            for start in range(self.ann_index.ntotal, n, CHUNK_ROWS):
+                self.ann_index.add(self.db_features[start:start + CHUNK_ROWS], start_id=start)
+        if self.knn_graph is not None and self.knn_graph.needs_update(n):
+            self.knn_graph = self.knn_graph.update(self.db_features)
+        if self.auto_albums is not None and self.auto_albums.needs_update(n):
+            self.auto_albums = self.auto_albums.update(self.db_features)
+
+    def start_watcher(self):
+        """在后台监视图片目录，变化的目录攒成小批后增量更新数据库"""
+        if self.watcher is None:
+            self.watcher = FolderWatcher(self.root_path, self.walker, self.update_dirs, self.watch_mode,
+                                         self.watch_poll_interval, self.watch_debounce)
+            self.watcher.start()
+
+    def stop_watcher(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def scan_changes(self, root_path=None, full=False):
+        """扫描图片目录并与已索引的图片对比，返回 (新增路径, 删除的行号, 修改的行号, 仅修改时间变化的行号)
+
+        full 为 False 时只检查扫描器重新列出的目录（修改时间变化）中的文件是否被修改；
+        原地修改文件不会改变目录的修改时间，这类修改由目录监视或 full 扫描发现。
+        """
+        if root_path is None:
+            root_path = self.root_path
+        snapshot = self.walker.walk(root_path)
+        return self.collect_changes(snapshot, self.img_paths, changed_dirs=None if full else self.walker.relisted)
+
+    def collect_changes(self, snapshot, indexed_paths, rows=None, changed_dirs=None):
+        """消费 diff_snapshot 产出的变更；rows 为 indexed_paths 在数据库中的行号，默认即为其下标
+
+        changed_dirs 不为空时只检查这些目录中的文件是否被修改，为空时检查快照中的全部已索引文件。
+        """
+        added, removed, modified, touched = [], [], [], []
+
+        def check(path):
+            """文件大小或修改时间与记录不一致、且内容指纹也变化时才视为已修改，返回 (path, 是否修改, 新的修改时间)"""
+            values = self.metadata[path]
+            try:
+                stat = os.stat(path)
+                if stat.st_size == values[METADATA_SIZE] and stat.st_mtime == values[METADATA_MTIME]:
+                    return path, False, None
+                fingerprint = self.fingerprints.get(path)
+                if fingerprint is None or fingerprint_file(path) != fingerprint:
+                    return path, True, None
+            except OSError:
+                return path, False, None
+            return path, False, stat.st_mtime
+
+        # 并行 stat，每个文件只检查一次
+        candidates = [path for path in snapshot if path in self.metadata
+                      and (changed_dirs is None or os.path.dirname(path) in changed_dirs)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            checked = {path: (is_changed, mtime) for path, is_changed, mtime in executor.map(check, candidates)
+                       if is_changed or mtime is not None}
+
+        def is_modified(path, row):
+            is_changed, mtime = checked.get(path, (False, None))
+            if is_changed or mtime is None:
+                return is_changed
+            # 内容未变（如只更新了修改时间），只更新记录，无需重新提取特征
+            self.metadata[path] = (mtime,) + tuple(self.metadata[path][1:])
+            touched.append(row if rows is None else rows[row])
+            return False
+
+        buckets = {ADDED: added, REMOVED: removed, MODIFIED: modified}
+        for kind, path, row in diff_snapshot(snapshot, indexed_paths, is_modified):
+            if kind == ADDED:
+                added.append(path)
+            else:
+                buckets[kind].append(row if rows is None else rows[row])
+        logger.info(f"Scan found {len(added)} new, {len(removed)} removed and {len(modified)} modified images "
+                    f"({len(self.img_paths)} images in db)")
+        return added, removed, modified, touched
+
+    def relocate_moved(self, added, removed):
+        """按内容指纹把新增图片与已删除的行配对（移动或重命名），配对的行只改路径并保留特征
+
+        只对大小与某个已删除图片相同的新增文件计算指纹。返回 (剩余新增路径, 剩余删除行号, 配对的行号)。
+        """
+        removed_sizes = {self.metadata[self.img_paths[row]][METADATA_SIZE] for row in removed
+                         if self.img_paths[row] in self.metadata}
+        if not removed_sizes:
+            return added, removed, []
+
+        def size(path):
+            try:
+                return os.path.getsize(path)
+            except OSError:
+                return -1
+
+        candidates = [path for path in added if size(path) in removed_sizes]
+        if not candidates:
+            return added, removed, []
+        by_fingerprint = {}
+        for row in removed:
+            fingerprint = self.fingerprints.get(self.img_paths[row])
+            if fingerprint is not None:
+                by_fingerprint.setdefault(fingerprint, []).append(row)
+
+        def read(path):
+            try:
+                return path, fingerprint_file(path)
+            except OSError:
+                return path, None
+
+        moved = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for path, fingerprint in executor.map(read, candidates):
+                rows = by_fingerprint.get(fingerprint)
+                if rows:
+                    moved[path] = rows.pop()
+
+        # 正在使用的元数据索引持有旧的路径列表，不能原地修改
+        self.img_paths = list(self.img_paths)
+        for path, row in moved.items():
+            old_path = self.img_paths[row]
+            self.img_paths[row] = path
+            self.fingerprints[path] = self.fingerprints.pop(old_path)
+            values = self.metadata.pop(old_path, None)
+            if values is not None:
+                self.metadata[path] = (os.path.getmtime(path),) + tuple(values[1:])
+        if moved:
+            logger.info(f"Matched {len(moved)} moved or renamed images by fingerprint, keeping their features")
+        moved_rows = set(moved.values())
+        return ([path for path in added if path not in moved], [row for row in removed if row not in moved_rows],
+                sorted(moved_rows))
+
+    def cleanup_invalid_paths(self, invalid_indices):
+        """从数据库中删除给定行（已不存在或需要重新提取特征的图片）"""
+        if not invalid_indices:
             logger.info("No invalid paths found in database")
+            return 0
+        logger.info(f"Found {len(invalid_indices)} invalid paths, removing...")
+        invalid_indices = sorted(invalid_indices)
+        keep = np.ones(len(self.img_paths), dtype=bool)
+        keep[invalid_indices] = False
+
+        for i in invalid_indices:
+            self.fingerprints.pop(self.img_paths[i], None)
+            self.metadata.pop(self.img_paths[i], None)
+
+        # 更新图片路径列表
+        self.img_paths = [path for path, kept in zip(self.img_paths, keep.tolist()) if kept]
+
+        # 更新特征张量
+        old_features = self.db_features
+        if len(self.db_features) > 0:
+            self.db_features = self.db_features.remove(invalid_indices)
+            self.remove_derived_rows(invalid_indices, old_features)
+            logger.debug(f"valid features={self.db_features.shape}, valid_paths={len(self.img_paths)}, invalid_paths={len(invalid_indices)}")
+
+        logger.info(f"Removed {len(invalid_indices)} invalid paths from database")
         return len(invalid_indices)
 
     def ensure_features_normalized(self):
@@ -157,16 +512,9 @@ class DataBase:
                 self.db_features /= self.db_features.norm(dim=-1, keepdim=True)
                 logger.info("Normalized database features")
 
-    def update_new_paths(self, root_path=None, use_multithreading=True):
-        if root_path is None:
-            root_path = self.root_path
-
-        
-        new_img_paths = self.get_update_img_paths(root_path)
-        if use_multithreading and len(new_img_paths) > 100:
-            new_img_paths, new_db_features = self.load_and_extract_multi_thread(new_img_paths)
-        else:
-            new_img_paths, new_db_features = self.load_and_extract_single_thread(new_img_paths)
+    def update_new_paths(self, new_img_paths, use_multithreading=True):
+        """提取新图片的特征并追加到数据库末尾"""
+        new_img_paths, new_db_features = self.load_and_extract_batched(new_img_paths, use_multithreading)
         
         if not (len(new_db_features) == len(new_img_paths)):
             logger.error(f"features num={len(new_db_features)}, img num={len(new_img_paths)}, stop update database")
@@ -175,125 +523,235 @@ class DataBase:
         if len(new_img_paths) == 0:
             return 0
         
-        self.img_paths += new_img_paths
-        self.db_features = torch.cat([self.db_features, new_db_features], dim=0)
+        start_id = len(self.img_paths)
+        # 正在使用的元数据索引持有旧的路径列表，不能原地修改
+        self.img_paths = self.img_paths + new_img_paths
+        self.db_features = self.db_features.append(new_db_features)
+        if self.ann_index is not None and self.ann_index.ntotal == start_id:
+            self.ann_index.add(new_db_features, start_id=start_id)
+        if self.quantized is not None:
+            self.quantized = self.quantized.append(new_db_features) if len(self.quantized) == start_id else None
         return len(new_img_paths)
     
-    def update_db(self):
-        """更新数据库"""
-        invalid_num = 0
-        updated_num = 0
+    def update_db(self, full=False):
+        """更新数据库；full 为 True 时检查所有已索引的文件是否被修改（见 scan_changes）"""
+        with self.update_lock:
+            changes = [], [], [], []
+            if self.allow_cleanup_invalid_paths or self.allow_update_new_paths:
+                changes = self.scan_changes(full=full)
+            return self.apply_changes(*changes, backfill=True)
+
+    def update_dirs(self, dirs):
+        """只重新列出给定目录，与其中已索引的图片对比后增量更新数据库；dirs 为 None 时完整扫描"""
+        if dirs is None:
+            # 事件有丢失（包括文件被原地修改的事件），需要完整检查
+            return self.update_db(full=True)
+        with self.update_lock:
+            old_paths, new_paths = self.walker.refresh(dirs)
+            indexed_paths = sorted({path for path in old_paths + new_paths if path in self.path_to_index})
+            rows = [self.path_to_index[path] for path in indexed_paths]
+            return self.apply_changes(*self.collect_changes(new_paths, indexed_paths, rows))
 
+    def apply_changes(self, added, removed, modified, touched, backfill=False):
+        """按扫描结果删除、移动、重新提取和新增图片，有变化时发布新版本的检索索引"""
+        invalid_num = 0
+        updated_num = len(touched)
+        # 原地修改的行（只更新记录或移动过的图片），以变更前的行号记录到日志
+        set_rows = list(touched)
+        # 移动过的图片沿用原来的行；修改过的图片先删除旧行，再作为新图片重新提取特征
+        if self.allow_cleanup_invalid_paths and self.allow_update_new_paths:
+            added, removed, moved_rows = self.relocate_moved(added, removed)
+            updated_num += len(moved_rows)
+            set_rows += moved_rows
+        else:
+            modified = []
+        set_paths = [self.img_paths[row] for row in set_rows]
+        modified_paths = [self.img_paths[row] for row in modified]
+        removed_rows = []
         if self.allow_cleanup_invalid_paths:
-            invalid_num = self.cleanup_invalid_paths()
+            removed_rows = sorted(removed + modified)
+            invalid_num = self.cleanup_invalid_paths(removed_rows)
+        appended_num = 0
         if self.allow_update_new_paths:
-            updated_num = self.update_new_paths()
+            appended_num = self.update_new_paths(added + modified_paths)
+            updated_num += appended_num
+        # 旧数据库中的图片没有元数据，补全后需要重新保存
+        backfilled_num = self.backfill_metadata() if backfill else 0
+        updated_num += backfilled_num
 
         if (self.allow_cleanup_invalid_paths or self.allow_update_new_paths) and (invalid_num > 0 or updated_num > 0):
-            self.update_mapping()
-            self.dump_db_features(self.dump_path)
+            # 只追加了新图片时已有行的映射不变
+            self.update_mapping(start=len(self.img_paths) - appended_num if not (set_rows or removed_rows) else 0)
+            if backfilled_num > 0:
+                self.metadata_table = None
+            else:
+                self.update_metadata_table(set_rows, set_paths, removed_rows, appended_num)
+            self.index_version += 1
+            retrained = self.refresh_ann_index()
+            self.refresh_knn_graph()
+            self.refresh_auto_albums()
+            # 补全的元数据分散在各行，直接写入完整的一代；近邻图等旁路文件不在每次更新时重写
+            self.save_changes(set_rows, set_paths, removed_rows, appended_num, full=backfilled_num > 0)
+            self.rebuild_search_index()
+            if retrained:
+                # 重新训练的ANN索引无法由日志重放得到，尽快随新的一代保存
+                self.persist_derived()
         else:
             logger.info(f"ignore update")
         return updated_num + invalid_num
     
-    @functools.lru_cache(maxsize=1)
-    def get_update_img_paths(self, root_path):
-        """获取需要更新的图片路径"""
-        img_paths = glob_all_images(root_path)
-        new_img_paths = [img_path for img_path in img_paths if img_path not in set(self.img_paths)]
-        logger.info(f"Found {len(img_paths)} images, {len(self.img_paths)} images in db, {len(new_img_paths)} new images")
-        return new_img_paths
-    
-    def extract_clip_features(self, image_path):
-        """提取图片特征"""
-        try:
-            with self.thread_model() as (model, preprocess):
-                image = preprocess(Image.open(image_path)).unsqueeze(0)
-                with torch.no_grad():
-                    image_features = model.encode_image(image)
-                image_features /= image_features.norm(dim=-1, keepdim=True)
-                return image_features
-        except Exception as e:
-            logger.error(f"Error extracting features from {image_path}: {e}")
-            logger.info(f"add to ignore paths: {image_path}")
-            with self.ignore_paths_lock:  # 线程安全
-                self.ignore_paths.add(image_path)
-            return None
-    
-    def load_and_extract_single_thread(self, new_img_paths):
-        """单线程版本的特征提取"""
-        extracted_paths = []
-        extracted_features = []
-        
-        if new_img_paths:
-            logger.info(f"Extracting features for {len(new_img_paths)} new images (single-threaded)...")
-            start_time = time.time()
-            
-            for img_path in new_img_paths:
-                if img_path in self.ignore_paths:
-                    logger.debug(f"ignore {img_path}")
-                    continue
-                feature = self.extract_clip_features(img_path)
-                if feature is not None:
-                    extracted_features.append(feature)
-                    extracted_paths.append(img_path)
-            
-            if extracted_features:
-                extracted_features = torch.cat(extracted_features, dim=0)
-                elapsed_time = time.time() - start_time
-                logger.info(f"Successfully extracted features for {len(extracted_features)} images in {elapsed_time:.2f}s")
-            else:
-                extracted_features = torch.empty(0)
-        
-        return extracted_paths, extracted_features
-    
-    def load_and_extract_multi_thread(self, new_img_paths):
-        """多线程版本的特征提取"""
-        extracted_paths = []
-        extracted_features = []
-        
-        if new_img_paths:
-            logger.info(f"Extracting features for {len(new_img_paths)} new images (multi-threaded, {self.max_workers} workers)...")
-            start_time = time.time()
-            
-            # 使用线程池并行处理
-            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                # 提交所有任务
-                future_to_path = {
-                    executor.submit(self.extract_clip_features, img_path): img_path 
-                    for img_path in new_img_paths
-                }
-                
-                # 收集结果
-                completed_count = 0
-                for future in as_completed(future_to_path):
-                    img_path = future_to_path[future]
-                    try:
-                        feature = future.result()
-                        if feature is not None:
-                            extracted_features.append(feature)
-                            extracted_paths.append(img_path)
-                        
-                        completed_count += 1
-                        if completed_count % 100 == 0:
-                            logger.info(f"Progress: {completed_count}/{len(new_img_paths)} images processed")
-                            
-                    except Exception as e:
-                        logger.error(f"Error processing {img_path}: {e}")
-            
-            if extracted_features:
-                extracted_features = torch.cat(extracted_features, dim=0)
+    def ignore_failed_path(self, image_path, error):
+        logger.error(f"Error extracting features from {image_path}: {error}")
+        logger.info(f"add to ignore paths: {image_path}")
+        with self.ignore_paths_lock:  # 线程安全
+            self.ignore_paths.add(image_path)
+
+    def load_and_extract_batched(self, new_img_paths, use_multithreading=True):
+        """批量提取特征：解码线程预处理图片，推理阶段每次对 index_batch_size 张图片做一次前向计算"""
+        new_img_paths = [img_path for img_path in new_img_paths if img_path not in self.ignore_paths]
+        if not new_img_paths:
+            return [], torch.empty(0)
+
+        workers = self.max_workers if use_multithreading else 1
+        processes = self.index_decode_processes if use_multithreading else 0
+        decoders = f"{processes} decode processes" if processes > 0 else f"{workers} decode workers"
+        logger.info(f"Extracting features for {len(new_img_paths)} new images "
+                    f"(batch size {self.index_batch_size}, {decoders})...")
+        start_time = time.time()
+        extracted_paths, extracted_features = [], []
+        preprocess = self.inference.preprocess
+
+        def encode(batch):
+            features = self.inference.encode_images(batch)
+            return features / features.norm(dim=-1, keepdim=True)
+
+        sample_shape = preprocess(Image.new('RGB', (256, 256))).shape if processes > 0 else None
+        pipeline = EmbeddingPipeline(functools.partial(load_image, preprocess=preprocess), encode,
+                                     batch_size=self.index_batch_size, workers=workers,
+                                     queue_size=self.index_queue_size, on_error=self.ignore_failed_path,
+                                     processes=processes, sample_shape=sample_shape)
+        for batch_no, (paths, extras, features) in enumerate(pipeline.run(new_img_paths), 1):
+            # 只记录成功提取特征的图片的指纹和元数据
+            for path, (fingerprint, metadata) in zip(paths, extras):
+                self.fingerprints[path] = fingerprint
+                self.metadata[path] = metadata
+            extracted_paths += paths
+            extracted_features.append(features)
+            if batch_no % 10 == 0:
                 elapsed_time = time.time() - start_time
-                logger.info(f"Successfully extracted features for {len(extracted_features)} images in {elapsed_time:.2f}s (multi-threaded)")
-            else:
-                extracted_features = torch.empty(0)
-        
+                logger.info(f"Progress: {len(extracted_paths)}/{len(new_img_paths)} images "
+                            f"({len(extracted_paths) / max(elapsed_time, 1e-6):.1f} images/s)")
+
+        if not extracted_features:
+            return [], torch.empty(0)
+        extracted_features = torch.cat(extracted_features, dim=0)
+        elapsed_time = time.time() - start_time
+        logger.info(f"Successfully extracted features for {len(extracted_features)} images in {elapsed_time:.2f}s "
+                    f"({len(extracted_features) / max(elapsed_time, 1e-6):.1f} images/s)")
         return extracted_paths, extracted_features
 
-    def update_mapping(self):
-        """更新路径-索引映射关系"""
-        self.path_to_index = {path: idx for idx, path in enumerate(self.img_paths)}
-        self.index_to_path = {idx: path for idx, path in enumerate(self.img_paths)}
+    def update_mapping(self, start=0):
+        """更新路径-索引映射关系；start 之前的行没有变化时复制已有的映射，只加入之后的行
+
+        映射总是整体替换而不原地修改，检索索引直接引用 path_to_index。
+        """
+        if start == 0:
+            self.path_to_index = {path: idx for idx, path in enumerate(self.img_paths)}
+            self.index_to_path = {idx: path for idx, path in enumerate(self.img_paths)}
+            self.fingerprint_to_path = {fp: path for path, fp in self.fingerprints.items()}
+            return
+        new_paths = self.img_paths[start:]
+        self.path_to_index = dict(self.path_to_index)
+        self.path_to_index.update((path, idx) for idx, path in enumerate(new_paths, start))
+        self.index_to_path = dict(self.index_to_path)
+        self.index_to_path.update(enumerate(new_paths, start))
+        self.fingerprint_to_path = dict(self.fingerprint_to_path)
+        self.fingerprint_to_path.update((self.fingerprints[path], path) for path in new_paths
+                                        if path in self.fingerprints)
+
+    def get_path_by_fingerprint(self, fingerprint):
+        """根据内容指纹查找相册中内容相同的图片路径"""
+        return self.fingerprint_to_path.get(fingerprint)
+
+    def fingerprint_column(self, paths=None):
+        """将内容指纹整理为与行（或给定路径）对齐的 [N, 16] uint8 数组，缺失的行为全零"""
+        if paths is None:
+            paths = self.img_paths
+        column = np.zeros((len(paths), DIGEST_SIZE), dtype=np.uint8)
+        for idx, path in enumerate(paths):
+            fingerprint = self.fingerprints.get(path)
+            if fingerprint is not None:
+                column[idx] = np.frombuffer(fingerprint, dtype=np.uint8)
+        return column
+
+    def load_fingerprint_column(self, column):
+        zero = bytes(DIGEST_SIZE)
+        self.fingerprints = {}
+        for path, row in zip(self.img_paths, column):
+            fingerprint = row.tobytes()
+            if fingerprint != zero:
+                self.fingerprints[path] = fingerprint
+
+    def metadata_columns(self, paths=None):
+        """将元数据整理为与行（或给定路径）对齐的列，缺失的行时间为 nan、其余为 0"""
+        if paths is None:
+            paths = self.img_paths
+        columns = {name: np.zeros(len(paths), dtype=METADATA_DTYPES[name]) for name in METADATA_FIELDS}
+        columns['mtime'][:] = np.nan
+        columns['taken'][:] = np.nan
+        for idx, path in enumerate(paths):
+            values = self.metadata.get(path)
+            if values is not None:
+                for name, value in zip(METADATA_FIELDS, values):
+                    columns[name][idx] = value
+        return columns
+
+    def update_metadata_table(self, set_rows, set_paths, removed_rows, appended_num):
+        """按与变更日志相同的顺序（修改、删除、追加）更新与行对齐的元数据列，只整理变化的行"""
+        columns = self.metadata_table
+        if columns is None:
+            return
+        if set_rows:
+            values = self.metadata_columns(set_paths)
+            # 正在使用的元数据索引持有旧的列，不能原地修改
+            columns = {name: column.copy() for name, column in columns.items()}
+            for name, column in columns.items():
+                column[set_rows] = values[name]
+        if removed_rows:
+            keep = np.ones(len(columns[METADATA_FIELDS[0]]), dtype=bool)
+            keep[removed_rows] = False
+            columns = {name: column[keep] for name, column in columns.items()}
+        if appended_num:
+            values = self.metadata_columns(self.img_paths[len(self.img_paths) - appended_num:])
+            columns = {name: np.concatenate([column, values[name]]) for name, column in columns.items()}
+        self.metadata_table = columns
+
+    def load_metadata_columns(self, columns):
+        if not all(name in columns for name in METADATA_FIELDS):
+            return
+        rows = zip(*(columns[name].tolist() for name in METADATA_FIELDS))
+        self.metadata = {path: values for path, values in zip(self.img_paths, rows)
+                         if not np.isnan(values[0])}
+
+    def backfill_metadata(self):
+        """为缺少元数据的图片读取文件头补全元数据，返回补全的数量"""
+        missing = [path for path in self.img_paths if path not in self.metadata]
+        if not missing:
+            return 0
+        logger.info(f"Reading metadata for {len(missing)} images...")
+
+        def read(path):
+            try:
+                return path, read_image_metadata(path)
+            except Exception as e:
+                logger.debug(f"Error reading metadata from {path}: {e}")
+                return path, None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for path, values in executor.map(read, missing):
+                if values is not None:
+                    self.metadata[path] = values
+        return sum(path in self.metadata for path in missing)
 
     def get_feature_by_path(self, img_path):
         """根据图片路径获取对应的特征向量"""
@@ -313,58 +771,175 @@ class DataBase:
         """根据路径获取索引"""
         return self.path_to_index.get(img_path, -1)
     
+    def store_columns(self, paths=None):
+        """与行对齐、写入特征库的全部附加列"""
+        return {'fingerprint': self.fingerprint_column(paths), **self.metadata_columns(paths)}
+
+    def save_changes(self, set_rows, set_paths, removed_rows, appended_num, full=False):
+        """把一次更新追加到特征库的变更日志，写入量与变更大小成正比；特征库尚不存在或 full 时写入完整的一代
+
+        日志记录依次为: 按变更前行号修改的行（set_rows 及其新路径）、删除的行号、追加到末尾的 appended_num 行。
+        """
+        store = FeatureStore(get_store_path(self.dump_path))
+        if full or not store.exists():
+            self.dump_db_features(self.dump_path)
+            return
+        try:
+            header = store.read_header()
+            journal = store.journal(header)
+            append_paths = self.img_paths[len(self.img_paths) - appended_num:] if appended_num else []
+            arrays = {
+                'set_rows': np.asarray(set_rows, dtype=np.int64),
+                'removed': np.asarray(removed_rows, dtype=np.int64),
+            }
+            arrays.update({f'set.{name}': column for name, column in self.store_columns(set_paths).items()})
+            if appended_num:
+                arrays['append_features'] = (self.db_features[-appended_num:].detach().to(torch.float32)
+                                             .contiguous().cpu().numpy())
+                arrays.update({f'append.{name}': column
+                               for name, column in self.store_columns(append_paths).items()})
+            added_ignore = sorted(self.ignore_paths - self.saved_ignore_paths)
+            record = {
+                'index_version': self.index_version,
+                'set_paths': set_paths,
+                'append_paths': append_paths,
+                'ignore_paths': added_ignore,
+            }
+            written = journal.append(record, arrays)
+            self.saved_ignore_paths.update(added_ignore)
+            logger.info(f"Appended {written / 1024:.1f} KB to {journal.path} ({len(set_rows)} updated, "
+                        f"{len(removed_rows)} removed, {appended_num} added)")
+        except Exception as e:
+            logger.error(f"Error appending to journal, rewriting database: {e}")
+            self.dump_db_features(self.dump_path)
+            return
+        self.schedule_compaction()
+
+    def schedule_compaction(self, force=False):
+        """日志超过特征库大小的 journal_compact_ratio 倍（且不小于 journal_compact_min_mb）或 force 时在后台合并"""
+        store = FeatureStore(get_store_path(self.dump_path))
+        threshold = max(self.journal_compact_ratio * store.base_size(), self.journal_compact_min_mb * 1024 * 1024)
+        if self.compacting or (not force and store.journal().size() < threshold):
+            return
+        self.compacting = True
+        threading.Thread(target=self.compact_db, name='journal-compaction', daemon=True).start()
+
+    def compact_db(self):
+        """把变更日志合并为特征库的新一代，旧的一代及其日志随后删除"""
+        try:
+            with self.update_lock:
+                logger.info("Compacting database journal...")
+                self.dump_db_features(self.dump_path)
+        finally:
+            self.compacting = False
+
     def dump_db_features(self, dump_path):
-        """保存特征数据库"""
+        """保存特征数据库（列式特征库，与 dump_path 同名的 .store 目录）"""
         try:
+            store = FeatureStore(get_store_path(dump_path))
             # 备份现有数据库
-            if os.path.exists(dump_path):
+            if store.exists():
                 import datetime
-                import shutil
 
-                backup_name = f"db_backup_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.pt"
+                backup_name = f"db_backup_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
                 backup_path = os.path.join(self.backup_path, backup_name)
-                shutil.copy2(dump_path, backup_path)
+                store.backup(backup_path)
                 logger.info(f"Backed up existing database to {backup_path}")
             
             # 保存新数据库
-            torch.save({
-                'img_paths': self.img_paths,
-                'features': self.db_features,
-                'path_to_index': self.path_to_index,  # 保存映射
-                'index_to_path': self.index_to_path,   # 保存映射
-                'ignore_paths': list(self.ignore_paths)
-            }, dump_path)
-            logger.info(f"Saved database to {dump_path}")
+            header = store.write(self.db_features, self.img_paths, self.ignore_paths, self.index_version,
+                                 columns=self.store_columns())
+            self.saved_ignore_paths = set(self.ignore_paths)
+            # 改为引用磁盘上的映射，释放内存中的特征和变更
+            self.db_features = LiveFeatures(store.read_features(header))
+            self.save_derived()
+            logger.info(f"Saved database to {store.path}")
         except Exception as e:
             logger.error(f"Error saving database: {e}")
     
     def load_db_features(self, dump_path):
-        """加载特征数据库"""
+        """加载特征数据库；旧版 .pt 文件会一次性迁移为列式特征库"""
+        store = FeatureStore(get_store_path(dump_path))
         try:
-            data = torch.load(dump_path, map_location='cpu')
-            self.img_paths = data['img_paths']
-            self.db_features = data['features']
-            self.ensure_features_normalized()
-
-            # 加载映射关系，如果不存在则重新创建
-            if 'path_to_index' in data and 'index_to_path' in data:
-                self.path_to_index = data['path_to_index']
-                self.index_to_path = data['index_to_path']
-            else:
-                # 向后兼容：如果旧版本数据没有映射，则创建新的
+            if store.exists():
+                header, features, self.img_paths = store.read()
+                self.db_features = LiveFeatures(features)
+                self.ignore_paths = set(header['ignore_paths'])
+                self.index_version = header['index_version']
+                columns = store.read_columns(header)
+                self.saved_ignore_paths = set(self.ignore_paths)
+                # 旁路文件与这一代对应，重放日志时随之增量更新
+                self.load_ann_index()
+                self.load_knn_graph()
+                self.load_auto_albums()
+                columns = self.replay_journal(store.journal(header), columns)
+                if 'fingerprint' in columns:
+                    self.load_fingerprint_column(columns['fingerprint'])
+                self.load_metadata_columns(columns)
                 self.update_mapping()
-                logger.info("Created new path-index mapping for legacy data")
-            
-            if 'ignore_paths' in data:
-                self.ignore_paths = set(data['ignore_paths'])
- 
-            logger.info(f"Loaded database with {len(self.img_paths)} images")
+                logger.info(f"Loaded database with {len(self.img_paths)} images from {store.path}")
+            else:
+                self.load_legacy_db_features(dump_path)
+                logger.info(f"Migrating legacy database {dump_path} to {store.path}")
+                self.dump_db_features(dump_path)
         except Exception as e:
             logger.error(f"Error loading database: {e}")
             self.img_paths = []
-            self.db_features = torch.empty(0)
+            self.db_features = LiveFeatures(torch.empty(0))
             self.ignore_paths = set()
+            self.saved_ignore_paths = set()
+            self.update_mapping()
+        self.rebuild_search_index()
+
+    def replay_journal(self, journal, columns):
+        """在刚加载的一代数据上重放变更日志，返回重放后的附加列"""
+        replayed = 0
+        for record, arrays in journal.replay():
+            if replayed == 0:
+                # 内存映射的列是只读的
+                columns = {name: np.array(column) for name, column in columns.items()}
+            old_features = self.db_features
+            self.db_features, self.img_paths, columns = apply_record(self.db_features, self.img_paths, columns,
+                                                                     record, arrays)
+            self.replay_derived(arrays['removed'].tolist(), old_features)
+            self.index_version = record['index_version']
+            self.ignore_paths.update(record['ignore_paths'])
+            replayed += 1
+        if replayed:
+            self.saved_ignore_paths = set(self.ignore_paths)
+            logger.info(f"Replayed {replayed} journal records ({journal.size() / 1024:.1f} KB)")
+            self.schedule_compaction()
+        return columns
+
+    def load_legacy_db_features(self, dump_path):
+        """加载旧版 torch.save 格式的数据库"""
+        data = torch.load(dump_path, map_location='cpu')
+        self.img_paths = data['img_paths']
+        self.db_features = data['features']
+        self.ensure_features_normalized()
+        self.db_features = LiveFeatures(self.db_features)
+
+        # 加载映射关系，如果不存在则重新创建
+        if 'path_to_index' in data and 'index_to_path' in data:
+            self.path_to_index = data['path_to_index']
+            self.index_to_path = data['index_to_path']
+        else:
+            # 向后兼容：如果旧版本数据没有映射，则创建新的
+            self.update_mapping()
+            logger.info("Created new path-index mapping for legacy data")
+        
+        if 'ignore_paths' in data:
+            self.ignore_paths = set(data['ignore_paths'])
+        self.index_version = data.get('index_version', 0)
+ 
+        logger.info(f"Loaded database with {len(self.img_paths)} images")
     
+    def evaluate_ann_recall(self, k=20, nprobes=(1, 4, 16, 64), n_queries=100):
+        """评估ANN索引相对精确检索的召回率，用于调节nprobe"""
+        if self.ann_index is None:
+            return []
+        return evaluate_recall(self.ann_index, self.db_features[:], k=k, nprobes=nprobes, n_queries=n_queries)
+
     def set_max_workers(self, max_workers):
         """设置最大线程数"""
         self.max_workers = max(1, min(max_workers, 8))  # 限制在1-8之间
@@ -0,0 +1,31 @@
+import os
+
+# 变更类型
+ADDED = 'added'
+REMOVED = 'removed'
+MODIFIED = 'modified'
+
+
+def diff_snapshot(snapshot, indexed_paths, is_modified=None, exists=os.path.exists):
+    """对比文件系统快照与已索引的路径，逐条产出 (kind, path, row)
+
+    快照和已索引路径各遍历一次，总耗时与图片数成线性关系。
+    快照中未索引的路径产出 ADDED（row 为 None）；已索引的路径在 is_modified(path, row) 为真时产出 MODIFIED；
+    快照中没有的已索引路径再用 exists 确认，文件确实不存在时才产出 REMOVED（按行号从小到大），
+    因此扫描器不进入的目录（隐藏目录、符号链接等）中已索引的图片不会被误删。
+    indexed_paths 中重复的路径只有最后一行与快照对应，其余行按未出现处理。
+    """
+    path_to_row = {path: row for row, path in enumerate(indexed_paths)}
+    seen = bytearray(len(indexed_paths))
+    for path in snapshot:
+        row = path_to_row.get(path)
+        if row is None:
+            yield ADDED, path, None
+            continue
+        seen[row] = 1
+        if is_modified is not None and is_modified(path, row):
+            yield MODIFIED, path, row
+
+    for row, path in enumerate(indexed_paths):
+        if not seen[row] and not exists(path):
+            yield REMOVED, path, row
@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+import torch
+from loguru import logger
+
+from models.store import similarity
+
+# 余弦相似度不低于该值的两张图片视为近似重复（连拍、重新保存的副本等）
+DEFAULT_THRESHOLD = 0.95
+# 分块自相似度计算的块大小，单个块的临时内存为 block_size^2 * 4 字节
+DEFAULT_BLOCK_SIZE = 4096
+# 保存检查点的最小间隔（秒）
+CHECKPOINT_INTERVAL = 30
+
+
+def get_duplicates_path(dump_path):
+    """重复检测结果与数据库文件同名，后缀为 .duplicates.json"""
+    return os.path.splitext(dump_path)[0] + '.duplicates.json'
+
+
+def get_checkpoint_path(dump_path):
+    return os.path.splitext(dump_path)[0] + '.duplicates.ckpt.npz'
+
+
+class UnionFind:
+    """并查集（按大小合并 + 路径减半）"""
+    def __init__(self, n):
+        self.parent = np.arange(n, dtype=np.int64)
+        self.size = np.ones(n, dtype=np.int64)
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+
+def blocked_pairs(features, threshold, block_size=DEFAULT_BLOCK_SIZE, start_block=0):
+    """分块计算特征的自相似度，逐个行块产出相似度不低于阈值的图片对
+
+    只计算上三角的块，每次只有一个 block_size x block_size 的相似度块存在于内存中。
+    产出 (行块序号, rows, cols, similarities)，其中 rows < cols。
+    """
+    n = len(features)
+    for block in range(start_block, (n + block_size - 1) // block_size):
+        row_start = block * block_size
+        rows = features[row_start:row_start + block_size].to(torch.float32)
+        found_rows, found_cols, found_sims = [], [], []
+        for col_start in range(row_start, n, block_size):
+            tile = similarity(rows, features, col_start, col_start + block_size)
+            if col_start == row_start:
+                # 对角块只保留严格上三角，排除自身和重复的对
+                tile.masked_fill_(torch.ones_like(tile, dtype=torch.bool).tril_(), float('-inf'))
+            i, j = torch.nonzero(tile >= threshold, as_tuple=True)
+            if len(i) > 0:
+                found_rows.append((i + row_start).numpy())
+                found_cols.append((j + col_start).numpy())
+                found_sims.append(tile[i, j].numpy())
+        if found_rows:
+            yield block, np.concatenate(found_rows), np.concatenate(found_cols), np.concatenate(found_sims)
+        else:
+            empty = np.empty(0, dtype=np.int64)
+            yield block, empty, empty, np.empty(0, dtype=np.float32)
+
+
+def cluster_pairs(rows, cols, sims):
+    """用并查集将图片对合并为重复组，返回 [(行号列表, 组内最大相似度)]，按组大小降序"""
+    if len(rows) == 0:
+        return []
+    nodes, inverse = np.unique(np.concatenate([rows, cols]), return_inverse=True)
+    local_rows, local_cols = inverse[:len(rows)], inverse[len(rows):]
+    union_find = UnionFind(len(nodes))
+    for a, b in zip(local_rows.tolist(), local_cols.tolist()):
+        union_find.union(a, b)
+    roots = np.array([union_find.find(i) for i in range(len(nodes))])
+
+    best = np.zeros(len(nodes), dtype=np.float32)
+    np.maximum.at(best, roots[local_rows], sims)
+    groups = {}
+    for node, root in zip(nodes.tolist(), roots.tolist()):
+        groups.setdefault(root, []).append(node)
+    clusters = [(members, float(best[root])) for root, members in groups.items()]
+    clusters.sort(key=lambda cluster: (-len(cluster[0]), -cluster[1]))
+    return clusters
+
+
+class DuplicateFinder:
+    """近似重复检测后台任务
+
+    直接使用检索索引中已存储的特征，不重新编码图片。计算过程中定期把已完成的行块和找到的图片对
+    保存为检查点；任务中断（停止或进程退出）后，以相同的索引版本和参数再次启动时从检查点继续。
+    结果按路径保存，索引更新后仍可查看，但会标记为过期。
+    """
+    def __init__(self, dump_path, threshold=DEFAULT_THRESHOLD, block_size=DEFAULT_BLOCK_SIZE):
+        self.result_path = get_duplicates_path(dump_path)
+        self.checkpoint_path = get_checkpoint_path(dump_path)
+        self.threshold = threshold
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.state = 'idle'
+        self.progress = 0
+        self.total = 0
+        self.error = None
+        self.result = self.load_result()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, index, threshold=None, block_size=None):
+        """在后台线程中启动检测，已有任务在运行时返回 False"""
+        with self.lock:
+            if self.running:
+                return False
+            threshold = self.threshold if threshold is None else threshold
+            block_size = self.block_size if block_size is None else block_size
+            if not 0 < threshold <= 1:
+                raise ValueError('Threshold must be in (0, 1]')
+            if block_size < 1:
+                raise ValueError('Block size must be positive')
+            self.stop_event.clear()
+            self.state = 'running'
+            self.error = None
+            self.thread = threading.Thread(target=self.run, args=(index, threshold, block_size),
+                                           name='duplicate-finder', daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        """请求停止，当前行块完成后保存检查点并退出"""
+        self.stop_event.set()
+
+    def run(self, index, threshold, block_size):
+        try:
+            self._run(index, threshold, block_size)
+        except Exception as e:
+            logger.error(f"Duplicate detection failed: {e}")
+            self.state = 'failed'
+            self.error = str(e)
+
+    def _run(self, index, threshold, block_size):
+        n = len(index)
+        params = {'index_version': index.version, 'count': n, 'threshold': threshold, 'block_size': block_size}
+        start_block, rows, cols, sims = self.load_checkpoint(params)
+        self.total = (n + block_size - 1) // block_size
+        self.progress = start_block
+        if start_block > 0:
+            logger.info(f"Resuming duplicate detection from block {start_block}/{self.total}")
+        else:
+            logger.info(f"Starting duplicate detection over {n} images (threshold={threshold})")
+
+        start_time = last_checkpoint = time.time()
+        for block, block_rows, block_cols, block_sims in blocked_pairs(index.features, threshold, block_size,
+                                                                       start_block):
+            rows.append(block_rows)
+            cols.append(block_cols)
+            sims.append(block_sims)
+            self.progress = block + 1
+            if self.stop_event.is_set():
+                self.save_checkpoint(params, block + 1, rows, cols, sims)
+                self.state = 'stopped'
+                logger.info(f"Duplicate detection stopped at block {block + 1}/{self.total}")
+                return
+            if time.time() - last_checkpoint > CHECKPOINT_INTERVAL:
+                self.save_checkpoint(params, block + 1, rows, cols, sims)
+                last_checkpoint = time.time()
+
+        rows, cols, sims = (np.concatenate(part) if part else np.empty(0) for part in (rows, cols, sims))
+        clusters = cluster_pairs(rows.astype(np.int64), cols.astype(np.int64), sims.astype(np.float32))
+        self.result = {
+            'index_version': index.version,
+            'threshold': threshold,
+            'created_at': time.time(),
+            'total_pairs': int(len(rows)),
+            'clusters': [{'paths': sorted(index.paths[i] for i in members), 'max_similarity': round(best, 4)}
+                         for members, best in clusters],
+        }
+        self.save_result()
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        self.state = 'done'
+        logger.info(f"Found {len(clusters)} duplicate groups ({len(rows)} pairs) in {time.time() - start_time:.1f}s")
+
+    def load_checkpoint(self, params):
+        """读取与当前参数一致的检查点，返回 (起始行块, rows, cols, sims)"""
+        if os.path.exists(self.checkpoint_path):
+            try:
+                data = np.load(self.checkpoint_path)
+                if json.loads(str(data['params'])) == params:
+                    return int(data['next_block']), [data['rows']], [data['cols']], [data['sims']]
+                logger.info("Discarding duplicate detection checkpoint from a different index or settings")
+            except Exception as e:
+                logger.error(f"Error loading duplicate detection checkpoint: {e}")
+        return 0, [], [], []
+
+    def save_checkpoint(self, params, next_block, rows, cols, sims):
+        tmp_path = self.checkpoint_path + '.tmp.npz'
+        np.savez(tmp_path, params=json.dumps(params), next_block=next_block,
+                 rows=np.concatenate(rows) if rows else np.empty(0, dtype=np.int64),
+                 cols=np.concatenate(cols) if cols else np.empty(0, dtype=np.int64),
+                 sims=np.concatenate(sims) if sims else np.empty(0, dtype=np.float32))
+        os.replace(tmp_path, self.checkpoint_path)
+        logger.debug(f"Saved duplicate detection checkpoint at block {next_block}")
+
+    def load_result(self):
+        if not os.path.exists(self.result_path):
+            return None
+        try:
+            with open(self.result_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading duplicate detection result: {e}")
+            return None
+
+    def save_result(self):
+        tmp_path = self.result_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.result, f, ensure_ascii=False)
+        os.replace(tmp_path, self.result_path)
+
+    def status(self, index_version=None):
+        """任务状态和最近一次结果的概要"""
+        state = 'running' if self.running else self.state
+        if state == 'idle' and os.path.exists(self.checkpoint_path):
+            state = 'interrupted'
+        status = {
+            'state': state,
+            'progress': self.progress,
+            'total': self.total,
+            'error': self.error,
+        }
+        if self.result is not None:
+            status.update({
+                'threshold': self.result['threshold'],
+                'created_at': self.result['created_at'],
+                'total_groups': len(self.result['clusters']),
+                'total_duplicates': sum(len(c['paths']) for c in self.result['clusters']),
+                'stale': index_version is not None and self.result['index_version'] != index_version,
+            })
+        return status
+
+    def get_clusters(self, offset=0, limit=20, valid_paths=None):
+        """分页获取重复组；valid_paths 不为空时去掉已不在索引中的图片"""
+        if self.result is None:
+            return [], 0
+        clusters = self.result['clusters']
+        if valid_paths is not None:
+            clusters = [{**c, 'paths': [p for p in c['paths'] if p in valid_paths]} for c in clusters]
+            clusters = [c for c in clusters if len(c['paths']) > 1]
+        return clusters[offset:offset + limit], len(clusters)
@@ -0,0 +1,33 @@
+import os
+import hashlib
+
+# 文件头尾各采样的字节数；小于两倍采样大小的文件直接对全部内容计算哈希
+SAMPLE_SIZE = 64 * 1024
+DIGEST_SIZE = 16
+
+
+def _digest(size, head, tail=b''):
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    h.update(size.to_bytes(8, 'little'))
+    h.update(head)
+    h.update(tail)
+    return h.digest()
+
+
+def fingerprint_bytes(data):
+    """计算内容指纹：文件大小 + 头尾采样内容的 blake2b 摘要（16字节）"""
+    size = len(data)
+    if size <= 2 * SAMPLE_SIZE:
+        return _digest(size, data)
+    return _digest(size, data[:SAMPLE_SIZE], data[-SAMPLE_SIZE:])
+
+
+def fingerprint_file(path):
+    """计算文件的内容指纹，与 fingerprint_bytes 对同一内容的结果一致，但只读取头尾"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        if size <= 2 * SAMPLE_SIZE:
+            return _digest(size, f.read())
+        head = f.read(SAMPLE_SIZE)
+        f.seek(-SAMPLE_SIZE, os.SEEK_END)
+        return _digest(size, head, f.read(SAMPLE_SIZE))
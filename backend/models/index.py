@@ -0,0 +1,194 @@
+import numpy as np
+import torch
+from loguru import logger
+
+from models import selection
+from models.quantize import RESCORE_FACTOR, correct_lse, exact_scores
+from models.store import similarity
+
+# CLIP 计算softmax概率时使用的温度系数
+LOGIT_SCALE = 100.0
+# 分数模式: softmax 为全库softmax概率（与早期版本一致），cosine 为余弦相似度，无需在全库上计算指数和归一化
+SCORE_MODES = ('softmax', 'cosine')
+
+
+class SearchIndex:
+    """检索索引：持有一份连续、已归一化的特征矩阵快照及其版本号
+
+    索引在数据库加载或变更时构建一次，查询期间只读，不做任何原地修改；
+    数据库更新后会整体替换为新版本的索引，因此正在进行的查询不受影响。
+    """
+    def __init__(self, features, paths, version=0, ann=None, quantized=None, normalized=False, scanner=None,
+                 metadata=None, knn=None, clusters=None, path_to_index=None):
+        if features.ndim != 2 or len(features) == 0:
+            dim = features.shape[-1] if features.ndim == 2 else 0
+            features = torch.empty((0, dim), dtype=torch.float32)
+        # 数据库中的 LiveFeatures 直接引用，只在访问的行上读取内存映射的特征
+        if isinstance(features, torch.Tensor):
+            features = features.detach().to(dtype=torch.float32)
+
+            # 已归一化的特征直接复用，避免额外拷贝；normalized=True 时连校验也跳过，
+            # 以免在内存映射的特征上触发整库读取
+            if not normalized and len(features) > 0:
+                norms = features.norm(dim=-1, keepdim=True)
+                if not torch.allclose(norms, torch.ones_like(norms), atol=1e-4):
+                    features = features / norms.clamp_min(1e-12)
+                    logger.debug("Normalized features while building search index")
+            features = features.contiguous()
+
+        self.features = features
+        self.paths = list(paths)
+        # 数据库已维护的映射直接引用（只会整体替换，不会原地修改）
+        self.path_to_index = path_to_index if path_to_index is not None else \
+            {path: idx for idx, path in enumerate(self.paths)}
+        self.version = version
+        self.ann = ann
+        # 压缩后的常驻特征（fp16/int8），为空时直接在float32特征上扫描
+        self.quantized = quantized
+        # 分片并行扫描器，为空时在单个矩阵乘上扫描全库
+        self.scanner = scanner
+        # 元数据过滤索引，为空时不支持过滤
+        self.metadata = metadata
+        # 与本版本行号一致的k近邻图，为空时相似图片检索需要扫描全库
+        self.knn = knn
+        # 与本版本行号一致的自动相册（聚类），可作为检索的粗路由层
+        self.clusters = clusters
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def dim(self):
+        return self.features.shape[1]
+
+    def get_feature(self, path=None, index=None):
+        """按路径或行号获取已存储的特征，不存在时返回 (None, -1)"""
+        if path is not None:
+            index = self.path_to_index.get(path, -1)
+        if index is None or not 0 <= index < len(self.paths):
+            return None, -1
+        return self.features[index].to(torch.float32), index
+
+    def normalize_query(self, query_features):
+        query_features = query_features.to(device=self.features.device, dtype=self.features.dtype)
+        return query_features / query_features.norm(dim=-1, keepdim=True)
+
+    def filter_rows(self, filters):
+        """根据元数据过滤条件返回候选行号，没有过滤条件时返回 None"""
+        if not filters:
+            return None
+        if self.metadata is None:
+            return np.empty(0, dtype=np.int64)
+        return self.metadata.filter(filters)
+
+    def search(self, query_features, k, threshold=0.0, rows=None, score_mode='softmax', route=0):
+        """检索每个查询最相似的k张图片
+
+        返回 (scores, indices)，形状为 [Q, k]，按分数从高到低排列，不足k个或低于阈值的位置索引为 -1。
+        score_mode 为 softmax 时分数为softmax概率，启用ANN时概率只在探测到的候选集上归一化；
+        为 cosine 时分数为余弦相似度，阈值直接作用于相似度，不随相册大小变化。
+        rows 为元数据过滤得到的行号时只在这些行上计算相似度，概率也只在这些行上归一化。
+        route 大于 0 且有自动相册时，每个查询只在最相关的 route 个聚类上计算相似度（概率同样只在这些行上归一化）。
+        """
+        if score_mode not in SCORE_MODES:
+            raise ValueError(f"Unsupported score mode: {score_mode}")
+        # cosine 模式下只需top-k，跳过全库的logsumexp
+        logit_scale = LOGIT_SCALE if score_mode == 'softmax' else None
+        query_features = self.normalize_query(query_features)
+        if route > 0 and self.clusters is not None:
+            return self.search_routed(query_features, k, threshold, rows, route, logit_scale)
+        if rows is not None:
+            return self.search_rows(query_features, k, threshold, torch.as_tensor(rows, dtype=torch.long), logit_scale)
+        if self.ann is not None:
+            values, indices, *lse = self.ann.search(query_features, k, features=self.features, logit_scale=logit_scale)
+            lse = lse[0] if lse else None
+        elif self.quantized is not None:
+            # 在压缩矩阵上扫描，再从磁盘特征库读取候选行精确重排
+            approx, candidates, lse = self.scan(
+                lambda start, end: self.quantized.scores(query_features, start, end), k * RESCORE_FACTOR,
+                logit_scale=logit_scale)
+            values, indices, lse = self.rescore(query_features, approx, candidates, lse, k, logit_scale)
+        else:
+            values, indices, lse = self.scan(
+                lambda start, end: similarity(query_features, self.features, start, end), k, logit_scale=logit_scale)
+
+        return self.to_scores(values, indices, lse, threshold)
+
+    def search_rows(self, query_features, k, threshold, rows, logit_scale=LOGIT_SCALE):
+        """只在给定行上精确检索；过滤后的候选通常远少于全库，因此不使用ANN"""
+        if len(rows) == 0:
+            empty = torch.empty((len(query_features), 0))
+            return empty, empty.long()
+        if self.quantized is not None:
+            approx, candidates, lse = self.scan(
+                lambda start, end: self.quantized.row_scores(query_features, rows[start:end]),
+                k * RESCORE_FACTOR, len(rows), logit_scale)
+            values, indices, lse = self.rescore(query_features, approx, rows[candidates], lse, k, logit_scale)
+        else:
+            values, local, lse = self.scan(
+                lambda start, end: query_features @ self.features[rows[start:end]].T, k, len(rows), logit_scale)
+            indices = rows[local]
+        return self.to_scores(values, indices, lse, threshold)
+
+    def rescore(self, query_features, approx, candidates, lse, k, logit_scale):
+        """用原始精度特征对压缩矩阵上的候选精确重排，返回 (values, indices, lse)
+
+        lse 来自近似分数，其中候选的近似项替换为精确项，保证softmax概率的分子分母使用相同的分数。
+        """
+        exact = exact_scores(self.features, query_features, candidates)
+        if lse is not None:
+            lse = correct_lse(lse, approx, exact, logit_scale)
+        values, order = selection.topk(exact, k)
+        return values, torch.gather(candidates, -1, order), lse
+
+    def neighbors(self, index, k, threshold=0.0, score_mode='softmax'):
+        """从k近邻图中读取图片自身及其近邻，返回形状为 [1, k] 的 (scores, indices)
+
+        分数与 search 以该图片特征为查询时一致；近邻图不可用或k超出图的容量时返回 None。
+        """
+        if score_mode not in SCORE_MODES:
+            raise ValueError(f"Unsupported score mode: {score_mode}")
+        if self.knn is None or k > self.knn.k + 1 or not 0 <= index < len(self):
+            return None
+        neighbors, sims = self.knn.get_neighbors(index, k - 1)
+        feature = self.features[index]
+        values = torch.cat([(feature @ feature).reshape(1), torch.from_numpy(sims)]).unsqueeze(0)
+        indices = torch.cat([torch.tensor([index]), torch.from_numpy(neighbors.astype(np.int64))]).unsqueeze(0)
+        lse = torch.tensor([self.knn.lse[index]], dtype=torch.float32) if score_mode == 'softmax' else None
+        return self.to_scores(values, indices, lse, threshold)
+
+    def search_routed(self, query_features, k, threshold, rows, route, logit_scale=LOGIT_SCALE):
+        """逐个查询通过聚类中心路由到候选行，再在候选行（与过滤结果的交集）上精确检索"""
+        all_scores = torch.zeros((len(query_features), k))
+        all_indices = torch.full((len(query_features), k), -1, dtype=torch.long)
+        for qi, query in enumerate(query_features):
+            candidates = self.clusters.route(query.unsqueeze(0), route)
+            if rows is not None:
+                candidates = np.intersect1d(candidates, rows, assume_unique=True)
+            scores, indices = self.search_rows(query.unsqueeze(0), k, threshold,
+                                               torch.as_tensor(candidates, dtype=torch.long), logit_scale)
+            all_scores[qi, :scores.shape[1]] = scores[0]
+            all_indices[qi, :indices.shape[1]] = indices[0]
+        return all_scores, all_indices
+
+    def to_scores(self, values, indices, lse, threshold):
+        """将候选的相似度转换为返回的分数；lse 为空时直接返回余弦相似度"""
+        # softmax单调，先按相似度取top-k，再只对候选计算概率
+        scores = torch.exp(LOGIT_SCALE * values - lse.unsqueeze(-1)) if lse is not None else values
+        invalid = indices < 0
+        if threshold > 0:
+            invalid |= scores <= threshold
+        return scores.masked_fill(invalid, 0.0), indices.masked_fill(invalid, -1)
+
+    def scan(self, score_shard, k, n=None, logit_scale=LOGIT_SCALE):
+        """扫描 n 行（默认全库），返回 (values, indices, lse)；配置了扫描器时按分片并行计算
+
+        logit_scale 为空时不计算 logsumexp，lse 返回 None。
+        """
+        n = len(self) if n is None else n
+        if self.scanner is not None and n > 0:
+            return self.scanner.scan(score_shard, n, k, logit_scale)
+        similarity = score_shard(0, n)
+        lse = torch.logsumexp(logit_scale * similarity, dim=-1) if logit_scale is not None else None
+        values, indices = selection.topk(similarity, k)
+        return values, indices, lse
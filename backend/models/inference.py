@@ -0,0 +1,126 @@
+import time
+import queue
+import threading
+import functools
+from collections import deque
+from concurrent.futures import Future
+import torch
+from loguru import logger
+
+from models.model import get_model, get_tokenizer
+
+# 每次前向计算最多合并的样本数
+DEFAULT_MAX_BATCH = 64
+# 收到第一个请求后等待其他请求加入同一批的最长时间（毫秒）
+DEFAULT_MAX_DELAY_MS = 5
+
+
+class InferenceRequest:
+    def __init__(self, kind, inputs):
+        self.kind = kind
+        self.inputs = inputs
+        self.future = Future()
+
+    def __len__(self):
+        return len(self.inputs)
+
+
+class InferenceService:
+    """进程内共享的推理服务
+
+    唯一持有模型的对象。建库和检索都把编码请求提交到队列，由单个推理线程执行：
+    收到请求后在 max_delay_ms 内继续收集同类请求（图像或文本），合并为最多 max_batch 个样本的一批做一次前向计算，
+    再把结果按请求拆分返回。并发的文本搜索因此共享前向计算，而不是排队依次执行。
+    算子内线程数是进程级设置，由 DataBase 在启动时设置一次，这里不再修改。
+    """
+    def __init__(self, device="cpu", lang="en", max_batch=DEFAULT_MAX_BATCH, max_delay_ms=DEFAULT_MAX_DELAY_MS):
+        self.device = device
+        self.model, self.preprocess = get_model(device, lang=lang)
+        self.tokenizer = get_tokenizer(lang=lang)
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max(0, max_delay_ms) / 1000
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.batch_count = 0
+        self.sample_count = 0
+        self.thread = threading.Thread(target=self.serve, name='inference', daemon=True)
+        self.thread.start()
+
+    def encode_images(self, images):
+        """编码预处理后的图像张量 [B, C, H, W]，返回未归一化的 [B, D] 特征"""
+        return self.submit('image', images).result()
+
+    def encode_texts(self, texts):
+        """编码文本列表，返回未归一化的 [B, D] 特征；分词在调用线程中完成"""
+        return self.submit('text', self.tokenizer(texts)).result()
+
+    def submit(self, kind, inputs):
+        request = InferenceRequest(kind, inputs)
+        self.requests.put(request)
+        return request.future
+
+    def serve(self):
+        logger.info(f"Inference service started: max_batch={self.max_batch}, "
+                    f"max_delay={self.max_delay * 1000:.1f}ms, intra_op_threads={torch.get_num_threads()}")
+        # 收集时遇到的另一类请求或放不下的请求，留到下一批
+        deferred = deque()
+        while True:
+            first = deferred.popleft() if deferred else self.requests.get()
+            batch, size = [first], len(first)
+            for request in list(deferred):
+                if request.kind == first.kind and size + len(request) <= self.max_batch:
+                    deferred.remove(request)
+                    batch.append(request)
+                    size += len(request)
+
+            deadline = time.monotonic() + self.max_delay
+            while size < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request.kind == first.kind and size + len(request) <= self.max_batch:
+                    batch.append(request)
+                    size += len(request)
+                else:
+                    deferred.append(request)
+            self.run(first.kind, batch)
+
+    def run(self, kind, batch):
+        try:
+            inputs = torch.cat([request.inputs for request in batch]).to(self.device)
+            with torch.no_grad():
+                if kind == 'image':
+                    features = self.model.encode_image(inputs)
+                else:
+                    features = self.model.encode_text(inputs)
+            features = features.float().cpu()
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        with self.lock:
+            self.request_count += len(batch)
+            self.batch_count += 1
+            self.sample_count += len(features)
+        for request, request_features in zip(batch, torch.split(features, [len(r) for r in batch])):
+            request.future.set_result(request_features)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': self.request_count,
+                'batches': self.batch_count,
+                'samples': self.sample_count,
+                'avg_requests_per_batch': round(self.request_count / self.batch_count, 2) if self.batch_count else 0,
+            }
+
+
+@functools.lru_cache(maxsize=4)
+def get_inference_service(device="cpu", lang="en", max_batch=DEFAULT_MAX_BATCH, max_delay_ms=DEFAULT_MAX_DELAY_MS):
+    """相同配置的建库和检索共用一个推理服务"""
+    return InferenceService(device, lang, max_batch, max_delay_ms)
@@ -0,0 +1,106 @@
+import os
+import json
+import zlib
+import struct
+import numpy as np
+import torch
+from loguru import logger
+
+# 每条记录: 魔数, 元信息长度, 数组数据长度, CRC32(元信息 + 数组数据)，其后依次为 JSON 元信息和数组数据
+RECORD_HEADER = struct.Struct('<4sIQI')
+RECORD_MAGIC = b'CAJ1'
+
+
+class Journal:
+    """特征库的追加式变更日志
+
+    每次更新只把变更（修改的行、删除的行号、新增的行）作为一条记录追加到日志末尾并 fsync，
+    写入量与变更的大小成正比；日志与特征库的某一代对应（journal.<gen>.log），合并后随旧代一起删除。
+    加载时在该代的数据上按顺序重放全部记录；崩溃导致的残缺记录在重放时截断。
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def append(self, record, arrays):
+        """追加一条记录；record 为可序列化为 JSON 的字典，arrays 为 {名称: numpy 数组}"""
+        layout, chunks, offset = [], [], 0
+        for name, array in arrays.items():
+            data = np.ascontiguousarray(array).tobytes()
+            layout.append({'name': name, 'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset})
+            chunks.append(data)
+            offset += len(data)
+        meta = json.dumps(dict(record, arrays=layout), ensure_ascii=False).encode('utf-8')
+        payload = b''.join(chunks)
+        checksum = zlib.crc32(payload, zlib.crc32(meta))
+        with open(self.path, 'ab') as f:
+            f.write(RECORD_HEADER.pack(RECORD_MAGIC, len(meta), len(payload), checksum))
+            f.write(meta)
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        return RECORD_HEADER.size + len(meta) + len(payload)
+
+    def replay(self):
+        """按写入顺序产出 (record, arrays)；遇到残缺或损坏的记录时截断日志并停止"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset < len(data):
+            end = offset + RECORD_HEADER.size
+            if end > len(data):
+                break
+            magic, meta_size, payload_size, checksum = RECORD_HEADER.unpack_from(data, offset)
+            meta = data[end:end + meta_size]
+            payload = data[end + meta_size:end + meta_size + payload_size]
+            if (magic != RECORD_MAGIC or len(meta) != meta_size or len(payload) != payload_size
+                    or zlib.crc32(payload, zlib.crc32(meta)) != checksum):
+                break
+            record = json.loads(meta.decode('utf-8'))
+            arrays = {
+                item['name']: np.frombuffer(payload, dtype=np.dtype(item['dtype']),
+                                            count=int(np.prod(item['shape'], dtype=np.int64)),
+                                            offset=item['offset']).reshape(item['shape'])
+                for item in record.pop('arrays')
+            }
+            yield record, arrays
+            offset = end + meta_size + payload_size
+
+        if offset < len(data):
+            logger.warning(f"Truncating {len(data) - offset} bytes of incomplete journal records in {self.path}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(offset)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def apply_record(features, paths, columns, record, arrays):
+    """在内存中的数据上重放一条记录，依次为: 修改已有行、删除行、追加新行；返回 (features, paths, columns)
+
+    features 为 models.store.LiveFeatures，删除和追加都不会复制底层映射的特征。
+    """
+    for i, row in enumerate(arrays['set_rows'].tolist()):
+        paths[row] = record['set_paths'][i]
+        for name, column in columns.items():
+            if f'set.{name}' in arrays:
+                column[row] = arrays[f'set.{name}'][i]
+
+    removed = arrays['removed']
+    if len(removed) > 0:
+        keep = np.ones(len(paths), dtype=bool)
+        keep[removed] = False
+        features = features.remove(removed)
+        paths = [path for path, kept in zip(paths, keep.tolist()) if kept]
+        columns = {name: column[keep] for name, column in columns.items()}
+
+    if record['append_paths']:
+        features = features.append(torch.from_numpy(arrays['append_features'].copy()))
+        paths = paths + record['append_paths']
+        # 记录中没有的列无法与新行对齐，直接丢弃（加载时缺列的元数据会被忽略）
+        columns = {name: np.concatenate([column, arrays[f'append.{name}']]) for name, column in columns.items()
+                   if f'append.{name}' in arrays}
+    return features, paths, columns
@@ -0,0 +1,179 @@
+import os
+import time
+import numpy as np
+import torch
+from loguru import logger
+
+from models.index import LOGIT_SCALE
+from models.store import similarity
+
+# 每张图片保存的近邻数
+DEFAULT_K = 16
+# 分块计算相似度的块大小，单个块的临时内存为 block_size^2 * 4 字节
+DEFAULT_BLOCK_SIZE = 4096
+# 删除图片后剩余的softmax分母过小时，相减会损失精度，改为重新计算该行
+LSE_REMOVE_TOLERANCE = 1e-6
+
+
+def get_knn_path(dump_path):
+    """k近邻图保存在数据库文件旁边"""
+    return os.path.splitext(dump_path)[0] + '.knn.npz'
+
+
+def scan_rows(row_ids, features, k, block_size=DEFAULT_BLOCK_SIZE):
+    """分块计算给定行与全部特征的相似度，返回每行（不含自身）的top-k近邻和全库的 logsumexp
+
+    返回 (sims [R, k] float32, neighbors [R, k] int64, lse [R] float64)，不足k个的位置为 -inf / -1。
+    """
+    n = len(features)
+    row_ids = torch.as_tensor(row_ids, dtype=torch.long)
+    rows = features[row_ids].to(torch.float32)
+    sims = torch.full((len(rows), k), float('-inf'))
+    neighbors = torch.full((len(rows), k), -1, dtype=torch.long)
+    lse = torch.full((len(rows),), float('-inf'), dtype=torch.float64)
+    for col_start in range(0, n, block_size):
+        col_ids = torch.arange(col_start, min(col_start + block_size, n))
+        tile = similarity(rows, features, col_start, col_start + block_size)
+        # softmax的分母包含自身，与检索时一致
+        lse = torch.logaddexp(lse, torch.logsumexp(LOGIT_SCALE * tile, dim=-1).double())
+        tile.masked_fill_(col_ids.unsqueeze(0) == row_ids.unsqueeze(1), float('-inf'))
+        sims, neighbors = merge_neighbors(sims, neighbors, tile, col_ids.expand_as(tile), k)
+    return sims, neighbors, lse
+
+
+def merge_neighbors(sims, neighbors, new_sims, new_neighbors, k):
+    """将候选并入每行已有的top-k近邻"""
+    values, order = torch.topk(torch.cat([sims, new_sims], dim=-1), k, dim=-1)
+    indices = torch.cat([neighbors, new_neighbors], dim=-1).gather(-1, order)
+    return values, indices.masked_fill(torch.isinf(values), -1)
+
+
+class KnnGraph:
+    """全库k近邻图
+
+    每行保存 k 个近邻的行号（int32）和余弦相似度，以及该行对全库相似度的 logsumexp，
+    因此相似图片检索和随机漫游无需扫描全库，softmax分数也与精确检索一致。
+    图片增删时只增量修补：新增的行做一次全库扫描，旧行只与新增的行比较；删除时重映射行号，
+    从 logsumexp 中减去被删除图片的贡献，近邻被删除的行标记为待修复，在下次 update 时重新计算。
+    每次修改都返回新的对象，正在使用旧图的查询不受影响。
+    """
+    def __init__(self, k=DEFAULT_K, neighbors=None, sims=None, lse=None, dirty=None,
+                 block_size=DEFAULT_BLOCK_SIZE):
+        self.k = k
+        self.block_size = block_size
+        self.neighbors = neighbors if neighbors is not None else np.empty((0, k), dtype=np.int32)
+        self.sims = sims if sims is not None else np.empty((0, k), dtype=np.float32)
+        self.lse = lse if lse is not None else np.empty(0, dtype=np.float64)
+        # 近邻列表不完整、需要重新计算的行
+        self.dirty = dirty if dirty is not None else np.empty(0, dtype=np.int64)
+        self.index_version = None
+
+    @property
+    def count(self):
+        return len(self.neighbors)
+
+    def __len__(self):
+        return self.count
+
+    def _copy(self, neighbors, sims, lse, dirty):
+        return KnnGraph(self.k, neighbors, sims, lse, dirty, self.block_size)
+
+    def needs_update(self, n):
+        return self.count != n or len(self.dirty) > 0
+
+    def get_neighbors(self, row, count=None):
+        """返回 (近邻行号, 余弦相似度)，按相似度从高到低排列"""
+        neighbors, sims = self.neighbors[row], self.sims[row]
+        valid = neighbors >= 0
+        neighbors, sims = neighbors[valid], sims[valid]
+        if count is not None:
+            neighbors, sims = neighbors[:count], sims[:count]
+        return neighbors, sims
+
+    def update(self, features):
+        """为 features 中超出当前行数的新行建立近邻并修复待修复的行，返回新的图"""
+        n, start = len(features), self.count
+        if start > n:
+            raise ValueError(f"Graph has {start} rows but only {n} features are given")
+        start_time = time.time()
+        neighbors = torch.from_numpy(self.neighbors.astype(np.int64))
+        sims = torch.from_numpy(self.sims.copy())
+        lse = torch.from_numpy(self.lse.copy())
+
+        if start < n:
+            # 旧行只需与新增的行比较
+            new_features = features[start:].to(torch.float32)
+            for row_start in range(0, start, self.block_size):
+                row_end = min(row_start + self.block_size, start)
+                rows = features[row_start:row_end].to(torch.float32)
+                for col_start in range(0, n - start, self.block_size):
+                    tile = rows @ new_features[col_start:col_start + self.block_size].T
+                    col_ids = torch.arange(start + col_start, start + col_start + tile.shape[1])
+                    lse[row_start:row_end] = torch.logaddexp(
+                        lse[row_start:row_end], torch.logsumexp(LOGIT_SCALE * tile, dim=-1).double())
+                    sims[row_start:row_end], neighbors[row_start:row_end] = merge_neighbors(
+                        sims[row_start:row_end], neighbors[row_start:row_end], tile, col_ids.expand_as(tile), self.k)
+            # 新增的行做一次全库扫描
+            new_parts = [scan_rows(torch.arange(row_start, min(row_start + self.block_size, n)), features,
+                                   self.k, self.block_size)
+                         for row_start in range(start, n, self.block_size)]
+            sims = torch.cat([sims] + [part[0] for part in new_parts])
+            neighbors = torch.cat([neighbors] + [part[1] for part in new_parts])
+            lse = torch.cat([lse] + [part[2] for part in new_parts])
+
+        for block_start in range(0, len(self.dirty), self.block_size):
+            rows = torch.from_numpy(self.dirty[block_start:block_start + self.block_size])
+            sims[rows], neighbors[rows], lse[rows] = scan_rows(rows, features, self.k, self.block_size)
+
+        logger.info(f"Updated k-NN graph: {n - start} new rows, {len(self.dirty)} repaired rows "
+                    f"in {time.time() - start_time:.2f}s")
+        return self._copy(neighbors.numpy().astype(np.int32), sims.numpy(), lse.numpy(),
+                          np.empty(0, dtype=np.int64))
+
+    def remove(self, indices, features):
+        """删除给定行（features 为删除前的特征），返回新的图"""
+        removed = np.zeros(self.count, dtype=bool)
+        removed[np.asarray(indices, dtype=np.int64)] = True
+        keep = np.flatnonzero(~removed)
+        remap = np.full(self.count + 1, -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+
+        # 重映射近邻行号，被删除的近邻排到末尾，失去近邻的行需要补全
+        neighbors = remap[self.neighbors[keep]]
+        sims = np.where(neighbors >= 0, self.sims[keep], -np.inf).astype(np.float32)
+        lost = (neighbors < 0) & (self.neighbors[keep] >= 0)
+        order = np.argsort(-sims, axis=1, kind='stable')
+        neighbors = np.take_along_axis(neighbors, order, axis=1).astype(np.int32)
+        sims = np.take_along_axis(sims, order, axis=1)
+        dirty = lost.any(axis=1)
+
+        # 从每行的 logsumexp 中减去被删除图片的贡献
+        lse = self.lse[keep].copy()
+        removed_features = features[torch.from_numpy(np.flatnonzero(removed))].to(torch.float32)
+        for row_start in range(0, len(keep), self.block_size):
+            rows = torch.from_numpy(keep[row_start:row_start + self.block_size])
+            removed_lse = torch.logsumexp(LOGIT_SCALE * (features[rows].to(torch.float32) @ removed_features.T),
+                                          dim=-1).double().numpy()
+            ratio = np.exp(removed_lse - lse[row_start:row_start + len(rows)])
+            lse[row_start:row_start + len(rows)] += np.log1p(-np.minimum(ratio, 1 - LSE_REMOVE_TOLERANCE))
+            dirty[row_start:row_start + len(rows)] |= ratio > 1 - LSE_REMOVE_TOLERANCE
+
+        # 修复行在删除后的行号空间中
+        old_dirty = remap[self.dirty]
+        dirty_rows = np.union1d(np.flatnonzero(dirty), old_dirty[old_dirty >= 0])
+        return self._copy(neighbors, sims, lse, dirty_rows)
+
+    def save(self, path, index_version):
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, k=self.k, index_version=index_version, neighbors=self.neighbors,
+                 sims=self.sims, lse=self.lse, dirty=self.dirty)
+        os.replace(tmp_path, path)
+        self.index_version = index_version
+        logger.info(f"Saved k-NN graph with {self.count} rows to {path}")
+
+    @classmethod
+    def load(cls, path, block_size=DEFAULT_BLOCK_SIZE):
+        data = np.load(path)
+        graph = cls(int(data['k']), data['neighbors'], data['sims'], data['lse'], data['dirty'], block_size)
+        graph.index_version = int(data['index_version'])
+        return graph
@@ -0,0 +1,182 @@
+import os
+import math
+import threading
+from datetime import datetime
+import numpy as np
+from PIL import Image
+from loguru import logger
+
+# 与行对齐、持久化到特征库的数值列；目录和扩展名可由路径推出，无需存储
+METADATA_FIELDS = ('mtime', 'taken', 'width', 'height', 'size')
+METADATA_DTYPES = {'mtime': np.float64, 'taken': np.float64, 'width': np.int32, 'height': np.int32, 'size': np.int64}
+# 用于判断文件是否变化的列在元组中的位置
+METADATA_MTIME = METADATA_FIELDS.index('mtime')
+METADATA_SIZE = METADATA_FIELDS.index('size')
+# EXIF 拍摄时间（Exif IFD 中的 DateTimeOriginal）与修改时间（主 IFD 中的 DateTime）
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 36867
+EXIF_DATETIME = 306
+# 支持的过滤条件
+FILTER_KEYS = ('folder', 'ext', 'date_from', 'date_to', 'min_size', 'max_size',
+               'min_width', 'max_width', 'min_height', 'max_height')
+
+
+def _parse_exif_datetime(value):
+    try:
+        return datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S').timestamp()
+    except (ValueError, OverflowError, OSError):
+        return math.nan
+
+
+def read_exif_taken(image):
+    """读取EXIF拍摄时间（时间戳），不存在时返回 nan"""
+    try:
+        exif = image.getexif()
+        value = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+    except Exception:
+        return math.nan
+    return _parse_exif_datetime(value) if value else math.nan
+
+
+def image_metadata(path, image, size):
+    """提取特征时顺带记录的元数据，返回按 METADATA_FIELDS 排列的元组"""
+    width, height = image.size
+    return (os.path.getmtime(path), read_exif_taken(image), width, height, size)
+
+
+def read_image_metadata(path):
+    """只读取文件头获取元数据，用于补全旧数据库中缺失的记录"""
+    with Image.open(path) as image:
+        return image_metadata(path, image, os.path.getsize(path))
+
+
+def parse_date(value, end_of_day=False):
+    """解析过滤条件中的日期：时间戳数字或 ISO 格式字符串（只有日期时 date_to 包含当天）"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    parsed = datetime.fromisoformat(text)
+    if end_of_day and len(text) <= 10:
+        return parsed.timestamp() + 86400 - 1e-3
+    return parsed.timestamp()
+
+
+class MetadataIndex:
+    """元数据过滤索引
+
+    目录和扩展名按字典编码，每个取值保存一份有序的行号列表（倒排表）；
+    日期、文件大小和宽高保存按值排序的行号，范围条件通过二分查找得到行号集合。
+    过滤结果为有序行号数组，检索只在这些行上计算相似度。索引在首次过滤时构建。
+    """
+    def __init__(self, paths, columns):
+        self.paths = paths
+        self.columns = columns
+        self.lock = threading.Lock()
+        self.built = False
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _encode(self, values):
+        ids, names = np.empty(len(values), dtype=np.int32), {}
+        for i, value in enumerate(values):
+            ids[i] = names.setdefault(value, len(names))
+        order = np.argsort(ids, kind='stable')
+        starts = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ids, minlength=len(names)), out=starts[1:])
+        return list(names), order, starts
+
+    def _sorted(self, values):
+        order = np.argsort(values, kind='stable')
+        return values[order], order
+
+    def build(self):
+        with self.lock:
+            if self.built:
+                return
+            self.folders, self.folder_order, self.folder_starts = self._encode(
+                [os.path.normcase(os.path.dirname(p)) for p in self.paths])
+            self.extensions, self.ext_order, self.ext_starts = self._encode(
+                [os.path.splitext(p)[1].lower().lstrip('.') for p in self.paths])
+            # 有拍摄时间时按拍摄时间，否则按文件修改时间
+            taken, mtime = self.columns['taken'], self.columns['mtime']
+            self.ranges = {
+                'date': self._sorted(np.where(np.isnan(taken), mtime, taken)),
+                'size': self._sorted(self.columns['size']),
+                'width': self._sorted(self.columns['width']),
+                'height': self._sorted(self.columns['height']),
+            }
+            self.built = True
+
+    def _category_rows(self, names, order, starts, selected):
+        selected = set(selected)
+        rows = [order[starts[i]:starts[i + 1]] for i, name in enumerate(names) if name in selected]
+        return np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+
+    def _folder_rows(self, folders):
+        prefixes = [os.path.normcase(os.path.normpath(folder)) for folder in folders]
+        selected = [name for name in self.folders
+                    if any(name == prefix or name.startswith(prefix.rstrip(os.sep) + os.sep) for prefix in prefixes)]
+        return self._category_rows(self.folders, self.folder_order, self.folder_starts, selected)
+
+    def _range_rows(self, name, low=None, high=None):
+        values, order = self.ranges[name]
+        start = 0 if low is None else np.searchsorted(values, low, side='left')
+        # nan 排在最后，上界为空时也不包含缺失值
+        end = np.searchsorted(values, np.inf if high is None else high, side='right')
+        return order[start:end]
+
+    def filter(self, filters):
+        """根据过滤条件返回有序的行号数组；没有过滤条件时返回 None 表示检索全库
+
+        folder 包含子目录；ext 不区分大小写；date_from/date_to 为拍摄日期（无EXIF时为修改时间）；
+        min_/max_ 前缀的条件为闭区间。
+        """
+        filters = {key: value for key, value in (filters or {}).items() if value not in (None, '', [])}
+        if not filters:
+            return None
+        unknown = set(filters) - set(FILTER_KEYS)
+        if unknown:
+            raise ValueError(f"Unsupported filters: {', '.join(sorted(unknown))}")
+        self.build()
+
+        selections = []
+        if 'folder' in filters:
+            folders = filters['folder']
+            selections.append(self._folder_rows([folders] if isinstance(folders, str) else folders))
+        if 'ext' in filters:
+            extensions = filters['ext']
+            extensions = [extensions] if isinstance(extensions, str) else extensions
+            selections.append(self._category_rows(self.extensions, self.ext_order, self.ext_starts,
+                                                  [e.lower().lstrip('.') for e in extensions]))
+        if 'date_from' in filters or 'date_to' in filters:
+            low = parse_date(filters['date_from']) if 'date_from' in filters else None
+            high = parse_date(filters['date_to'], end_of_day=True) if 'date_to' in filters else None
+            selections.append(self._range_rows('date', low, high))
+        for name in ('size', 'width', 'height'):
+            if f'min_{name}' in filters or f'max_{name}' in filters:
+                selections.append(self._range_rows(name, filters.get(f'min_{name}'), filters.get(f'max_{name}')))
+
+        # 先从最小的集合开始求交集，越严格的过滤条件计算量越小
+        selections.sort(key=len)
+        mask = np.zeros(len(self.paths), dtype=bool)
+        mask[selections[0]] = True
+        for rows in selections[1:]:
+            if not mask.any():
+                break
+            other = np.zeros(len(self.paths), dtype=bool)
+            other[rows] = True
+            mask &= other
+        rows = np.flatnonzero(mask)
+        logger.debug(f"Metadata filter {filters} matched {len(rows)}/{len(self.paths)} images")
+        return rows
+
+    def facets(self):
+        """可用于过滤的目录和扩展名（及对应图片数）"""
+        self.build()
+        return {
+            'folders': {name: int(self.folder_starts[i + 1] - self.folder_starts[i])
+                        for i, name in enumerate(self.folders)},
+            'extensions': {name: int(self.ext_starts[i + 1] - self.ext_starts[i])
+                           for i, name in enumerate(self.extensions)},
+        }
@@ -17,6 +17,13 @@ def get_model(device="cpu", lang="en"):
     return model, preprocess
 
 
+def get_model_name(lang="en"):
+    """模型标识，用于区分不同模型产生的特征缓存"""
+    if lang == "zh-cn":
+        return "cn_clip/ViT-B-16"
+    return "open_clip/ViT-B-16/laion2b_s34b_b88k"
+
+
 @functools.lru_cache(maxsize=4)
 def get_tokenizer(lang="en"):
     if lang == "zh-cn":
@@ -0,0 +1,232 @@
+import queue
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import torch
+from loguru import logger
+
+# 每次前向计算的图片数
+DEFAULT_BATCH_SIZE = 64
+# 解码队列中最多等待的图片数（默认为批大小的4倍），限制预处理后张量占用的内存
+QUEUE_BATCHES = 4
+# 解码线程在队列已满时检查停止标志的间隔（秒）
+PUT_TIMEOUT = 0.5
+# 使用进程池解码的最少图片数，图片较少时启动进程的开销得不偿失
+MIN_PROCESS_IMAGES = 1000
+# 等待解码进程结果的间隔（秒），超时后检查是否有进程异常退出
+READY_TIMEOUT = 1.0
+
+_DONE = object()
+
+
+class LoadError:
+    """解码或预处理失败的图片"""
+    def __init__(self, path, error):
+        self.path = path
+        self.error = error
+
+
+def _decode_process(load, memory_name, shape, tasks, free_slots, ready):
+    """解码进程：预处理后的张量写入共享内存中的空闲槽位，只把槽位号和附加信息发回主进程"""
+    torch.set_num_threads(1)
+    memory = shared_memory.SharedMemory(name=memory_name)
+    ring = np.ndarray(shape, dtype=np.float32, buffer=memory.buf)
+    try:
+        while True:
+            path = tasks.get()
+            if path is None:
+                break
+            try:
+                tensor, extra = load(path)
+                if tuple(tensor.shape) != tuple(shape[1:]):
+                    raise ValueError(f"Unexpected tensor shape {tuple(tensor.shape)}, expected {tuple(shape[1:])}")
+            except Exception as e:
+                ready.put((path, None, f"{type(e).__name__}: {e}"))
+                continue
+            slot = free_slots.get()
+            ring[slot] = tensor.numpy()
+            ready.put((path, slot, extra))
+    finally:
+        del ring
+        memory.close()
+        ready.put(None)
+
+
+class EmbeddingPipeline:
+    """批量提取图片特征的流水线
+
+    多个解码线程读取、解码并预处理图片，放入有界队列；单个推理阶段从队列中凑满一批后做一次前向计算。
+    processes 大于 0 时改用解码进程（不受GIL限制），预处理后的张量经共享内存环形缓冲区传回，
+    此时需要提供预处理输出的形状 sample_shape。
+    解码失败的图片直接跳过；整批前向计算失败时逐张重试，只丢弃出错的图片。
+    load(path) 返回 (图像张量, 附加信息)；encode(batch) 对 [B, C, H, W] 张量返回 [B, D] 特征。
+    """
+    def __init__(self, load, encode, batch_size=DEFAULT_BATCH_SIZE, workers=4, queue_size=None, on_error=None,
+                 processes=0, sample_shape=None):
+        self.load = load
+        self.encode = encode
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.queue_size = queue_size or self.batch_size * QUEUE_BATCHES
+        self.on_error = on_error
+        self.processes = processes if sample_shape is not None else 0
+        self.sample_shape = sample_shape
+
+    def run(self, paths):
+        """逐批产出 (paths, extras, features)，顺序与输入不一定一致"""
+        paths = list(paths)
+        if self.processes > 0 and len(paths) >= MIN_PROCESS_IMAGES:
+            items = self.process_items(paths)
+        else:
+            items = self.thread_items(paths)
+        batch = []
+        for item in items:
+            if isinstance(item, LoadError):
+                self.report(item.path, item.error)
+                continue
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield from self.encode_batch(batch)
+                batch = []
+        if batch:
+            yield from self.encode_batch(batch)
+
+    def thread_items(self, paths):
+        """在解码线程中读取并预处理图片，逐个产出 (path, tensor, extra) 或 LoadError"""
+        tasks = iter(paths)
+        tasks_lock = threading.Lock()
+        items = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    items.put(item, timeout=PUT_TIMEOUT)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def worker():
+            try:
+                while not stop.is_set():
+                    with tasks_lock:
+                        path = next(tasks, None)
+                    if path is None:
+                        break
+                    try:
+                        tensor, extra = self.load(path)
+                        item = (path, tensor, extra)
+                    except Exception as e:
+                        item = LoadError(path, e)
+                    if not put(item):
+                        break
+            finally:
+                put(_DONE)
+
+        threads = [threading.Thread(target=worker, name=f'decode-{i}', daemon=True) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            finished = 0
+            while finished < len(threads):
+                item = items.get()
+                if item is _DONE:
+                    finished += 1
+                else:
+                    yield item
+        finally:
+            # 提前退出时让解码线程尽快结束
+            stop.set()
+            while True:
+                try:
+                    items.get_nowait()
+                except queue.Empty:
+                    break
+            for thread in threads:
+                thread.join()
+
+    def process_items(self, paths):
+        """在进程池中读取并预处理图片，张量通过共享内存环形缓冲区传回，不经过序列化
+
+        环形缓冲区的每个槽位存放一张预处理后的图片；空闲槽位号和已填充的槽位号通过队列传递，
+        主进程取出张量后立即归还槽位。load 必须可以被序列化（模块级函数或 functools.partial）。
+        解码进程异常退出（如内存不足被杀死）时不会发出结束标记，抛出 BrokenProcessPool 而不是一直等待。
+        """
+        context = multiprocessing.get_context('spawn')
+        # 槽位数至少要容纳一整批再加上每个进程手中的一张，否则推理阶段会一直等不满一批
+        slots = max(self.queue_size, self.batch_size + self.processes)
+        shape = (slots,) + tuple(self.sample_shape)
+        memory = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+        ring = torch.from_numpy(np.ndarray(shape, dtype=np.float32, buffer=memory.buf))
+        tasks, free_slots, ready = context.Queue(), context.Queue(), context.Queue()
+        for slot in range(slots):
+            free_slots.put(slot)
+        for path in paths:
+            tasks.put(path)
+        for _ in range(self.processes):
+            tasks.put(None)
+
+        processes = [context.Process(target=_decode_process, name=f'decode-{i}', daemon=True,
+                                     args=(self.load, memory.name, shape, tasks, free_slots, ready))
+                     for i in range(self.processes)]
+        for process in processes:
+            process.start()
+        logger.info(f"Started {len(processes)} decode processes with a {slots}-slot shared-memory ring")
+
+        try:
+            finished = 0
+            while finished < len(processes):
+                try:
+                    message = ready.get(timeout=READY_TIMEOUT)
+                except queue.Empty:
+                    for process in processes:
+                        if process.exitcode not in (None, 0):
+                            raise BrokenProcessPool(f"Decode process {process.name} exited unexpectedly "
+                                                    f"with code {process.exitcode}")
+                    continue
+                if message is None:
+                    finished += 1
+                    continue
+                path, slot, extra = message
+                if slot is None:
+                    yield LoadError(path, extra)
+                    continue
+                tensor = ring[slot].clone()
+                free_slots.put(slot)
+                yield path, tensor, extra
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+            del ring
+            memory.close()
+            memory.unlink()
+
+    def encode_batch(self, batch):
+        paths, tensors, extras = zip(*batch)
+        try:
+            features = self.encode(torch.stack(tensors))
+            yield list(paths), list(extras), features
+            return
+        except Exception as e:
+            logger.warning(f"Batch of {len(batch)} images failed ({e}), retrying one by one")
+
+        kept_paths, kept_extras, features = [], [], []
+        for path, tensor, extra in batch:
+            try:
+                features.append(self.encode(tensor.unsqueeze(0)))
+                kept_paths.append(path)
+                kept_extras.append(extra)
+            except Exception as e:
+                self.report(path, e)
+        if features:
+            yield kept_paths, kept_extras, torch.cat(features)
+
+    def report(self, path, error):
+        if self.on_error is not None:
+            self.on_error(path, error)
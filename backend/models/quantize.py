@@ -0,0 +1,159 @@
+import torch
+from loguru import logger
+
+from models import selection
+
+PRECISIONS = ('fp32', 'fp16', 'int8')
+# 反量化扫描时每块的行数，块转换后的float32数据应能放进CPU缓存
+SCAN_CHUNK_SIZE = 4096
+# 在压缩矩阵上取 k * RESCORE_FACTOR 个候选，再用原始特征精确重排
+RESCORE_FACTOR = 10
+
+
+class QuantizedFeatures:
+    """压缩存储的特征矩阵
+
+    fp16: 直接转换为半精度，内存减半；
+    int8: 按行缩放，每行保存一个float32缩放系数，内存约为原来的1/4。
+    每行独立量化，删除或追加行时返回新的对象并复用已有的压缩数据，正在使用旧对象的检索索引不受影响。
+    """
+    def __init__(self, features, precision='int8'):
+        if precision not in ('fp16', 'int8'):
+            raise ValueError(f"Unsupported precision: {precision}")
+        self.precision = precision
+        self.scales = None
+
+        chunks, scales = [], []
+        for start in range(0, len(features), SCAN_CHUNK_SIZE):
+            chunk = features[start:start + SCAN_CHUNK_SIZE].to(torch.float32)
+            if precision == 'fp16':
+                chunks.append(chunk.to(torch.float16))
+            else:
+                scale = chunk.abs().amax(dim=-1).clamp_min(1e-12) / 127.0
+                chunks.append(torch.round(chunk / scale.unsqueeze(-1)).to(torch.int8))
+                scales.append(scale)
+        dim = features.shape[1] if features.ndim == 2 else 0
+        dtype = torch.float16 if precision == 'fp16' else torch.int8
+        self.data = torch.cat(chunks) if chunks else torch.empty((0, dim), dtype=dtype)
+        if precision == 'int8':
+            self.scales = torch.cat(scales) if scales else torch.empty(0)
+
+    @classmethod
+    def from_parts(cls, precision, data, scales=None):
+        """由已压缩的数据构造，不做量化"""
+        quantized = cls.__new__(cls)
+        quantized.precision = precision
+        quantized.data = data
+        quantized.scales = scales
+        return quantized
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, features):
+        """只量化新增的行并追加到末尾"""
+        added = QuantizedFeatures(features, self.precision)
+        scales = None if self.scales is None else torch.cat([self.scales, added.scales])
+        return QuantizedFeatures.from_parts(self.precision, torch.cat([self.data, added.data]), scales)
+
+    def remove(self, indices):
+        """删除给定行"""
+        keep = torch.ones(len(self.data), dtype=torch.bool)
+        keep[torch.as_tensor(indices, dtype=torch.long)] = False
+        scales = None if self.scales is None else self.scales[keep]
+        return QuantizedFeatures.from_parts(self.precision, self.data[keep], scales)
+
+    @property
+    def nbytes(self):
+        size = self.data.numel() * self.data.element_size()
+        if self.scales is not None:
+            size += self.scales.numel() * self.scales.element_size()
+        return size
+
+    def scores(self, query_features, start=0, end=None):
+        """分块计算查询与压缩特征的近似内积，返回 [Q, end - start]"""
+        end = len(self.data) if end is None else end
+        out = torch.empty((len(query_features), end - start))
+        for chunk_start in range(start, end, SCAN_CHUNK_SIZE):
+            chunk_end = min(chunk_start + SCAN_CHUNK_SIZE, end)
+            chunk = self.data[chunk_start:chunk_end]
+            if self.scales is not None:
+                sim = (query_features @ chunk.to(torch.float32).T) * self.scales[chunk_start:chunk_end]
+            else:
+                # 半精度矩阵乘直接在压缩数据上计算，无需先转换为float32
+                sim = query_features.to(torch.float16) @ chunk.T
+            out[:, chunk_start - start:chunk_end - start] = sim
+        return out
+
+    def row_scores(self, query_features, rows):
+        """计算查询与指定行的近似内积，返回 [Q, len(rows)]"""
+        chunk = self.data[rows]
+        if self.scales is not None:
+            return (query_features @ chunk.to(torch.float32).T) * self.scales[rows]
+        return (query_features.to(torch.float16) @ chunk.T).to(torch.float32)
+
+
+def quantize_features(features, precision):
+    """按配置压缩特征，fp32 时返回 None 表示不压缩"""
+    if precision == 'fp32' or len(features) == 0:
+        return None
+    quantized = QuantizedFeatures(features, precision)
+    logger.info(f"Quantized {len(quantized)} features to {precision} "
+                f"({quantized.nbytes / 1024 ** 2:.1f} MB resident)")
+    return quantized
+
+
+def exact_scores(features, query_features, candidates):
+    """用原始精度特征计算查询与候选的内积，返回 [Q, 候选数]；索引为 -1 的填充位置为 -inf"""
+    exact = (features[candidates.clamp_min(0)].to(torch.float32) * query_features.unsqueeze(1)).sum(-1)
+    return exact.masked_fill(candidates < 0, float('-inf'))
+
+
+def rescore(features, query_features, candidates, k):
+    """用原始精度特征对候选重新打分，返回 (values, indices)，形状为 [Q, k]"""
+    exact = exact_scores(features, query_features, candidates)
+    values, order = selection.topk(exact, k)
+    return values, torch.gather(candidates, -1, order)
+
+
+def correct_lse(lse, approx, exact, logit_scale):
+    """把 logsumexp 中候选的近似项替换为精确项，使返回的精确分数与归一化项一致（概率不超过1）
+
+    lse 为近似分数在全部行上的 logsumexp；approx、exact 为同一批候选的近似、精确内积，形状为 [Q, 候选数]。
+    """
+    approx_lse = torch.logsumexp(logit_scale * approx, dim=-1)
+    exact_lse = torch.logsumexp(logit_scale * exact, dim=-1)
+    # 非候选行的近似项之和；候选占满全部概率质量时为 -inf
+    rest = lse + torch.log1p(-torch.exp((approx_lse - lse).clamp_max(0.0)))
+    return torch.logaddexp(rest, exact_lse)
+
+
+def evaluate_quantization(features, precisions=('fp16', 'int8'), k=20, n_queries=200, seed=0):
+    """对比量化检索与float32基准检索的top-k重合率"""
+    generator = torch.Generator().manual_seed(seed)
+    features = features.to(torch.float32)
+    n_queries = min(n_queries, len(features))
+    query_ids = torch.randperm(len(features), generator=generator)[:n_queries]
+    queries = features[query_ids] + 0.05 * torch.randn((n_queries, features.shape[1]), generator=generator)
+    queries = torch.nn.functional.normalize(queries, dim=-1)
+
+    _, truth = selection.topk(queries @ features.T, k)
+    report = []
+    for precision in precisions:
+        quantized = QuantizedFeatures(features, precision)
+        approx = quantized.scores(queries)
+        _, scan_only = selection.topk(approx, k)
+        _, candidates = selection.topk(approx, k * RESCORE_FACTOR)
+        _, rescored = rescore(features, queries, candidates, k)
+
+        def overlap(found):
+            hits = sum(len(set(found[i].tolist()) & set(truth[i].tolist())) for i in range(n_queries))
+            return round(hits / (n_queries * truth.shape[-1]), 4)
+
+        report.append({
+            'precision': precision,
+            'memory_ratio': round(quantized.nbytes / (features.numel() * 4), 3),
+            'overlap_scan': overlap(scan_only),
+            'overlap_rescored': overlap(rescored),
+        })
+    return report
@@ -0,0 +1,80 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import torch
+from loguru import logger
+
+from models import selection
+
+# 每个分片的默认行数，单次查询的临时内存为 O(查询数 * 分片大小)
+DEFAULT_SHARD_SIZE = 65536
+
+_scanner = None
+_scanner_lock = threading.Lock()
+
+
+def default_scan_workers():
+    """默认扫描线程数：并发的分片数 * 算子内线程数 <= CPU核数，避免并发矩阵乘互相抢占"""
+    return max(1, (os.cpu_count() or 1) // max(1, torch.get_num_threads()))
+
+
+class ShardedScanner:
+    """分片并行扫描器
+
+    特征矩阵按固定行数切分为分片，各分片在共享线程池中独立计算相似度、logsumexp 和局部top-k，
+    最后用堆合并各分片的候选。所有请求共用同一个线程池；算子内线程数由启动时的配置决定（见 DataBase），
+    扫描器不修改它，默认线程数按 线程数 * 算子内线程数 <= CPU核数 确定，并发请求时不会超额占用CPU。
+    """
+    def __init__(self, shard_size=DEFAULT_SHARD_SIZE, workers=0):
+        self.shard_size = max(1, shard_size)
+        self.workers = workers if workers > 0 else default_scan_workers()
+        self.intra_op_threads = torch.get_num_threads()
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scan')
+        logger.info(f"Sharded scanner: shard_size={self.shard_size}, workers={self.workers}, "
+                    f"intra_op_threads={self.intra_op_threads}")
+
+    def _scan_shard(self, score_shard, start, end, k, logit_scale):
+        similarity = score_shard(start, end)
+        lse = torch.logsumexp(logit_scale * similarity, dim=-1) if logit_scale is not None else None
+        values, indices = selection.topk(similarity, k)
+        return values, indices + start, lse
+
+    def scan(self, score_shard, n, k, logit_scale):
+        """分片扫描 [0, n) 行，返回全局 (values, indices, lse)
+
+        score_shard(start, end) 返回第 [start, end) 行的相似度，形状为 [Q, end - start]；
+        lse 为全部 n 行上 logit_scale * 相似度 的 logsumexp，用于只对候选计算softmax概率；
+        logit_scale 为空时不计算，lse 返回 None。
+        """
+        bounds = [(start, min(start + self.shard_size, n)) for start in range(0, n, self.shard_size)]
+        if len(bounds) <= 1:
+            # 单个分片直接在当前线程计算，省去线程调度
+            results = [self._scan_shard(score_shard, start, end, k, logit_scale) for start, end in bounds]
+        else:
+            futures = [self.pool.submit(self._scan_shard, score_shard, start, end, k, logit_scale)
+                       for start, end in bounds]
+            results = [future.result() for future in futures]
+
+        if not results:
+            empty = torch.empty((1, 0))
+            return empty, empty.long(), torch.full((1,), float('-inf')) if logit_scale is not None else None
+        shard_values, shard_indices, shard_lse = zip(*results)
+        lse = torch.logsumexp(torch.stack(shard_lse, dim=-1), dim=-1) if logit_scale is not None else None
+        if len(results) == 1:
+            return shard_values[0], shard_indices[0], lse
+        values, indices = selection.merge_topk(shard_values, shard_indices, k)
+        # 候选总数可能少于k（例如k大于库大小），截去填充部分保持与单分片一致
+        valid = min(k, n)
+        return values[:, :valid], indices[:, :valid], lse
+
+
+def get_scanner(shard_size=DEFAULT_SHARD_SIZE, workers=0):
+    """获取进程内共享的扫描器；参数变化时重新创建"""
+    global _scanner
+    with _scanner_lock:
+        if _scanner is None or _scanner.shard_size != max(1, shard_size) or \
+                (workers > 0 and _scanner.workers != workers):
+            if _scanner is not None:
+                _scanner.pool.shutdown(wait=False)
+            _scanner = ShardedScanner(shard_size, workers)
+        return _scanner
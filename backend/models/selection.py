@@ -0,0 +1,84 @@
+import heapq
+import itertools
+import torch
+
+# 分块扫描时每块的默认行数
+DEFAULT_CHUNK_SIZE = 65536
+
+
+def _as_2d(scores):
+    return scores.unsqueeze(0) if scores.ndim == 1 else scores
+
+
+def topk(scores, k, largest=True):
+    """部分选择top-k（O(N)），返回按分数排序的 (values, indices)，形状为 [Q, k]"""
+    scores = _as_2d(scores)
+    k = max(0, min(k, scores.shape[-1]))
+    return torch.topk(scores, k, dim=-1, largest=largest, sorted=True)
+
+
+def bottomk(scores, k):
+    """部分选择bottom-k，返回按分数从低到高排序的 (values, indices)"""
+    return topk(scores, k, largest=False)
+
+
+def topk_by_threshold(scores, k, threshold):
+    """先按阈值过滤再取top-k，结果按分数排序
+
+    低于阈值的位置索引为 -1、分数为 -inf，调用方通过 ``indices >= 0`` 过滤。
+    """
+    scores = _as_2d(scores)
+    masked = scores.masked_fill(scores <= threshold, float('-inf'))
+    values, indices = topk(masked, k)
+    indices = indices.masked_fill(torch.isinf(values), -1)
+    return values, indices
+
+
+def chunked_topk(score_chunk, n, k, chunk_size=DEFAULT_CHUNK_SIZE, threshold=None, largest=True):
+    """分块流式top-k，完整的分数向量无需一次性存在于内存中
+
+    score_chunk(start, end) 返回第 [start, end) 行的分数，形状为 [Q, end - start]。
+    每块只保留当前最优的k个候选，临时内存为 O(Q * (chunk_size + k))。
+    """
+    fill = float('-inf') if largest else float('inf')
+    best_values = None
+    best_indices = None
+    for start in range(0, n, chunk_size):
+        end = min(start + chunk_size, n)
+        chunk = _as_2d(score_chunk(start, end))
+        if threshold is not None:
+            chunk = chunk.masked_fill(chunk <= threshold if largest else chunk >= threshold, fill)
+        values, indices = topk(chunk, k, largest=largest)
+        indices = indices + start
+        if best_values is not None:
+            values = torch.cat([best_values, values], dim=-1)
+            indices = torch.cat([best_indices, indices], dim=-1)
+            values, order = topk(values, k, largest=largest)
+            indices = torch.gather(indices, -1, order)
+        best_values, best_indices = values, indices
+
+    if best_values is None:
+        empty = torch.empty((1, 0))
+        return empty, empty.long()
+    if threshold is not None:
+        best_indices = best_indices.masked_fill(torch.isinf(best_values), -1)
+    return best_values, best_indices
+
+
+def merge_topk(shard_values, shard_indices, k):
+    """用堆合并多个分片各自排好序的top-k结果，返回全局 (values, indices)，形状为 [Q, k]
+
+    每个分片的 indices 应已加上分片起始行号；合并只涉及 O(分片数 * k) 个候选。
+    候选不足k个时以 -inf / -1 填充。
+    """
+    n_queries = shard_values[0].shape[0]
+    shards = [(v.tolist(), i.tolist()) for v, i in zip(shard_values, shard_indices)]
+    values, indices = [], []
+    for q in range(n_queries):
+        merged = list(itertools.islice(
+            heapq.merge(*(zip(v[q], i[q]) for v, i in shards), key=lambda item: -item[0]), k))
+        merged += [(float('-inf'), -1)] * (k - len(merged))
+        values.append([value for value, _ in merged])
+        indices.append([index for _, index in merged])
+    return (torch.tensor(values, dtype=torch.float32).reshape(n_queries, k),
+            torch.tensor(indices, dtype=torch.long).reshape(n_queries, k))
@@ -0,0 +1,43 @@
+from config import Config
+
+# 相册与数据库读取的配置项，默认值只在 config.py 中定义
+SETTING_NAMES = (
+    'INDEX_BATCH_SIZE', 'INDEX_QUEUE_SIZE', 'INDEX_DECODE_PROCESSES', 'WALK_WORKERS',
+    'WATCH_MODE', 'WATCH_POLL_INTERVAL', 'WATCH_DEBOUNCE', 'JOURNAL_COMPACT_RATIO', 'JOURNAL_COMPACT_MIN_MB',
+    'INFERENCE_MAX_BATCH', 'INFERENCE_MAX_DELAY_MS', 'INFERENCE_THREADS',
+    'SEARCH_BACKEND', 'ANN_NLIST', 'ANN_NPROBE', 'ANN_PQ_M', 'ANN_MIN_SIZE', 'FEATURE_PRECISION',
+    'SCAN_SHARD_SIZE', 'SCAN_WORKERS', 'KNN_K', 'KNN_BLOCK_SIZE', 'AUTO_ALBUM_CLUSTERS', 'AUTO_ALBUM_BATCH_SIZE',
+    'SCORE_MODE', 'SEARCH_CURSOR_DEPTH', 'SEARCH_CURSOR_TTL', 'SEARCH_MAX_CURSORS', 'SEARCH_ROUTE_CLUSTERS',
+    'DUPLICATE_THRESHOLD', 'DUPLICATE_BLOCK_SIZE', 'TEXT_CACHE_SIZE', 'TEXT_CACHE_PERSIST', 'IMAGE_CACHE_SIZE',
+)
+
+
+class AlbumSettings:
+    """相册与数据库的可调参数
+
+    属性名为配置项名的小写形式（如 knn_k 对应 KNN_K）；config 中没有的项取 config.Config 中的值。
+    不可变且可哈希，可以直接作为 get_database 的缓存键。
+    """
+    def __init__(self, config=None):
+        config = config or {}
+        values = tuple((name, config[name] if name in config else getattr(Config, name)) for name in SETTING_NAMES)
+        object.__setattr__(self, 'values', values)
+        for name, value in values:
+            object.__setattr__(self, name.lower(), value)
+
+    @classmethod
+    def from_config(cls, config):
+        """从 Flask 配置（或其他映射）读取"""
+        return cls(config)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other):
+        return isinstance(other, AlbumSettings) and self.values == other.values
+
+    def __hash__(self):
+        return hash(self.values)
+
+    def __repr__(self):
+        return f"AlbumSettings({', '.join(f'{name.lower()}={value!r}' for name, value in self.values)})"
@@ -0,0 +1,295 @@
+import os
+import json
+import glob
+import shutil
+import numpy as np
+import torch
+from loguru import logger
+
+from models.journal import Journal
+
+STORE_FORMAT_VERSION = 1
+HEADER_NAME = 'header.json'
+# 按块读写特征时每块的行数
+CHUNK_ROWS = 65536
+
+
+def get_store_path(dump_path):
+    """特征库目录与数据库文件同名，后缀为 .store"""
+    return os.path.splitext(dump_path)[0] + '.store'
+
+
+class FeatureStore:
+    """列式磁盘特征库
+
+    目录结构:
+        header.json            元信息（行数、维度、当前代号等），最后写入，作为提交点
+        features.<gen>.f32     float32 特征矩阵，按行连续存放，通过 np.memmap 零拷贝打开
+        paths.<gen>.bin        UTF-8 编码的路径拼接而成的字节串
+        paths.<gen>.idx        int64 偏移表，长度为 N + 1
+        <column>.<gen>.npy     与行对齐的附加列（如内容指纹），通过 np.load(mmap_mode='r') 打开
+        journal.<gen>.log      写入该代之后的追加式变更日志（见 models.journal），加载时重放
+
+    每次写入使用新的代号，旧文件在 header 切换后删除；Windows 下仍被映射的旧文件会在下次写入时清理。
+    """
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def header_path(self):
+        return os.path.join(self.path, HEADER_NAME)
+
+    def _file(self, name, generation, suffix):
+        return os.path.join(self.path, f"{name}.{generation}.{suffix}")
+
+    def exists(self):
+        return os.path.exists(self.header_path)
+
+    def read_header(self):
+        with open(self.header_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def write(self, features, paths, ignore_paths=(), index_version=0, columns=None):
+        """写入新一代数据文件，并原子地切换 header；columns 为与行对齐的 numpy 数组"""
+        os.makedirs(self.path, exist_ok=True)
+        generation = self.read_header()['generation'] + 1 if self.exists() else 0
+
+        count = len(paths)
+        dim = features.shape[1] if features.ndim == 2 and count > 0 else 0
+        if len(features) != count:
+            raise ValueError(f"Got {len(features)} features for {count} paths")
+
+        # 分块写入，特征可以是内存映射的 LiveFeatures，无需整体读入内存
+        with open(self._file('features', generation, 'f32'), 'wb') as f:
+            for start in range(0, count, CHUNK_ROWS):
+                chunk = features[start:start + CHUNK_ROWS].detach().to(torch.float32).contiguous().cpu()
+                f.write(chunk.numpy().tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        encoded = [p.encode('utf-8') for p in paths]
+        offsets = np.zeros(count + 1, dtype=np.int64)
+        if count > 0:
+            np.cumsum([len(p) for p in encoded], out=offsets[1:])
+        with open(self._file('paths', generation, 'bin'), 'wb') as f:
+            f.write(b''.join(encoded))
+        with open(self._file('paths', generation, 'idx'), 'wb') as f:
+            f.write(offsets.tobytes())
+
+        columns = columns or {}
+        for name, array in columns.items():
+            if len(array) != count:
+                raise ValueError(f"Column {name} has {len(array)} rows, expected {count}")
+            np.save(self._file(name, generation, 'npy'), array)
+
+        header = {
+            'format_version': STORE_FORMAT_VERSION,
+            'generation': generation,
+            'count': count,
+            'dim': dim,
+            'dtype': 'float32',
+            'normalized': True,
+            'index_version': index_version,
+            'ignore_paths': sorted(ignore_paths),
+            'columns': sorted(columns),
+        }
+        tmp_path = self.header_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(header, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.header_path)
+
+        self.remove_stale_generations(generation)
+        return header
+
+    def read(self):
+        """零拷贝读取特征库，返回 (header, features, paths)
+
+        特征以写时复制（mode='c'）方式映射，多个进程共享操作系统页缓存，
+        即使被原地修改也不会写回磁盘。
+        """
+        header = self.read_header()
+        if header.get('format_version') != STORE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported feature store version: {header.get('format_version')}")
+        generation, count = header['generation'], header['count']
+        features = self.read_features(header)
+
+        offsets = np.fromfile(self._file('paths', generation, 'idx'), dtype=np.int64).tolist()
+        with open(self._file('paths', generation, 'bin'), 'rb') as f:
+            blob = f.read()
+        paths = [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(count)]
+        return header, features, paths
+
+    def read_features(self, header=None):
+        """以内存映射方式打开特征矩阵"""
+        if header is None:
+            header = self.read_header()
+        if header['count'] == 0:
+            return torch.empty(0)
+        array = np.memmap(self._file('features', header['generation'], 'f32'), dtype=np.float32,
+                          mode='c', shape=(header['count'], header['dim']))
+        return torch.from_numpy(array)
+
+    def read_columns(self, header=None):
+        """以内存映射方式打开附加列，返回 {列名: 数组}"""
+        if header is None:
+            header = self.read_header()
+        return {
+            name: np.load(self._file(name, header['generation'], 'npy'), mmap_mode='r')
+            for name in header.get('columns', [])
+        }
+
+    def journal(self, header=None):
+        """当前代对应的变更日志"""
+        if header is None:
+            header = self.read_header()
+        return Journal(self._file('journal', header['generation'], 'log'))
+
+    def base_size(self):
+        """当前代特征矩阵的字节数，用于判断日志是否需要合并"""
+        header = self.read_header()
+        return header['count'] * header['dim'] * 4
+
+    def current_files(self):
+        """当前代的所有文件（包括header）"""
+        generation = self.read_header()['generation']
+        return [self.header_path] + glob.glob(os.path.join(self.path, f"*.{generation}.*"))
+
+    def remove_stale_generations(self, generation):
+        for file_path in glob.glob(os.path.join(self.path, '*.*.*')):
+            name_parts = os.path.basename(file_path).split('.')
+            if len(name_parts) == 3 and name_parts[1].isdigit() and int(name_parts[1]) != generation:
+                try:
+                    os.remove(file_path)
+                except OSError as e:
+                    # Windows 下仍被映射的文件无法删除，留待下次写入时清理
+                    logger.debug(f"Failed to remove stale store file {file_path}: {e}")
+
+    def backup(self, backup_dir):
+        """将当前代的文件复制到备份目录"""
+        os.makedirs(backup_dir, exist_ok=True)
+        for file_path in self.current_files():
+            shutil.copy2(file_path, os.path.join(backup_dir, os.path.basename(file_path)))
+
+
+class LiveFeatures:
+    """特征库当前代的内存映射特征矩阵，叠加写入该代之后的变更
+
+    删除行只更新仍然有效的底层行号，新增的行保存在内存中的尾部，底层的映射始终不会被复制，
+    常驻内存只与变更日志的大小成正比。按行切片或按行号索引时返回普通的float32张量，
+    切片范围内没有删除的行时为底层映射的视图；扫描时用 scores 在连续的底层视图上计算相似度，
+    已删除的行只在相似度中按列跳过，不复制特征。删除或追加返回新的对象，正在使用旧对象的检索索引不受影响。
+    """
+    ndim = 2
+    dtype = torch.float32
+    device = torch.device('cpu')
+
+    def __init__(self, base, rows=None, tail=None):
+        if base.ndim != 2:
+            base = torch.empty((0, tail.shape[1] if tail is not None else 0))
+        self.base = base
+        # 仍然有效的底层行号（int64数组），为空表示底层的全部行
+        self.rows = rows
+        self.tail = tail if tail is not None else torch.empty((0, base.shape[1]))
+        self.base_count = len(base) if rows is None else len(rows)
+
+    def __len__(self):
+        return self.base_count + len(self.tail)
+
+    @property
+    def shape(self):
+        return torch.Size((len(self), self.base.shape[1]))
+
+    def __getitem__(self, key):
+        n = len(self)
+        if isinstance(key, slice):
+            start, stop, step = key.indices(n)
+            stop = max(start, stop)
+            if step == 1 and stop <= self.base_count:
+                view, positions = self.base_span(start, stop)
+                return view if positions is None else view[positions]
+            if step == 1 and start >= self.base_count:
+                return self.tail[start - self.base_count:stop - self.base_count]
+            key = np.arange(start, stop, step)
+        elif isinstance(key, (int, np.integer)):
+            if not -n <= key < n:
+                raise IndexError(f"Row {key} is out of range for {n} features")
+            return self[np.asarray([key])][0]
+        if isinstance(key, torch.Tensor):
+            key = key.cpu().numpy()
+        key = np.asarray(key)
+        if key.dtype == bool:
+            key = np.flatnonzero(key)
+        key = key.astype(np.int64, copy=False)
+        flat = np.where(key < 0, key + n, key).ravel()
+        if len(flat) > 0 and (flat.min() < 0 or flat.max() >= n):
+            raise IndexError(f"Row index is out of range for {n} features")
+
+        in_base = flat < self.base_count
+        base_rows = flat[in_base] if self.rows is None else self.rows[flat[in_base]]
+        if in_base.all():
+            out = self.base[torch.from_numpy(base_rows)]
+        else:
+            out = torch.empty((len(flat), self.base.shape[1]))
+            out[torch.from_numpy(in_base)] = self.base[torch.from_numpy(base_rows)]
+            out[torch.from_numpy(~in_base)] = self.tail[torch.from_numpy(flat[~in_base] - self.base_count)]
+        return out.reshape(key.shape + (self.base.shape[1],))
+
+    def base_span(self, start, stop):
+        """底层中覆盖第 [start, stop) 行（均在底层部分）的连续视图，返回 (视图, 各行在视图中的位置)
+
+        区间内没有删除的行时位置为 None，视图即为这些行。
+        """
+        if self.rows is None or start >= stop:
+            return self.base[start:stop], None
+        rows = self.rows[start:stop]
+        low, high = int(rows[0]), int(rows[-1]) + 1
+        if high - low == len(rows):
+            return self.base[low:high], None
+        return self.base[low:high], torch.from_numpy(rows - low)
+
+    def scores(self, query_features, start=0, stop=None):
+        """query_features 与第 [start, stop) 行的相似度，形状为 [Q, stop - start]"""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        stop = max(start, stop)
+        split = min(max(start, self.base_count), stop)
+        parts = []
+        if split > start:
+            view, positions = self.base_span(start, split)
+            similarity = query_features @ view.T
+            parts.append(similarity if positions is None else similarity[:, positions])
+        if stop > split:
+            parts.append(query_features @ self.tail[split - self.base_count:stop - self.base_count].T)
+        if not parts:
+            return query_features.new_empty((len(query_features), 0))
+        return parts[0] if len(parts) == 1 else torch.cat(parts, dim=1)
+
+    def remove(self, indices):
+        """删除给定行（删除前的行号），返回新的对象"""
+        if len(indices) == 0:
+            return self
+        keep = np.ones(len(self), dtype=bool)
+        keep[np.asarray(indices, dtype=np.int64)] = False
+        rows, tail = self.rows, self.tail
+        if not keep[:self.base_count].all():
+            rows = (np.arange(len(self.base)) if rows is None else rows)[keep[:self.base_count]]
+        if not keep[self.base_count:].all():
+            tail = tail[torch.from_numpy(keep[self.base_count:])]
+        return LiveFeatures(self.base, rows, tail)
+
+    def append(self, features):
+        """在末尾追加新行，返回新的对象"""
+        features = features.detach().to(torch.float32).cpu()
+        if len(features) == 0:
+            return self
+        if len(self) == 0:
+            return LiveFeatures(features)
+        return LiveFeatures(self.base, self.rows, torch.cat([self.tail, features], dim=0))
+
+
+def similarity(query_features, features, start, stop):
+    """query_features 与 features 第 [start, stop) 行的相似度；features 为 LiveFeatures 时不复制底层特征"""
+    if isinstance(features, LiveFeatures):
+        return features.scores(query_features, start, stop)
+    return query_features @ features[start:stop].T
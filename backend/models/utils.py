@@ -1,7 +1,7 @@
-import os
-import glob
 import torch
 from loguru import logger
+from models import selection
+from models.walker import DirectoryWalker
 
 def get_device():
     """自动检测设备，针对小显存优化"""
@@ -16,30 +16,27 @@ def get_device():
         return torch.device("cpu")
 
 def glob_all_images(root_path, extensions=['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.gif', '*.tiff', '*.webp']):
-    """获取所有图片文件"""
-    img_paths = []
-    
-    for ext in extensions:
-        img_paths.extend(glob.glob(os.path.join(root_path, "**", ext), recursive=True))
-        img_paths.extend(glob.glob(os.path.join(root_path, "**", ext.upper()), recursive=True))
-    
-    return list(set(img_paths))
+    """获取所有图片文件（单次遍历目录树，扩展名不区分大小写）"""
+    return DirectoryWalker(extensions=[ext.lstrip('*') for ext in extensions]).walk(root_path)
     # return list(set(img_paths[:5000]))
 
 def get_topk_indices(probs, k):
     """获取top-k索引"""
-    indices = torch.argsort(probs, dim=-1, descending=True)
-    return indices[0][:k]
+    _, indices = selection.topk(probs, k)
+    return indices[0]
 
 def get_lastk_indices(probs, k):
-    """获取last-k索引"""
-    indices = torch.argsort(probs, dim=-1, descending=True)
-    return indices[0][-k:]
+    """获取last-k索引（按分数从高到低排列）"""
+    _, indices = selection.bottomk(probs, k)
+    return indices[0].flip(-1)
 
-def get_indices_by_threshold(probs, threshold):
-    """根据阈值获取索引"""
-    indices = torch.where(probs > threshold)
-    return indices[1] if len(indices) > 1 else torch.tensor([])
+def get_indices_by_threshold(probs, threshold, k=None):
+    """根据阈值获取索引（按分数从高到低排列）"""
+    if k is None:
+        k = probs.shape[-1]
+    _, indices = selection.topk_by_threshold(probs, k, threshold)
+    indices = indices[0]
+    return indices[indices >= 0]
 
 if __name__ == "__main__":
     root_path = "D:\documents\images"
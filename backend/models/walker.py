@@ -0,0 +1,188 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from loguru import logger
+
+# 支持的图片扩展名（不区分大小写）
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp')
+# 并行遍历目录的线程数
+DEFAULT_WALK_WORKERS = 8
+# 修改时间距列出时不足该时长（纳秒）的目录不缓存，避免同一时间粒度内新增的文件被漏掉
+RACY_WINDOW_NS = 2 * 10 ** 9
+
+
+def get_dir_cache_path(dump_path):
+    """目录缓存保存在数据库文件旁边"""
+    return os.path.splitext(dump_path)[0] + '.dirs.json'
+
+
+class DirectoryWalker:
+    """单次遍历的图片目录扫描器
+
+    用 os.scandir 遍历一次目录树，扩展名不区分大小写；子目录提交到线程池并行遍历。
+    记录每个目录的修改时间和其中的图片文件名、子目录名，目录的修改时间未变（没有增删或重命名条目）时
+    直接复用上次的列表，只需一次 stat，无需重新列出目录。
+    与 glob 一致，跳过以 . 开头的文件和目录；不进入指向目录的符号链接，避免循环。
+    """
+    def __init__(self, extensions=IMAGE_EXTENSIONS, workers=DEFAULT_WALK_WORKERS, cache_path=None):
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.workers = max(1, workers)
+        self.cache_path = cache_path
+        # 目录 -> [修改时间(ns), 图片文件名列表, 子目录名列表]
+        self.cache = self.load_cache()
+        # 上次遍历中重新列出（修改时间变化或新出现）的目录
+        self.relisted = set()
+
+    def scan_dir(self, dir_path, cache):
+        """扫描单个目录，返回 (dir_path, entry, reused)"""
+        try:
+            mtime = os.stat(dir_path).st_mtime_ns
+        except FileNotFoundError:
+            return dir_path, None, False
+        except OSError as e:
+            logger.warning(f"Cannot stat directory {dir_path}: {e}")
+            return dir_path, None, False
+        cached = cache.get(dir_path)
+        if cached is not None and cached[0] == mtime:
+            return dir_path, cached, True
+
+        files, subdirs = [], []
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif os.path.splitext(entry.name)[1].lower() in self.extensions and entry.is_file():
+                            files.append(entry.name)
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.warning(f"Cannot list directory {dir_path}: {e}")
+            return dir_path, None, False
+        if time.time_ns() - mtime < RACY_WINDOW_NS:
+            mtime = -1
+        return dir_path, [mtime, files, subdirs], False
+
+    def walk(self, root_path):
+        """遍历 root_path 下的所有图片，返回排序后的路径列表，并更新目录缓存"""
+        start_time = time.time()
+        cache, new_cache = self.cache, {}
+        img_paths, reused, relisted = [], 0, set()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {executor.submit(self.scan_dir, root_path, cache)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dir_path, entry, from_cache = future.result()
+                    if entry is None:
+                        continue
+                    new_cache[dir_path] = entry
+                    reused += from_cache
+                    if not from_cache:
+                        relisted.add(dir_path)
+                    img_paths.extend(os.path.join(dir_path, name) for name in entry[1])
+                    pending.update(executor.submit(self.scan_dir, os.path.join(dir_path, name), cache)
+                                   for name in entry[2])
+
+        changed = new_cache != cache
+        self.cache = new_cache
+        self.relisted = relisted
+        if changed:
+            self.save_cache()
+        logger.info(f"Walked {len(new_cache)} directories ({reused} unchanged) and found {len(img_paths)} images "
+                    f"in {time.time() - start_time:.2f}s")
+        return sorted(img_paths)
+
+    def probe(self, root_path):
+        """只 stat 缓存中的目录，返回修改时间变化或已消失的目录，不列出任何目录（轮询监视使用）"""
+        cache, changed = self.cache, []
+        if root_path not in cache:
+            return [root_path]
+        stack = [root_path]
+        while stack:
+            dir_path = stack.pop()
+            entry = cache.get(dir_path)
+            if entry is None:
+                continue
+            try:
+                mtime = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                changed.append(dir_path)
+                continue
+            if mtime != entry[0]:
+                changed.append(dir_path)
+            stack.extend(os.path.join(dir_path, name) for name in entry[2])
+        return changed
+
+    def refresh(self, dirs):
+        """重新列出给定目录并更新缓存，返回 (这些目录中原有的图片路径, 现有的图片路径)
+
+        新出现的子目录整体列出，消失的目录连同缓存中的子目录整体移除；其余子目录不受影响。
+        调用方需要保证与 walk 不会同时执行。
+        """
+        cache = dict(self.cache)
+        old_paths, new_paths = set(), set()
+
+        def drop(dir_path):
+            entry = cache.pop(dir_path, None)
+            if entry is None:
+                return
+            old_paths.update(os.path.join(dir_path, name) for name in entry[1])
+            for name in entry[2]:
+                drop(os.path.join(dir_path, name))
+
+        def add(dir_path):
+            _, entry, _ = self.scan_dir(dir_path, {})
+            if entry is None:
+                return
+            cache[dir_path] = entry
+            new_paths.update(os.path.join(dir_path, name) for name in entry[1])
+            for name in entry[2]:
+                add(os.path.join(dir_path, name))
+
+        # 父目录在前，父目录新增的子目录列出后不会再被当作新目录重复处理
+        for dir_path in sorted(set(dirs)):
+            old = cache.get(dir_path)
+            if old is None:
+                add(dir_path)
+                continue
+            _, entry, _ = self.scan_dir(dir_path, {})
+            if entry is None:
+                drop(dir_path)
+                continue
+            cache[dir_path] = entry
+            old_paths.update(os.path.join(dir_path, name) for name in old[1])
+            new_paths.update(os.path.join(dir_path, name) for name in entry[1])
+            for name in set(old[2]) - set(entry[2]):
+                drop(os.path.join(dir_path, name))
+            for name in set(entry[2]) - set(old[2]):
+                add(os.path.join(dir_path, name))
+
+        # 不立即保存：缓存落后时下次完整遍历会因修改时间不一致而重新列出这些目录，结果仍然正确
+        self.cache = cache
+        return sorted(old_paths), sorted(new_paths)
+
+    def load_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading directory cache: {e}")
+            return {}
+
+    def save_cache(self):
+        if not self.cache_path:
+            return
+        try:
+            tmp_path = self.cache_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.cache, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            logger.error(f"Error saving directory cache: {e}")
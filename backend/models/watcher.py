@@ -0,0 +1,277 @@
+import os
+import sys
+import time
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+import threading
+from loguru import logger
+
+# 监视模式: off 不监视, auto 优先使用 inotify、不可用时轮询, inotify/poll 指定方式
+WATCH_MODES = ('off', 'auto', 'inotify', 'poll')
+# 轮询模式下检查目录修改时间的间隔（秒）
+DEFAULT_POLL_INTERVAL = 5.0
+# 最后一个事件之后等待的时长（秒），期间的事件合并为一批
+DEFAULT_DEBOUNCE = 1.0
+# 事件持续不断时，最早的事件最多等待 debounce 的该倍数后强制提交
+MAX_DEBOUNCE_FACTOR = 10
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+              | IN_MOVE_SELF | IN_ONLYDIR)
+# struct inotify_event 的定长部分: wd, mask, cookie, len
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+
+def _load_libc():
+    return ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+
+class Inotify:
+    """基于 ctypes 的最小 inotify 封装（仅 Linux），每个目录一个监视描述符"""
+    def __init__(self):
+        self.libc = _load_libc()
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self.wd_to_dir = {}
+        self.dir_to_wd = {}
+
+    @staticmethod
+    def available():
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            return hasattr(_load_libc(), 'inotify_init1')
+        except OSError:
+            return False
+
+    def __len__(self):
+        return len(self.dir_to_wd)
+
+    def add(self, dir_path):
+        """监视单个目录；目录已不存在时忽略，超过系统监视数上限时抛出 OSError(ENOSPC)"""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_path), WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            if code in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return
+            raise OSError(code, os.strerror(code), dir_path)
+        self.wd_to_dir[wd] = dir_path
+        self.dir_to_wd[dir_path] = wd
+
+    def add_tree(self, dir_path):
+        """监视目录及其所有子目录，与扫描器一致跳过隐藏目录，不进入符号链接"""
+        for current, subdirs, _ in os.walk(dir_path):
+            subdirs[:] = [name for name in subdirs if not name.startswith('.')]
+            self.add(current)
+
+    def remove_tree(self, dir_path):
+        """停止监视目录及其子目录（目录被移走后原来的路径不再有效）"""
+        prefix = dir_path + os.sep
+        for path in [path for path in self.dir_to_wd if path == dir_path or path.startswith(prefix)]:
+            wd = self.dir_to_wd.pop(path)
+            self.wd_to_dir.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """等待最多 timeout 秒，返回事件列表 [(dir_path, name, mask)]；dir_path 为 None 表示内核事件队列溢出"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            start = offset + EVENT_HEADER.size
+            name = os.fsdecode(data[start:start + length].rstrip(b'\0'))
+            offset = start + length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, '', mask))
+            elif mask & IN_IGNORED:
+                dir_path = self.wd_to_dir.pop(wd, None)
+                if dir_path is not None and self.dir_to_wd.get(dir_path) == wd:
+                    del self.dir_to_wd[dir_path]
+            elif wd in self.wd_to_dir:
+                events.append((self.wd_to_dir[wd], name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatcher:
+    """监视相册目录并增量更新数据库
+
+    Linux 上用 inotify 监视每个目录；其他平台、或 inotify 不可用（如目录数超过系统监视数上限）时，
+    定期只 stat 扫描器缓存中的目录，按修改时间找出变化的目录。
+    变化的目录先累积，debounce 秒内没有新事件（或最早的事件已等待 MAX_DEBOUNCE_FACTOR 倍时长）后
+    作为一批交给 on_change(dirs) 增量更新；dirs 为 None 表示事件有丢失，需要完整扫描。
+    """
+    def __init__(self, root_path, walker, on_change, mode='auto', poll_interval=DEFAULT_POLL_INTERVAL,
+                 debounce=DEFAULT_DEBOUNCE):
+        if mode not in WATCH_MODES or mode == 'off':
+            raise ValueError(f"Invalid watch mode: {mode}")
+        self.root_path = root_path
+        self.walker = walker
+        self.on_change = on_change
+        self.mode = mode
+        self.poll_interval = max(0.1, poll_interval)
+        self.debounce = max(0.0, debounce)
+        self.backend = None
+        self.inotify = None
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.full_rescan = False
+        self.first_event = 0.0
+        self.last_event = 0.0
+        self.batch_count = 0
+        self.updated_count = 0
+        self.last_update = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='folder-watcher', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def open_inotify(self):
+        if self.mode not in ('auto', 'inotify'):
+            return None
+        if not Inotify.available():
+            logger.warning("inotify is not available, falling back to polling")
+            return None
+        inotify = None
+        try:
+            inotify = Inotify()
+            # 扫描器缓存中即为相册的全部目录，无需再次遍历
+            for dir_path in list(self.walker.cache) or [self.root_path]:
+                inotify.add(dir_path)
+            return inotify
+        except OSError as e:
+            logger.warning(f"Cannot watch {self.root_path} with inotify ({e}), falling back to polling")
+            if inotify is not None:
+                inotify.close()
+            return None
+
+    def run(self):
+        self.inotify = self.open_inotify()
+        self.backend = 'inotify' if self.inotify is not None else 'poll'
+        logger.info(f"Watching {self.root_path} for changes ({self.backend}, debounce {self.debounce:.1f}s)")
+        # 开始监视之前发生的变化由一次轮询补上
+        self.mark(self.walker.probe(self.root_path))
+        next_poll = time.monotonic() + self.poll_interval
+        try:
+            while not self.stop_event.is_set():
+                timeout = min(max(self.debounce / 2, 0.05), 0.5)
+                if self.inotify is not None:
+                    self.handle(self.inotify.read(timeout))
+                else:
+                    self.stop_event.wait(timeout)
+                    if time.monotonic() >= next_poll:
+                        self.mark(self.walker.probe(self.root_path))
+                        next_poll = time.monotonic() + self.poll_interval
+                self.flush()
+        finally:
+            if self.inotify is not None:
+                self.inotify.close()
+
+    def handle(self, events):
+        """把 inotify 事件转换为需要重新列出的目录；新建或移入的目录加入监视，移走的目录停止监视"""
+        dirs = []
+        for dir_path, name, mask in events:
+            if dir_path is None:
+                logger.warning("inotify event queue overflowed, scheduling a full rescan")
+                with self.lock:
+                    self.full_rescan = True
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                dirs.append(dir_path)
+                continue
+            if name.startswith('.'):
+                continue
+            if not mask & IN_ISDIR:
+                # 只关心图片文件（如临时文件重命名为图片时的 IN_MOVED_TO）
+                if os.path.splitext(name)[1].lower() in self.walker.extensions:
+                    dirs.append(dir_path)
+                continue
+            dirs.append(dir_path)
+            child = os.path.join(dir_path, name)
+            if mask & (IN_MOVED_FROM | IN_DELETE):
+                self.inotify.remove_tree(child)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self.inotify.add_tree(child)
+                except OSError as e:
+                    logger.warning(f"Cannot watch {child} with inotify ({e}), falling back to polling")
+                    self.inotify.close()
+                    self.inotify = None
+                    self.backend = 'poll'
+                    break
+        self.mark(dirs)
+
+    def mark(self, dirs):
+        if not dirs:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if not self.pending and not self.full_rescan:
+                self.first_event = now
+            self.pending.update(dirs)
+            self.last_event = now
+
+    def flush(self):
+        """事件平息后提交累积的目录"""
+        now = time.monotonic()
+        with self.lock:
+            if not self.pending and not self.full_rescan:
+                return
+            if (now - self.last_event < self.debounce
+                    and now - self.first_event < self.debounce * MAX_DEBOUNCE_FACTOR):
+                return
+            dirs = None if self.full_rescan else sorted(self.pending)
+            self.pending = set()
+            self.full_rescan = False
+        try:
+            updated = self.on_change(dirs)
+        except Exception as e:
+            logger.error(f"Error applying watched changes: {e}")
+            return
+        self.batch_count += 1
+        self.updated_count += updated or 0
+        self.last_update = time.time()
+
+    def stats(self):
+        with self.lock:
+            pending = len(self.pending)
+        inotify = self.inotify
+        return {
+            'backend': self.backend,
+            'watched_dirs': len(inotify) if inotify is not None else len(self.walker.cache),
+            'pending_dirs': pending,
+            'batches': self.batch_count,
+            'updated': self.updated_count,
+            'last_update': self.last_update,
+        }
@@ -84,6 +84,152 @@ def test_image_search(image_path):
             print(f"相似结果 {i+1}: {result.get('filename')} - 分数: {result.get('score')}")
     print()
 
+@timer
+def test_similar_search():
+    """测试相似图片搜索"""
+    print("=== 测试相似图片搜索 ===")
+    response = requests.get(f"{BASE_URL}/images/random", params={'count': 1})
+    images = response.json().get('data', [])
+    if not images:
+        print("跳过相似图片搜索测试（相册为空）")
+        print()
+        return
+    payload = {'path': images[0]['path'], 'k': 5}
+    response = requests.post(f"{BASE_URL}/images/search/similar", json=payload)
+    print(f"状态码: {response.status_code}")
+    data = response.json()
+    print(f"查询图片: {images[0]['filename']}")
+    print(f"找到 {data.get('total_results', 0)} 个相似图片")
+    if data.get('data'):
+        for i, result in enumerate(data['data'][:3]):
+            print(f"相似结果 {i+1}: {result.get('filename')} - 分数: {result.get('score')}")
+    print()
+
+@timer
+def test_walk():
+    """测试随机漫游"""
+    print("=== 测试随机漫游 ===")
+    response = requests.get(f"{BASE_URL}/images/random?count=1")
+    images = response.json().get('data', [])
+    if not images:
+        print("跳过随机漫游测试（相册为空）")
+        print()
+        return
+    path, visited = images[0]['path'], []
+    for step in range(3):
+        visited.append(path)
+        payload = {'path': path, 'count': 5, 'exclude': visited, 'include_images': False}
+        data = requests.post(f"{BASE_URL}/images/walk", json=payload).json()
+        print(f"第 {step + 1} 步: {path} -> {data.get('next')}（{data.get('total_results', 0)} 个近邻）")
+        if not data.get('next'):
+            break
+        path = data['next']
+    print()
+
+@timer
+def test_batch_search():
+    """测试批量搜索"""
+    print("=== 测试批量搜索 ===")
+    payload = {
+        'queries': ['a picture of cat', 'a picture of dog', 'sunset at the beach'],
+        'k': 5
+    }
+    response = requests.post(f"{BASE_URL}/images/search/batch", json=payload)
+    print(f"状态码: {response.status_code}")
+    data = response.json()
+    print(f"查询数: {data.get('total_queries', 0)}")
+    for item in data.get('data', []):
+        top = item['results'][0]['filename'] if item.get('results') else '无结果'
+        print(f"{item.get('query')}: {item.get('total_results', 0)} 个结果, 第一名: {top}")
+    print()
+
+@timer
+def test_compose_search():
+    """测试组合搜索"""
+    print("=== 测试组合搜索 ===")
+    payload = {
+        'terms': [
+            {'text': 'a photo of the beach', 'weight': 1.0},
+            {'text': 'people', 'weight': -0.5}
+        ],
+        'k': 5
+    }
+    response = requests.post(f"{BASE_URL}/images/search/compose", json=payload)
+    print(f"状态码: {response.status_code}")
+    data = response.json()
+    print(f"找到 {data.get('total_results', 0)} 个结果")
+    if data.get('data'):
+        for i, result in enumerate(data['data'][:3]):
+            print(f"结果 {i+1}: {result.get('filename')} - 分数: {result.get('score')}")
+    print()
+
+@timer
+def test_paged_search():
+    """测试分页搜索"""
+    print("=== 测试分页搜索 ===")
+    payload = {'query': 'a picture of cat', 'page_size': 5}
+    response = requests.post(f"{BASE_URL}/images/search/text", json=payload)
+    print(f"状态码: {response.status_code}")
+    data = response.json()
+    print(f"候选总数: {data.get('total_candidates', 0)}, 第一页: {data.get('total_results', 0)} 个结果")
+    if data.get('has_more'):
+        params = {'cursor': data['cursor'], 'offset': data['next_offset'], 'limit': 5}
+        response = requests.get(f"{BASE_URL}/images/search/page", params=params)
+        page = response.json()
+        print(f"第二页状态码: {response.status_code}, {page.get('total_results', 0)} 个结果, 还有更多: {page.get('has_more')}")
+    print()
+
+@timer
+def test_filtered_search():
+    """测试元数据过滤搜索"""
+    print("=== 测试元数据过滤搜索 ===")
+    facets = requests.get(f"{BASE_URL}/images/facets").json().get('data', {})
+    extensions = list(facets.get('extensions', {}))
+    print(f"目录数: {len(facets.get('folders', {}))}, 扩展名: {extensions}")
+    if not extensions:
+        print("跳过过滤搜索测试（相册为空）")
+        print()
+        return
+    payload = {'query': 'a picture of cat', 'k': 5, 'filters': {'ext': extensions[:1]}}
+    response = requests.post(f"{BASE_URL}/images/search/text", json=payload)
+    print(f"状态码: {response.status_code}")
+    data = response.json()
+    print(f"过滤条件: {payload['filters']}, 找到 {data.get('total_results', 0)} 个结果")
+    print()
+
+@timer
+def test_auto_albums():
+    """测试自动相册"""
+    print("=== 测试自动相册 ===")
+    response = requests.get(f"{BASE_URL}/albums", params={'include_images': 'false'})
+    print(f"状态码: {response.status_code}")
+    albums = response.json().get('data', [])
+    print(f"自动相册数: {len(albums)}")
+    if albums:
+        album_id = albums[0]['id']
+        data = requests.get(f"{BASE_URL}/albums/{album_id}", params={'limit': 5, 'include_images': 'false'}).json()
+        print(f"相册 {album_id}: {data.get('total', 0)} 张图片")
+        for image in data.get('data', []):
+            print(f"  {image['filename']}: {image['score']}")
+    print()
+
+@timer
+def test_duplicates():
+    """测试近似重复检测"""
+    print("=== 测试近似重复检测 ===")
+    response = requests.post(f"{BASE_URL}/duplicates/scan", json={'threshold': 0.95})
+    print(f"状态码: {response.status_code}")
+    for _ in range(60):
+        status = requests.get(f"{BASE_URL}/duplicates", params={'limit': 1}).json().get('status', {})
+        if status.get('state') != 'running':
+            break
+        time.sleep(1)
+    data = requests.get(f"{BASE_URL}/duplicates", params={'limit': 5, 'include_images': 'false'}).json()
+    print(f"任务状态: {data.get('status', {}).get('state')}, 重复组数: {data.get('total_groups', 0)}")
+    for group in data.get('data', []):
+        print(f"  {group['size']} 张, 最高相似度 {group['max_similarity']}: {group['images'][0]['path']}")
+    print()
+
 @timer
 def test_get_stats():
     """测试获取统计信息"""
@@ -95,6 +241,7 @@ def test_get_stats():
     print(f"总图片数: {stats.get('total_images', 0)}")
     print(f"特征数量: {stats.get('feature_count', 0)}")
     print(f"总大小: {stats.get('total_size_mb', 0)} MB")
+    print(f"推理服务: {stats.get('inference', {})}")
     print()
 
 @timer
@@ -139,6 +286,14 @@ def run_all_tests():
         test_health_check()
         test_get_random_images()
         test_text_search()
+        test_similar_search()
+        test_walk()
+        test_batch_search()
+        test_compose_search()
+        test_paged_search()
+        test_filtered_search()
+        test_auto_albums()
+        test_duplicates()
         test_get_stats()
         test_get_config()
         test_index()
@@ -0,0 +1,111 @@
+import os
+import sys
+import types
+import hashlib
+
+import numpy as np
+import pytest
+import torch
+from loguru import logger
+from PIL import Image
+
+# 测试直接导入 backend 下的模块（与 app.py 的导入方式一致）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# loguru 默认绑定导入时的 stderr（即 pytest 的捕获流），退出时保存缓存等日志会写入已关闭的流
+logger.remove()
+logger.add(lambda message: sys.stderr.write(message), level='DEBUG')
+
+FEATURE_DIM = 512
+
+
+class StubClip(torch.nn.Module):
+    """代替 CLIP 的确定性小模型：图片缩小后做一次固定的随机投影，文本按内容哈希投影"""
+    def __init__(self):
+        super().__init__()
+        generator = torch.Generator().manual_seed(0)
+        self.image_proj = torch.randn(3 * 8 * 8, FEATURE_DIM, generator=generator)
+        self.text_proj = torch.randn(64, FEATURE_DIM, generator=generator)
+
+    def encode_image(self, images):
+        return torch.nn.functional.adaptive_avg_pool2d(images, 8).flatten(1) @ self.image_proj
+
+    def encode_text(self, tokens):
+        return tokens.float() @ self.text_proj
+
+
+def stub_preprocess(image):
+    image = image.convert('RGB').resize((32, 32))
+    return torch.from_numpy(np.asarray(image, dtype=np.float32) / 255.).permute(2, 0, 1)
+
+
+def stub_tokenize(texts):
+    tokens = torch.zeros(len(texts), 64)
+    for i, text in enumerate(texts):
+        tokens[i] = torch.tensor(list(hashlib.md5(text.encode('utf-8')).digest()) * 4, dtype=torch.float32) / 255.
+    return tokens
+
+
+# 测试不下载模型权重，open_clip 与 cn_clip 均替换为上面的小模型
+open_clip = types.ModuleType('open_clip')
+open_clip.create_model_and_transforms = lambda *args, **kwargs: (StubClip(), None, stub_preprocess)
+open_clip.get_tokenizer = lambda name: stub_tokenize
+cn_clip = types.ModuleType('cn_clip')
+cn_clip.clip = types.SimpleNamespace(load_from_name=lambda *args, **kwargs: (StubClip(), stub_preprocess),
+                                     tokenize=stub_tokenize)
+sys.modules['open_clip'] = open_clip
+sys.modules['cn_clip'] = cn_clip
+
+
+def save_image(path, seed):
+    """写入一张内容由 seed 决定的随机图片"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pixels = (np.random.default_rng(seed).random((40, 40, 3)) * 255).astype(np.uint8)
+    Image.fromarray(pixels).save(path)
+
+
+@pytest.fixture
+def album_dir(tmp_path):
+    """两个子目录、共 12 张图片的相册"""
+    root = tmp_path / 'images'
+    for i in range(12):
+        save_image(str(root / f'd{i % 2}' / f'img{i}.png'), i)
+    return root
+
+
+@pytest.fixture
+def make_database(tmp_path):
+    """按需在临时目录中建库，数据库文件与备份都放在 tmp_path 下"""
+    from models.database import DataBase
+
+    def make(root_path, settings=None):
+        return DataBase(str(root_path), dump_path=str(tmp_path / 'db.pt'), backup_path=str(tmp_path / 'backup'),
+                        max_workers=2, settings=settings)
+    return make
+
+
+@pytest.fixture
+def make_album(tmp_path):
+    """按需在临时目录中创建相册，数据库及其旁路文件都放在 tmp_path 下"""
+    from models.album import Album
+
+    def make(root_path, settings=None):
+        return Album(str(root_path), dump_path=str(tmp_path / 'db.pt'), backup_path=str(tmp_path / 'backup'),
+                     max_workers=2, settings=settings)
+    return make
+
+
+@pytest.fixture
+def client(tmp_path, album_dir, monkeypatch):
+    """指向临时相册的 Flask 测试客户端"""
+    import app as app_module
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app_module, '_album_instance', None)
+    app = app_module.create_app('development')
+    app.config.update(ROOT_PATH=str(album_dir), DUMP_PATH=str(tmp_path / 'db.pt'),
+                      BACKUP_PATH=str(tmp_path / 'backup'))
+    yield app.test_client()
+    # 日志处理器绑定了 pytest 捕获的输出流，测试结束后移除
+    for handler in list(app.logger.handlers):
+        app.logger.removeHandler(handler)
+        handler.close()
@@ -0,0 +1,81 @@
+import torch
+
+from models.cache import EmbeddingCache, normalize_query
+from models.settings import AlbumSettings
+
+
+def test_cache_evicts_least_recently_used():
+    cache = EmbeddingCache(max_size=2)
+    cache.put('a', torch.ones(4))
+    cache.put('b', torch.zeros(4))
+    assert cache.get('a') is not None
+    cache.put('c', torch.ones(4))
+
+    # 'a' 刚被访问过，淘汰的是 'b'
+    assert cache.get('b') is None and cache.get('a') is not None and cache.get('c') is not None
+    stats = cache.stats()
+    assert stats['size'] == 2 and stats['evictions'] == 1 and (stats['hits'], stats['misses']) == (3, 1)
+
+
+def test_cache_persists_most_recent_entries(tmp_path):
+    path = str(tmp_path / 'cache.pt')
+    cache = EmbeddingCache(max_size=3, persist_path=path)
+    for i in range(3):
+        cache.put(('model', 'en', str(i)), torch.full((4,), float(i)))
+    cache.get(('model', 'en', '0'))
+    cache.save()
+
+    # 容量变小时按LRU顺序保留最近使用的部分
+    loaded = EmbeddingCache(max_size=2, persist_path=path)
+    assert len(loaded) == 2 and loaded.get(('model', 'en', '1')) is None
+    assert torch.equal(loaded.get(('model', 'en', '0')), torch.zeros(4))
+
+
+def test_repeated_text_queries_are_encoded_once(album_dir, make_album, monkeypatch):
+    album = make_album(album_dir, AlbumSettings({'TEXT_CACHE_PERSIST': False}))
+    encode_texts = album.inference.encode_texts
+    encoded = []
+
+    def counting(texts):
+        encoded.extend(texts)
+        return encode_texts(texts)
+
+    monkeypatch.setattr(album.inference, 'encode_texts', counting)
+    first = album.encode_texts(['A  red Car', 'a dog', 'a red car'])
+    second = album.encode_texts([' a red car '])
+
+    # 规范化后相同的查询只编码一次，之后命中缓存
+    assert encoded == ['a red car', 'a dog']
+    assert normalize_query(' A  red Car ') == 'a red car'
+    assert torch.equal(first[0], first[2]) and torch.equal(second[0], first[0])
+    assert torch.allclose(first.norm(dim=-1), torch.ones(3))
+    assert album.text_cache.stats()['hits'] == 1
+
+
+def test_uploaded_images_reuse_cached_and_album_features(album_dir, make_album, tmp_path, monkeypatch):
+    from conftest import save_image
+
+    album = make_album(album_dir, AlbumSettings({'TEXT_CACHE_PERSIST': False}))
+    encode_images = album.inference.encode_images
+    encoded = []
+
+    def counting(images):
+        encoded.append(len(images))
+        return encode_images(images)
+
+    monkeypatch.setattr(album.inference, 'encode_images', counting)
+    album_path = str(album_dir / 'd0' / 'img2.png')
+    upload_path = str(tmp_path / 'upload.png')
+    save_image(upload_path, 99)
+    with open(album_path, 'rb') as f:
+        album_bytes = f.read()
+    with open(upload_path, 'rb') as f:
+        upload_bytes = f.read()
+
+    # 与相册中文件内容相同的上传直接使用已存储的特征，重复上传命中缓存
+    features = album.encode_image_data([album_bytes, upload_bytes, upload_bytes])
+    again = album.encode_image_data([upload_bytes, album_bytes])
+    assert encoded == [1]
+    assert torch.equal(features[0], album.index.get_feature(path=album_path)[0])
+    assert torch.equal(features[1], features[2]) and torch.equal(again[0], features[1])
+    assert album.image_album_hits == 1 and album.image_cache.stats()['hits'] == 2
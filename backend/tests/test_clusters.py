@@ -0,0 +1,78 @@
+import numpy as np
+import torch
+
+from models.clusters import AutoAlbums, REFIT_GROWTH
+from models.index import SearchIndex
+
+
+def make_features(n=400, dim=32, clusters=4, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    centers = torch.randn(clusters, dim, generator=generator)
+    features = centers[torch.arange(n) % clusters] + 0.2 * torch.randn(n, dim, generator=generator)
+    return torch.nn.functional.normalize(features, dim=-1)
+
+
+def check_assignment(albums, features):
+    """每张图片属于最近的中心，成员按与中心的相似度降序排列"""
+    sims = features @ albums.centroids.T
+    assert np.array_equal(albums.labels, sims.argmax(dim=-1).numpy())
+    assert np.allclose(albums.sims, sims.max(dim=-1).values.numpy(), atol=1e-5)
+    for cluster, size in albums.summary():
+        members = albums.members(cluster)
+        assert len(members) == size and (np.diff(albums.sims[members]) <= 0).all()
+    assert sum(size for _, size in albums.summary()) == len(features)
+
+
+def test_training_and_incremental_update():
+    features = make_features()
+    albums = AutoAlbums(n_clusters=8, batch_size=64).update(features[:300])
+    assert len(albums.centroids) == 8 and albums.fitted_size == 300
+    check_assignment(albums, features[:300])
+
+    # 新增的图片按批分配到最近的中心并更新中心，已有图片的分配不变，不重新训练
+    updated = albums.update(features)
+    assert updated.fitted_size == 300 and len(updated) == 400
+    assert np.array_equal(updated.labels[:300], albums.labels)
+    new_sims = features[300:] @ updated.centroids.T
+    assert np.allclose(updated.sims[300:], np.take_along_axis(new_sims.numpy(), updated.labels[300:, None], 1)[:, 0],
+                       atol=0.05)
+    # 图片数增长过多时重新训练
+    assert albums.update(make_features(n=300 * REFIT_GROWTH + 10)).fitted_size == 300 * REFIT_GROWTH + 10
+
+
+def test_remove_drops_rows_and_counts():
+    features = make_features()
+    albums = AutoAlbums(n_clusters=4, batch_size=64).update(features)
+    removed = [0, 1, 2, 3, 100]
+    smaller = albums.remove(removed)
+    keep = np.setdiff1d(np.arange(len(features)), removed)
+    assert np.array_equal(smaller.labels, albums.labels[keep])
+    assert float(albums.counts.sum() - smaller.counts.sum()) == len(removed)
+    # 原对象不受影响
+    assert len(albums) == 400
+
+
+def test_routed_search_matches_search_on_routed_rows():
+    features = make_features()
+    paths = [str(i) for i in range(len(features))]
+    albums = AutoAlbums(n_clusters=8, batch_size=64).update(features)
+    index = SearchIndex(features, paths, normalized=True, clusters=albums)
+    queries = features[[0, 1, 2]]
+
+    scores, indices = index.search(queries, 5, route=2)
+    for query, row_scores, row_indices in zip(queries, scores, indices):
+        rows = albums.route(query.unsqueeze(0), 2)
+        expected_scores, expected_indices = index.search(query.unsqueeze(0), 5, rows=rows)
+        assert torch.equal(row_indices, expected_indices[0]) and torch.allclose(row_scores, expected_scores[0])
+    assert torch.equal(indices[:, 0], torch.tensor([0, 1, 2]))
+
+
+def test_save_and_load(tmp_path):
+    albums = AutoAlbums(n_clusters=4, batch_size=64).update(make_features())
+    path = str(tmp_path / 'db.clusters.npz')
+    albums.save(path, index_version=7)
+
+    loaded = AutoAlbums.load(path, batch_size=64)
+    assert loaded.index_version == 7 and loaded.fitted_size == albums.fitted_size
+    assert torch.equal(loaded.centroids, albums.centroids) and np.array_equal(loaded.labels, albums.labels)
+    assert loaded.summary() == albums.summary()
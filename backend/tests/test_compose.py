@@ -0,0 +1,44 @@
+import pytest
+import torch
+
+from models.settings import AlbumSettings
+
+
+def test_composed_ranking_matches_weighted_term_scores(album_dir, make_album):
+    album = make_album(album_dir, AlbumSettings({'TEXT_CACHE_PERSIST': False}))
+    index = album.index
+    liked, disliked = str(album_dir / 'd0' / 'img2.png'), str(album_dir / 'd1' / 'img5.png')
+    terms = [{'text': 'a beach'}, {'path': liked, 'weight': 2}, {'index': index.path_to_index[disliked], 'weight': -1}]
+
+    text = album.encode_texts(['a beach'])[0]
+    term_features = torch.stack([text, index.get_feature(path=liked)[0], index.get_feature(path=disliked)[0]])
+    weights = torch.tensor([1.0, 2.0, -1.0])
+    query = album.compose_query(terms)
+    assert torch.allclose(query, torch.nn.functional.normalize(weights @ term_features, dim=0), atol=1e-6)
+
+    # 一次扫描的排序与逐项余弦相似度加权求和的排序一致
+    paths, scores = album.compose_search(terms, k=12, score_mode='cosine')
+    combined = weights @ (term_features @ index.features[:].T)
+    assert paths == [index.paths[i] for i in torch.argsort(combined, descending=True).tolist()]
+    assert paths[0] == liked and paths[-1] == disliked
+
+
+def test_invalid_terms_are_rejected(album_dir, make_album):
+    album = make_album(album_dir, AlbumSettings({'TEXT_CACHE_PERSIST': False}))
+    path = str(album_dir / 'd0' / 'img2.png')
+    with pytest.raises(ValueError):
+        album.compose_query([{'path': path}, {'path': path, 'weight': -1}])
+    with pytest.raises(ValueError):
+        album.compose_query([{'path': str(album_dir / 'missing.png')}])
+    with pytest.raises(ValueError):
+        album.compose_query([{'image': 0}])
+
+
+def test_compose_endpoint(client):
+    def compose(terms):
+        return client.post('/api/images/search/compose', json={'terms': terms, 'k': 3})
+
+    assert compose([]).status_code == 400
+    assert compose([{'weight': 1}]).status_code == 400
+    response = compose([{'text': 'a beach'}, {'text': 'a dog', 'weight': -0.5}])
+    assert response.status_code == 200 and len(response.get_json()['data']) == 3
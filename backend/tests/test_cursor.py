@@ -0,0 +1,41 @@
+from conftest import save_image
+from models.cursor import CursorStore
+
+
+def test_cursor_store_expires_and_evicts():
+    store = CursorStore(max_size=2, ttl=60)
+    first = store.create(['a', 'b', 'c'], [0.3, 0.2, 0.1], index_version=1)
+    second = store.create(['d'], [0.5], index_version=1)
+    assert store.get(first).page(1, 5) == (['b', 'c'], [0.2, 0.1])
+
+    # 超出容量时淘汰最久未访问的游标
+    third = store.create([], [], index_version=1)
+    assert store.get(second) is None and store.get(first) is not None
+    # 超过 ttl 未访问的游标失效
+    for cursor in store.cursors.values():
+        cursor.last_access -= 120
+    assert store.get(third) is None and len(store) == 0
+
+
+def test_pages_follow_the_full_ranking(client, album_dir):
+    import app as app_module
+
+    query = {'query': 'a photo', 'threshold': 0, 'score_mode': 'cosine'}
+    expected = client.post('/api/images/search/text', json=dict(query, k=12)).get_json()
+    first = client.post('/api/images/search/text', json=dict(query, page_size=5)).get_json()
+    assert first['total_candidates'] == 12 and first['has_more']
+
+    pages, offset = [first], first['next_offset']
+    while pages[-1]['has_more']:
+        pages.append(client.get(f"/api/images/search/page?cursor={first['cursor']}&offset={offset}&limit=5")
+                     .get_json())
+        offset = pages[-1]['next_offset']
+    assert [len(page['data']) for page in pages] == [5, 5, 2]
+    assert [item['path'] for page in pages for item in page['data']] == \
+        [item['path'] for item in expected['data']]
+
+    # 索引更新后游标失效，客户端需要重新检索
+    save_image(str(album_dir / 'd2' / 'new.png'), 50)
+    app_module._album_instance.database.update_db()
+    response = client.get(f"/api/images/search/page?cursor={first['cursor']}&offset=5&limit=5")
+    assert response.status_code == 410
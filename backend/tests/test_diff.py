@@ -0,0 +1,79 @@
+import os
+import shutil
+
+import torch
+
+from conftest import save_image
+from models.diff import diff_snapshot, ADDED, REMOVED, MODIFIED
+from models.metadata import METADATA_MTIME
+
+
+def test_diff_snapshot():
+    indexed = ['a.jpg', 'b.jpg', 'c.jpg', 'hidden/d.jpg']
+    snapshot = ['a.jpg', 'c.jpg', 'e.jpg']
+    # 快照中没有、但文件仍然存在（扫描器不进入的目录）的图片不算删除
+    exists = {'hidden/d.jpg'}.__contains__
+
+    changes = list(diff_snapshot(snapshot, indexed, lambda path, row: path == 'c.jpg', exists))
+    assert changes == [(MODIFIED, 'c.jpg', 2), (ADDED, 'e.jpg', None), (REMOVED, 'b.jpg', 1)]
+
+
+def test_moved_image_keeps_its_row(album_dir, make_database):
+    db = make_database(album_dir)
+    old_path = str(album_dir / 'd0' / 'img0.png')
+    row = db.path_to_index[old_path]
+    feature = db.db_features[row].clone()
+    count = len(db.img_paths)
+
+    new_path = str(album_dir / 'd1' / 'renamed.png')
+    shutil.move(old_path, new_path)
+    assert db.update_db() == 1
+
+    # 按内容指纹配对，只改路径，特征和行号不变
+    assert len(db.img_paths) == count and old_path not in db.path_to_index
+    assert db.path_to_index[new_path] == row
+    assert torch.equal(db.db_features[row], feature)
+
+
+def test_modified_image_is_reindexed(album_dir, make_database):
+    db = make_database(album_dir)
+    path = str(album_dir / 'd1' / 'img1.png')
+    feature = db.db_features[db.path_to_index[path]].clone()
+    untouched = str(album_dir / 'd0' / 'img2.png')
+
+    fingerprint = db.fingerprints[path]
+    count = len(db.img_paths)
+
+    # 原地改写（大小不变时修改时间仍会变化），完整扫描时按内容指纹确认
+    save_image(path, 100)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert db.update_db(full=True) > 0
+
+    assert len(db.img_paths) == count and untouched in db.path_to_index
+    assert db.fingerprints[path] != fingerprint
+    assert not torch.allclose(db.db_features[db.path_to_index[path]], feature)
+
+
+def test_touched_image_keeps_its_features(album_dir, make_database):
+    db = make_database(album_dir)
+    path = str(album_dir / 'd0' / 'img4.png')
+    row = db.path_to_index[path]
+    feature = db.db_features[row].clone()
+
+    # 只有修改时间变化、内容相同：只更新记录，不重新提取特征
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    db.update_db(full=True)
+
+    assert db.path_to_index[path] == row
+    assert torch.equal(db.db_features[row], feature)
+    assert db.metadata[path][METADATA_MTIME] == os.stat(path).st_mtime
+
+
+def test_diff_snapshot_with_duplicate_indexed_paths():
+    indexed = ['a.jpg', 'b.jpg', 'a.jpg', 'c.jpg']
+    gone = {'c.jpg'}
+
+    changes = list(diff_snapshot(['a.jpg', 'b.jpg'], indexed, exists=lambda path: path not in gone))
+    assert changes == [(REMOVED, 'c.jpg', 3)]
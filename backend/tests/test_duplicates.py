@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import torch
+
+from models.duplicates import DuplicateFinder, blocked_pairs, cluster_pairs, get_checkpoint_path
+from models.index import SearchIndex
+
+
+def make_index(n=50, dim=32, seed=0):
+    """随机特征中混入三组近似重复：(0, 10, 20)、(5, 45) 和 (30, 31)"""
+    generator = torch.Generator().manual_seed(seed)
+    features = torch.randn(n, dim, generator=generator)
+    for source, copies in ((0, (10, 20)), (5, (45,)), (30, (31,))):
+        for copy in copies:
+            features[copy] = features[source] + 0.05 * torch.randn(dim, generator=generator)
+    features = torch.nn.functional.normalize(features, dim=-1)
+    return SearchIndex(features, [f'img{i:02d}.jpg' for i in range(n)], version=1, normalized=True)
+
+
+def test_blocked_pairs_match_full_self_similarity():
+    index = make_index()
+    similarity = index.features @ index.features.T
+    expected = {(i, j) for i, j in zip(*np.nonzero(np.triu(similarity.numpy() >= 0.9, k=1)))}
+
+    found = set()
+    for _, rows, cols, sims in blocked_pairs(index.features, 0.9, block_size=7):
+        assert (rows < cols).all() and (sims >= 0.9).all()
+        found.update(zip(rows.tolist(), cols.tolist()))
+    assert found == expected and len(found) == 5
+
+
+def test_cluster_pairs_merges_transitive_pairs():
+    rows, cols = np.array([3, 1, 7]), np.array([4, 3, 8])
+    clusters = cluster_pairs(rows, cols, np.array([0.96, 0.99, 0.97], dtype=np.float32))
+    assert [sorted(members) for members, _ in clusters] == [[1, 3, 4], [7, 8]]
+    assert np.isclose(clusters[0][1], 0.99)
+
+
+def test_stopped_detection_resumes_from_checkpoint(tmp_path):
+    index = make_index()
+    dump_path = str(tmp_path / 'db.pt')
+    expected = DuplicateFinder(str(tmp_path / 'fresh.pt'), threshold=0.9, block_size=8)
+    expected.run(index, 0.9, 8)
+
+    # 停止请求在第一个行块完成后生效，检查点记录下一个行块
+    finder = DuplicateFinder(dump_path, threshold=0.9, block_size=8)
+    finder.stop_event.set()
+    finder.run(index, 0.9, 8)
+    assert finder.state == 'stopped' and finder.progress == 1
+    assert os.path.exists(get_checkpoint_path(dump_path))
+
+    resumed = DuplicateFinder(dump_path, threshold=0.9, block_size=8)
+    assert resumed.status()['state'] == 'interrupted'
+    resumed.run(index, 0.9, 8)
+    assert resumed.state == 'done' and not os.path.exists(get_checkpoint_path(dump_path))
+    assert resumed.result['clusters'] == expected.result['clusters']
+    assert sorted(c['paths'] for c in resumed.result['clusters']) == [
+        ['img00.jpg', 'img10.jpg', 'img20.jpg'], ['img05.jpg', 'img45.jpg'], ['img30.jpg', 'img31.jpg']]
+
+
+def test_stale_results_drop_removed_images(tmp_path):
+    index = make_index()
+    finder = DuplicateFinder(str(tmp_path / 'db.pt'), threshold=0.9, block_size=16)
+    finder.run(index, 0.9, 16)
+
+    # 结果按路径保存，重新加载后仍可查看；索引更新后标记为过期，并去掉已删除的图片
+    finder = DuplicateFinder(str(tmp_path / 'db.pt'))
+    assert finder.status(index_version=1)['stale'] is False
+    assert finder.status(index_version=2)['stale'] is True
+    valid_paths = set(index.paths) - {'img10.jpg', 'img31.jpg'}
+    clusters, total = finder.get_clusters(valid_paths=valid_paths)
+    assert total == 2 and sorted(c['paths'] for c in clusters) == [['img00.jpg', 'img20.jpg'],
+                                                                   ['img05.jpg', 'img45.jpg']]
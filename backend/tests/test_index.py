@@ -0,0 +1,179 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from conftest import save_image
+from models.ann import IVFIndex
+from models.index import SearchIndex, LOGIT_SCALE
+from models.quantize import quantize_features
+from models.settings import AlbumSettings
+
+
+def make_features(n=3000, dim=512, clusters=20, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    centers = torch.randn(clusters, dim, generator=generator)
+    features = centers[torch.randint(0, clusters, (n,), generator=generator)]
+    features = features + 0.8 * torch.randn(n, dim, generator=generator)
+    queries = features[:8] + 0.3 * torch.randn(8, dim, generator=generator)
+    return torch.nn.functional.normalize(features, dim=-1), torch.nn.functional.normalize(queries, dim=-1)
+
+
+@pytest.mark.parametrize('precision', ['fp16', 'int8'])
+def test_quantized_softmax_matches_fp32(precision):
+    features, queries = make_features()
+    paths = [str(i) for i in range(len(features))]
+    exact = SearchIndex(features, paths)
+    quantized = SearchIndex(features, paths, quantized=quantize_features(features, precision))
+
+    # 自身查询时概率质量集中在一张图片上，最容易暴露分子分母不一致
+    for query in (queries, features[:4]):
+        scores, indices = quantized.search(query, 10)
+        expected_scores, expected_indices = exact.search(query, 10)
+        assert scores.max() <= 1.0 + 1e-6
+        assert torch.equal(indices, expected_indices)
+        assert torch.allclose(scores, expected_scores, rtol=1e-2, atol=1e-6)
+
+
+@pytest.mark.parametrize('precision', ['fp16', 'int8'])
+def test_quantized_softmax_on_rows_matches_fp32(precision):
+    features, queries = make_features()
+    paths = [str(i) for i in range(len(features))]
+    exact = SearchIndex(features, paths)
+    quantized = SearchIndex(features, paths, quantized=quantize_features(features, precision))
+    rows = torch.arange(0, len(features), 3)
+
+    scores, indices = quantized.search(queries, 10, rows=rows)
+    expected_scores, expected_indices = exact.search(queries, 10, rows=rows)
+    assert scores.max() <= 1.0 + 1e-6
+    assert torch.equal(indices, expected_indices)
+    assert torch.allclose(scores, expected_scores, rtol=1e-2, atol=1e-6)
+
+
+@pytest.mark.parametrize('precision', ['fp16', 'int8'])
+def test_quantized_append_and_remove_match_full_quantization(precision):
+    features, _ = make_features(n=500)
+    removed = [0, 7, 123, 499]
+    keep = torch.ones(len(features), dtype=torch.bool)
+    keep[removed] = False
+
+    quantized = quantize_features(features[:400], precision).append(features[400:]).remove(removed)
+    expected = quantize_features(features[keep], precision)
+    assert torch.equal(quantized.data, expected.data)
+    if precision == 'int8':
+        assert torch.equal(quantized.scales, expected.scales)
+
+
+def test_database_updates_derived_rows_incrementally(album_dir, make_database, monkeypatch):
+    from models import database
+
+    db = make_database(album_dir, AlbumSettings({'FEATURE_PRECISION': 'int8'}))
+    assert len(db.quantized) == 12
+
+    def quantize_all(*args):
+        raise AssertionError("update re-quantized the whole album")
+
+    # 之后的更新只量化新增的行，删除、追加和修改记录都不再整理全库
+    monkeypatch.setattr(database, 'quantize_features', quantize_all)
+    os.remove(album_dir / 'd0' / 'img0.png')
+    save_image(str(album_dir / 'd2' / 'new0.png'), 60)
+    touched = str(album_dir / 'd1' / 'img3.png')
+    stat = os.stat(touched)
+    os.utime(touched, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert db.update_db(full=True) == 3
+    # 只追加时复制已有的映射
+    save_image(str(album_dir / 'd2' / 'new1.png'), 61)
+    assert db.update_db() == 1
+
+    expected = quantize_features(db.db_features[:], 'int8')
+    index = db.get_search_index()
+    assert index.quantized is db.quantized
+    assert torch.equal(db.quantized.data, expected.data) and torch.equal(db.quantized.scales, expected.scales)
+    columns = db.metadata_columns()
+    assert all(np.array_equal(index.metadata.columns[name], column, equal_nan=True)
+               for name, column in columns.items())
+    assert index.metadata.columns['mtime'][db.path_to_index[touched]] == os.stat(touched).st_mtime
+    assert index.path_to_index == {path: idx for idx, path in enumerate(db.img_paths)}
+    assert db.fingerprint_to_path == {fp: path for path, fp in db.fingerprints.items()}
+
+
+def test_index_normalizes_once_and_reuses_normalized_features():
+    features, _ = make_features(n=200, dim=64)
+    paths = [str(i) for i in range(len(features))]
+
+    # 已归一化的特征直接引用，不复制
+    index = SearchIndex(features, paths, version=3, normalized=True)
+    assert index.features.data_ptr() == features.data_ptr()
+    assert index.version == 3 and index.path_to_index['7'] == 7
+
+    # 未归一化的特征在构建时归一化一次，查询结果与归一化后的特征一致
+    scaled = SearchIndex(features * torch.linspace(0.5, 2.0, len(features)).unsqueeze(1), paths)
+    assert torch.allclose(scaled.features.norm(dim=-1), torch.ones(len(features)), atol=1e-5)
+    scores, indices = scaled.search(features[:5], 3, score_mode='cosine')
+    expected_scores, expected_indices = index.search(features[:5], 3, score_mode='cosine')
+    assert torch.equal(indices, expected_indices) and torch.equal(indices[:, 0], torch.arange(5))
+    assert torch.allclose(scores, expected_scores, atol=1e-5)
+
+
+def test_ann_probing_all_lists_matches_exact():
+    features, queries = make_features()
+    paths = [str(i) for i in range(len(features))]
+    ann = IVFIndex(features.shape[1], nlist=16, nprobe=16)
+    ann.train(features)
+    ann.add(features)
+    exact = SearchIndex(features, paths)
+    approximate = SearchIndex(features, paths, ann=ann)
+
+    # 探查全部倒排列表时候选即为全库，排序和softmax分数都应与精确检索一致
+    for score_mode in ('softmax', 'cosine'):
+        scores, indices = approximate.search(queries, 10, score_mode=score_mode)
+        expected_scores, expected_indices = exact.search(queries, 10, score_mode=score_mode)
+        assert torch.equal(indices, expected_indices)
+        assert torch.allclose(scores, expected_scores, rtol=1e-4, atol=1e-6)
+
+
+def test_ann_with_pq_finds_self_after_remove():
+    features, _ = make_features(n=2000)
+    ann = IVFIndex(features.shape[1], nlist=8, nprobe=2, pq_m=16)
+    ann.train(features)
+    ann.add(features)
+    removed = list(range(0, 2000, 7))
+    ann.remove(removed)
+    kept = torch.from_numpy(np.setdiff1d(np.arange(2000), removed))
+    remaining = features[kept]
+
+    # PQ近似分数筛选候选，再用原始特征精确重排，自身查询排在第一位；删除后行号重新编号
+    _, indices = ann.search(remaining[:20], 5, features=remaining)
+    assert ann.ntotal == len(remaining)
+    assert torch.equal(indices[:, 0], torch.arange(20))
+
+
+def test_cosine_mode_returns_raw_similarity():
+    features, queries = make_features(n=1000)
+    index = SearchIndex(features, [str(i) for i in range(len(features))], normalized=True)
+    similarity = queries @ features.T
+
+    scores, indices = index.search(queries, 10, score_mode='cosine')
+    expected_scores, expected_indices = torch.topk(similarity, 10)
+    assert torch.equal(indices, expected_indices)
+    assert torch.allclose(scores, expected_scores, atol=1e-6)
+
+    # 排序与 softmax 模式一致，概率由同一组相似度得到
+    probs, softmax_indices = index.search(queries, 10)
+    assert torch.equal(softmax_indices, indices)
+    assert torch.allclose(probs, torch.softmax(LOGIT_SCALE * similarity, dim=-1).gather(1, indices), atol=1e-6)
+
+    # 阈值直接作用于余弦相似度
+    threshold = float(expected_scores[0, 4])
+    scores, indices = index.search(queries[:1], 10, threshold=threshold, score_mode='cosine')
+    assert (indices[0] >= 0).sum() == 4 and bool((scores[0, :4] > threshold).all())
+    with pytest.raises(ValueError):
+        index.search(queries, 10, score_mode='logits')
+
+
+def test_unknown_score_mode_is_rejected(client):
+    response = client.post('/api/images/search/text', json={'query': 'cat', 'score_mode': 'logits'})
+    assert response.status_code == 400
+    response = client.post('/api/images/search/text', json={'query': 'cat', 'k': 3, 'score_mode': 'cosine'})
+    assert response.status_code == 200 and len(response.get_json()['data']) == 3
@@ -0,0 +1,39 @@
+import pytest
+import torch
+
+from models.inference import InferenceService
+
+
+def test_concurrent_requests_share_one_forward_pass():
+    threads = torch.get_num_threads()
+    service = InferenceService(max_batch=8, max_delay_ms=200)
+    # 算子内线程数只在启动时设置，推理服务不修改
+    assert torch.get_num_threads() == threads
+
+    images = [torch.rand(1, 3, 32, 32) for _ in range(4)]
+    futures = [service.submit('image', image) for image in images]
+    results = [future.result(timeout=10) for future in futures]
+
+    expected = service.model.encode_image(torch.cat(images))
+    assert torch.allclose(torch.cat(results), expected, atol=1e-5)
+    stats = service.stats()
+    assert stats['requests'] == 4 and stats['batches'] == 1 and stats['samples'] == 4
+
+
+def test_requests_of_different_kinds_are_batched_separately():
+    service = InferenceService(max_batch=8, max_delay_ms=50)
+    image = service.submit('image', torch.rand(2, 3, 32, 32))
+    text = service.submit('text', service.tokenizer(['a cat', 'a dog', 'a bird']))
+
+    assert image.result(timeout=10).shape == (2, 512)
+    assert torch.allclose(text.result(timeout=10), service.encode_texts(['a cat', 'a dog', 'a bird']))
+    assert service.stats()['batches'] == 3
+
+
+def test_failed_batch_is_reported_to_each_request():
+    service = InferenceService(max_batch=8, max_delay_ms=50)
+    broken = service.submit('image', torch.rand(1, 5, 32, 32))
+    with pytest.raises(RuntimeError):
+        broken.result(timeout=10)
+    # 出错后服务继续处理后续请求
+    assert service.encode_images(torch.rand(1, 3, 32, 32)).shape == (1, 512)
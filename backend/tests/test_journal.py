@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+
+from models.journal import Journal, RECORD_HEADER
+
+
+def make_record(i):
+    record = {'set_paths': [], 'append_paths': [f'{i}.jpg']}
+    arrays = {
+        'set_rows': np.empty(0, dtype=np.int64),
+        'removed': np.array([i], dtype=np.int64),
+        'append_features': np.full((1, 4), i, dtype=np.float32),
+    }
+    return record, arrays
+
+
+def replay(journal):
+    return [(record['append_paths'], arrays['removed'].tolist(), arrays['append_features'].tolist())
+            for record, arrays in journal.replay()]
+
+
+def test_replay_returns_records_in_order(tmp_path):
+    journal = Journal(str(tmp_path / 'journal.0.log'))
+    for i in range(3):
+        journal.append(*make_record(i))
+
+    assert replay(journal) == [([f'{i}.jpg'], [i], [[float(i)] * 4]) for i in range(3)]
+
+
+def test_replay_truncates_torn_tail(tmp_path):
+    journal = Journal(str(tmp_path / 'journal.0.log'))
+    sizes = [journal.append(*make_record(i)) for i in range(3)]
+    committed = sum(sizes[:2])
+    # 模拟写最后一条记录时崩溃：只有一部分落盘
+    with open(journal.path, 'r+b') as f:
+        f.truncate(committed + RECORD_HEADER.size + 5)
+
+    assert [paths for paths, _, _ in replay(journal)] == [['0.jpg'], ['1.jpg']]
+    assert journal.size() == committed
+
+    # 截断后可以继续追加，新记录紧接在最后一条完整记录之后
+    journal.append(*make_record(3))
+    assert [paths for paths, _, _ in replay(journal)] == [['0.jpg'], ['1.jpg'], ['3.jpg']]
+
+
+def test_replay_truncates_corrupted_record(tmp_path):
+    journal = Journal(str(tmp_path / 'journal.0.log'))
+    sizes = [journal.append(*make_record(i)) for i in range(3)]
+    # 翻转第二条记录数据中的一个字节，CRC 校验失败，其后的记录一并丢弃
+    offset = sizes[0] + sizes[1] - 1
+    with open(journal.path, 'r+b') as f:
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    assert [paths for paths, _, _ in replay(journal)] == [['0.jpg']]
+    assert os.path.getsize(journal.path) == sizes[0]
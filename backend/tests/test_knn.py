@@ -0,0 +1,41 @@
+import numpy as np
+import torch
+
+from models.knn import KnnGraph
+
+
+def make_features(n=300, dim=32, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.nn.functional.normalize(torch.randn(n, dim, generator=generator), dim=-1)
+
+
+def assert_same_graph(graph, expected):
+    assert not graph.needs_update(expected.count)
+    assert np.array_equal(graph.neighbors, expected.neighbors)
+    assert np.allclose(graph.sims, expected.sims, atol=1e-6)
+    assert np.allclose(graph.lse, expected.lse, rtol=1e-6)
+
+
+def test_incremental_update_matches_full_build():
+    features = make_features()
+    graph = KnnGraph(k=8, block_size=64).update(features[:200]).update(features)
+    assert_same_graph(graph, KnnGraph(k=8, block_size=64).update(features))
+
+
+def test_remove_then_update_matches_full_build():
+    features = make_features()
+    graph = KnnGraph(k=8, block_size=64).update(features)
+    removed = list(range(0, 300, 4))
+    kept = torch.from_numpy(np.setdiff1d(np.arange(300), removed))
+    remaining = features[kept]
+
+    # 删除后行号立即重映射，lse 已减去被删除图片的贡献；失去近邻的行标记为待修复
+    removed_graph = graph.remove(removed, features)
+    assert removed_graph.count == len(remaining) and len(removed_graph.dirty) > 0
+    assert removed_graph.neighbors.max() < len(remaining)
+    expected = KnnGraph(k=8, block_size=64).update(remaining)
+    assert np.allclose(removed_graph.lse, expected.lse, rtol=1e-6)
+    # 原来的图不受影响
+    assert graph.count == 300
+
+    assert_same_graph(removed_graph.update(remaining), expected)
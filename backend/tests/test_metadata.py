@@ -0,0 +1,35 @@
+from conftest import save_image
+
+
+def test_serving_index_is_not_changed_by_updates(album_dir, make_database):
+    db = make_database(album_dir)
+    index = db.get_search_index()
+    query = index.features[:1].clone()
+
+    for i in range(3):
+        save_image(str(album_dir / 'd2' / f'new{i}.png'), 50 + i)
+    db.update_db(full=True)
+
+    # 旧版本的索引继续服务正在进行的查询，路径、元数据与特征的行数保持一致
+    assert len(index.metadata) == len(index.paths) == len(index.features) == 12
+    rows = index.filter_rows({'ext': 'png'})
+    assert len(rows) == 12
+    scores, indices = index.search(query, 5, rows=rows)
+    assert indices.max() < 12
+    assert len(db.get_search_index().filter_rows({'folder': str(album_dir / 'd2')})) == 3
+
+
+def test_range_filters_are_validated(client):
+    def search(filters):
+        return client.post('/api/images/search/text', json={'query': 'cat', 'k': 5, 'threshold': 0,
+                                                            'filters': filters})
+
+    response = search({'min_size': 'big'})
+    assert response.status_code == 400 and 'min_size' in response.get_json()['error']
+    assert search({'max_width': [1]}).status_code == 400
+    assert search({'date_from': 'yesterday'}).status_code == 400
+
+    # 数字字符串和日期字符串按数值比较
+    response = search({'min_size': '1', 'max_width': '40', 'date_to': '2999-01-01'})
+    assert response.status_code == 200 and response.get_json()['total_results'] == 5
+    assert search({'min_size': 10 ** 9}).get_json()['total_results'] == 0
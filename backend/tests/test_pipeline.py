@@ -0,0 +1,97 @@
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+import torch
+
+from models import pipeline
+from models.pipeline import EmbeddingPipeline
+
+
+def load_tensor(path):
+    """按路径中的数字生成张量，数字为负时模拟解码失败"""
+    value = int(os.path.basename(path))
+    if value < 0:
+        raise ValueError('broken image')
+    return torch.full((3, 2, 2), float(value)), value
+
+
+def load_or_crash(path):
+    """模拟解码进程被杀死（不会执行任何清理）"""
+    if path.endswith('crash'):
+        os._exit(9)
+    return load_tensor(path)
+
+
+def encode(batch):
+    return batch.flatten(1)[:, :1]
+
+
+def run_pipeline(stage, paths):
+    """运行流水线，返回 (批大小列表, 值 -> 特征)"""
+    sizes, features = [], {}
+    for batch_paths, extras, batch_features in stage.run(paths):
+        assert len(batch_paths) == len(extras) == len(batch_features)
+        sizes.append(len(batch_paths))
+        features.update(zip(extras, batch_features[:, 0].tolist()))
+    return sizes, features
+
+
+def test_thread_decoding_fills_batches_and_skips_failures():
+    failed = []
+    paths = [str(i) for i in range(23)] + ['-1', '-2']
+    stage = EmbeddingPipeline(load_tensor, encode, batch_size=4, workers=3, queue_size=6,
+                              on_error=lambda path, error: failed.append(path))
+
+    sizes, features = run_pipeline(stage, paths)
+    # 除最后一批外每批都是满的，特征与解码结果对应
+    assert sizes == [4] * 5 + [3]
+    assert features == {i: float(i) for i in range(23)}
+    assert sorted(failed) == ['-1', '-2']
+
+
+def test_failed_batch_is_retried_one_by_one():
+    def fragile_encode(batch):
+        if (batch == 7).any():
+            raise RuntimeError('bad image')
+        return encode(batch)
+
+    failed = []
+    stage = EmbeddingPipeline(load_tensor, fragile_encode, batch_size=4, workers=1,
+                              on_error=lambda path, error: failed.append(path))
+    sizes, features = run_pipeline(stage, [str(i) for i in range(10)])
+    assert sum(sizes) == 9 and 7 not in features and failed == ['7']
+
+
+def test_closing_the_pipeline_stops_decode_threads():
+    before = threading.active_count()
+    stage = EmbeddingPipeline(load_tensor, encode, batch_size=2, workers=3, queue_size=2)
+    batches = stage.run([str(i) for i in range(100)])
+    next(batches)
+    batches.close()
+    assert threading.active_count() == before
+
+
+def test_process_decoding_matches_thread_decoding(monkeypatch):
+    monkeypatch.setattr(pipeline, 'MIN_PROCESS_IMAGES', 1)
+    failed = []
+    paths = [str(i) for i in range(30)] + ['-1']
+    # 槽位少于图片数，环形缓冲区的槽位需要被归还和复用
+    stage = EmbeddingPipeline(load_tensor, encode, batch_size=4, queue_size=6, processes=2, sample_shape=(3, 2, 2),
+                              on_error=lambda path, error: failed.append(path))
+
+    sizes, features = run_pipeline(stage, paths)
+    assert sizes == [4] * 7 + [2]
+    assert features == {i: float(i) for i in range(30)}
+    assert failed == ['-1']
+
+
+def test_dead_decode_process_raises(monkeypatch):
+    monkeypatch.setattr(pipeline, 'MIN_PROCESS_IMAGES', 1)
+    monkeypatch.setattr(pipeline, 'READY_TIMEOUT', 0.1)
+    paths = [str(i) for i in range(20)] + ['crash']
+    stage = EmbeddingPipeline(load_or_crash, encode, batch_size=4, processes=2, sample_shape=(3, 2, 2))
+
+    with pytest.raises(BrokenProcessPool):
+        list(stage.run(paths))
@@ -0,0 +1,28 @@
+import torch
+
+from models.index import SearchIndex
+from models.scan import ShardedScanner
+
+
+def test_sharded_scan_matches_single_scan():
+    threads = torch.get_num_threads()
+    scanner = ShardedScanner(shard_size=100, workers=3)
+    # 扫描器按启动时的算子内线程数分配线程，不修改进程级设置
+    assert torch.get_num_threads() == threads and scanner.intra_op_threads == threads
+
+    generator = torch.Generator().manual_seed(0)
+    features = torch.nn.functional.normalize(torch.randn(1050, 32, generator=generator), dim=-1)
+    queries = torch.randn(4, 32, generator=generator)
+    paths = [str(i) for i in range(len(features))]
+    single = SearchIndex(features, paths, normalized=True)
+    sharded = SearchIndex(features, paths, normalized=True, scanner=scanner)
+
+    for score_mode in ('softmax', 'cosine'):
+        scores, indices = sharded.search(queries, 10, score_mode=score_mode)
+        expected_scores, expected_indices = single.search(queries, 10, score_mode=score_mode)
+        assert torch.equal(indices, expected_indices)
+        assert torch.allclose(scores, expected_scores, rtol=1e-5, atol=1e-7)
+    # k 大于库大小时截去填充部分
+    scores, indices = sharded.search(queries[:1], 2000, score_mode='cosine')
+    assert indices.shape == (1, 1050) and (indices >= 0).all()
+    scanner.pool.shutdown()
@@ -0,0 +1,84 @@
+import torch
+
+from models import utils
+from models.selection import topk, bottomk, topk_by_threshold, chunked_topk, merge_topk
+
+
+def test_merge_topk_matches_global_topk():
+    scores = torch.randn(3, 100, generator=torch.Generator().manual_seed(0))
+    shard_values, shard_indices = [], []
+    for start in range(0, 100, 30):
+        values, indices = topk(scores[:, start:start + 30], 5)
+        shard_values.append(values)
+        shard_indices.append(indices + start)
+
+    values, indices = merge_topk(shard_values, shard_indices, 5)
+    expected_values, expected_indices = topk(scores, 5)
+    assert torch.equal(values, expected_values)
+    assert torch.equal(indices, expected_indices)
+
+
+def test_merge_topk_ties_keep_shard_order():
+    # 分数相同时先出现的分片在前，结果与分片的合并顺序一致、可重复
+    shard_values = [torch.tensor([[0.9, 0.5]]), torch.tensor([[0.9, 0.5]]), torch.tensor([[0.7, 0.5]])]
+    shard_indices = [torch.tensor([[0, 1]]), torch.tensor([[10, 11]]), torch.tensor([[20, 21]])]
+
+    values, indices = merge_topk(shard_values, shard_indices, 4)
+    assert torch.equal(values, torch.tensor([[0.9, 0.9, 0.7, 0.5]]))
+    assert indices.tolist() == [[0, 10, 20, 1]]
+
+
+def test_merge_topk_pads_short_results():
+    shard_values = [torch.tensor([[0.3], [0.1]]), torch.empty(2, 0)]
+    shard_indices = [torch.tensor([[4], [7]]), torch.empty(2, 0, dtype=torch.long)]
+
+    values, indices = merge_topk(shard_values, shard_indices, 3)
+    assert values.shape == indices.shape == (2, 3)
+    assert indices.tolist() == [[4, -1, -1], [7, -1, -1]]
+    assert torch.isinf(values[:, 1:]).all() and (values[:, 1:] < 0).all()
+    assert values.dtype == torch.float32 and indices.dtype == torch.long
+
+
+def test_bottomk_is_ascending():
+    scores = torch.tensor([0.5, 0.1, 0.9, 0.3])
+    values, indices = bottomk(scores, 2)
+    assert indices.tolist() == [[1, 3]]
+    assert torch.equal(values, torch.tensor([[0.1, 0.3]]))
+
+
+def test_topk_by_threshold_pads_below_threshold():
+    scores = torch.tensor([[0.5, 0.1, 0.9, 0.3]])
+    values, indices = topk_by_threshold(scores, 3, 0.3)
+    # 等于阈值的也被排除
+    assert indices.tolist() == [[2, 0, -1]]
+    assert torch.isinf(values[0, 2])
+
+
+def test_chunked_topk_matches_topk():
+    scores = torch.randn(2, 1000, generator=torch.Generator().manual_seed(1))
+    values, indices = chunked_topk(lambda start, end: scores[:, start:end], 1000, 10, chunk_size=128)
+    expected_values, expected_indices = topk(scores, 10)
+    assert torch.equal(values, expected_values) and torch.equal(indices, expected_indices)
+
+    values, indices = chunked_topk(lambda start, end: scores[:, start:end], 1000, 10, chunk_size=128, largest=False)
+    assert torch.equal(indices, bottomk(scores, 10)[1])
+
+    # 超过阈值的候选不足k个时以 -1 填充
+    threshold = scores.topk(4, dim=-1).values[:, -1].min().item()
+    values, indices = chunked_topk(lambda start, end: scores[:, start:end], 1000, 10, chunk_size=128,
+                                   threshold=threshold)
+    assert ((indices >= 0).sum(-1) >= 3).all() and (indices[:, -1] == -1).all()
+    assert (values[indices >= 0] > threshold).all()
+
+    values, indices = chunked_topk(lambda start, end: scores[:, start:end], 0, 10)
+    assert values.shape == indices.shape == (1, 0)
+
+
+def test_utils_helpers_match_argsort():
+    probs = torch.randn(1, 50, generator=torch.Generator().manual_seed(2))
+    order = torch.argsort(probs, dim=-1, descending=True)[0]
+    assert torch.equal(utils.get_topk_indices(probs, 5), order[:5])
+    assert torch.equal(utils.get_lastk_indices(probs, 5), order[-5:])
+    above = utils.get_indices_by_threshold(probs, 0.5)
+    assert set(above.tolist()) == set(torch.where(probs > 0.5)[1].tolist())
+    assert torch.equal(above, order[:len(above)])
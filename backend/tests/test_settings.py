@@ -0,0 +1,28 @@
+import pytest
+
+from config import Config
+from models.settings import AlbumSettings, SETTING_NAMES
+
+
+def test_defaults_come_from_config():
+    settings = AlbumSettings()
+    for name in SETTING_NAMES:
+        assert getattr(settings, name.lower()) == getattr(Config, name)
+
+
+def test_overrides_are_hashable_and_immutable():
+    settings = AlbumSettings.from_config({'KNN_K': 4, 'SCORE_MODE': 'cosine', 'SECRET_KEY': 'ignored'})
+    assert settings.knn_k == 4 and settings.score_mode == 'cosine'
+    assert settings.ann_nlist == Config.ANN_NLIST
+    # 作为 get_database 的缓存键：相同的配置相等且哈希相同
+    assert settings == AlbumSettings({'SCORE_MODE': 'cosine', 'KNN_K': 4})
+    assert hash(settings) == hash(AlbumSettings({'SCORE_MODE': 'cosine', 'KNN_K': 4}))
+    assert settings != AlbumSettings()
+    with pytest.raises(AttributeError):
+        settings.knn_k = 8
+
+
+def test_database_uses_settings(album_dir, make_database):
+    db = make_database(album_dir, AlbumSettings({'KNN_K': 3, 'FEATURE_PRECISION': 'fp16'}))
+    assert db.knn_k == 3 and db.knn_graph is not None and db.knn_graph.k == 3
+    assert db.get_search_index().quantized is not None
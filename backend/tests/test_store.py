@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from models.store import FeatureStore, LiveFeatures
+
+
+def test_live_features_keep_mapped_base(tmp_path):
+    features = torch.nn.functional.normalize(torch.randn(10, 8), dim=-1)
+    store = FeatureStore(str(tmp_path / 'db.store'))
+    header = store.write(features, [f'{i}.jpg' for i in range(10)])
+    base = store.read_features(header)
+
+    appended = torch.ones(2, 8)
+    live = LiveFeatures(base).remove([1, 3]).append(appended).remove([8])
+    expected = torch.cat([features[[0, 2, 4, 5, 6, 7, 8, 9]], appended])[[0, 1, 2, 3, 4, 5, 6, 7, 9]]
+
+    # 底层仍是同一个内存映射，只有行号和新增的行保存在内存中
+    assert live.base is base
+    assert len(live.tail) == 1
+    assert len(live) == len(expected) and live.shape == expected.shape
+    assert torch.equal(live[:], expected)
+    assert torch.equal(live[-2:], expected[-2:])
+    assert torch.equal(live[3], expected[3])
+    rows = torch.tensor([[0, 8], [7, -1]])
+    assert torch.equal(live[rows], expected[rows])
+    assert torch.equal(live[np.array([True] * 4 + [False] * 5)], expected[:4])
+
+
+def test_write_streams_live_features(tmp_path):
+    features = torch.randn(6, 4)
+    live = LiveFeatures(features).remove([0]).append(torch.zeros(1, 4))
+    store = FeatureStore(str(tmp_path / 'db.store'))
+    header = store.write(live, [f'{i}.jpg' for i in range(len(live))])
+    assert torch.equal(store.read_features(header), live[:])
+
+
+def test_header_is_the_commit_point(tmp_path, monkeypatch):
+    store = FeatureStore(str(tmp_path / 'db.store'))
+    features = torch.randn(4, 8)
+    store.write(features, [f'{i}.jpg' for i in range(4)], index_version=1)
+
+    # 写完数据文件、切换 header 之前崩溃：仍然读到上一代
+    def crash(src, dst):
+        raise OSError('crashed before commit')
+    with monkeypatch.context() as patch:
+        patch.setattr(os, 'replace', crash)
+        with pytest.raises(OSError):
+            store.write(torch.randn(2, 8), ['a.jpg', 'b.jpg'], index_version=2)
+    header, read_features, paths = store.read()
+    assert header['generation'] == 0 and header['index_version'] == 1
+    assert paths == [f'{i}.jpg' for i in range(4)]
+    assert torch.equal(read_features, features)
+
+    # 下一次成功的写入覆盖残留的未提交文件，并删除旧的一代
+    new_features = torch.randn(3, 8)
+    store.write(new_features, ['x.jpg', 'y.jpg', 'z.jpg'], index_version=3)
+    header, read_features, paths = store.read()
+    assert header['generation'] == 1 and paths == ['x.jpg', 'y.jpg', 'z.jpg']
+    assert torch.equal(read_features, new_features)
+    assert not any(name.split('.')[1] == '0' for name in os.listdir(store.path) if name != 'header.json')
+
+
+def test_live_features_scan_without_copying(tmp_path):
+    features = torch.nn.functional.normalize(torch.randn(100, 8), dim=-1)
+    store = FeatureStore(str(tmp_path / 'db.store'))
+    base = store.read_features(store.write(features, [f'{i}.jpg' for i in range(100)]))
+    appended = torch.nn.functional.normalize(torch.randn(5, 8), dim=-1)
+    live = LiveFeatures(base).remove([10, 11, 57]).append(appended)
+    dense = live[:]
+    queries = torch.randn(3, 8)
+
+    # 没有删除行的区间仍是底层映射的视图
+    assert live[20:50].data_ptr() == base[22:52].data_ptr()
+    assert torch.equal(live[20:50], dense[20:50])
+    # 跨越已删除的行和内存中的尾部时，相似度与逐行读取的结果一致
+    for start, stop in [(0, 97), (5, 60), (90, 102), (97, 102), (40, 40)]:
+        assert torch.allclose(live.scores(queries, start, stop), queries @ dense[start:stop].T, atol=1e-6)
@@ -0,0 +1,79 @@
+import os
+import time
+
+from models import walker
+from models.walker import DirectoryWalker
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+
+def age_dirs(root):
+    """把目录的修改时间改到修改窗口之前，使其可以被缓存"""
+    past = time.time() - 60
+    for dir_path, _, _ in os.walk(root):
+        os.utime(dir_path, (past, past))
+
+
+def make_tree(root):
+    for name in ('a.jpg', 'b.PNG', 'notes.txt', '.hidden.jpg', 'sub/c.webp', 'sub/deep/d.jpeg', '.cache/e.jpg'):
+        touch(str(root / name))
+    os.symlink(str(root / 'sub'), str(root / 'link'))
+    age_dirs(root)
+
+
+def test_walk_finds_images_once(tmp_path):
+    root = tmp_path / 'album'
+    make_tree(root)
+
+    # 扩展名不区分大小写，跳过隐藏的文件和目录，不进入指向目录的符号链接
+    paths = DirectoryWalker(workers=2).walk(str(root))
+    assert paths == sorted(str(root / name) for name in ('a.jpg', 'b.PNG', 'sub/c.webp', 'sub/deep/d.jpeg'))
+
+
+def test_unchanged_directories_are_not_relisted(tmp_path, monkeypatch):
+    root = tmp_path / 'album'
+    make_tree(root)
+    cache_path = str(tmp_path / 'db.dirs.json')
+    first = DirectoryWalker(workers=2, cache_path=cache_path).walk(str(root))
+
+    listed = []
+    scandir = os.scandir
+
+    def counting(path):
+        listed.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(walker.os, 'scandir', counting)
+    # 缓存随数据库保存，重新启动后未变化的目录只需一次 stat
+    restarted = DirectoryWalker(workers=2, cache_path=cache_path)
+    assert restarted.walk(str(root)) == first
+    assert listed == [] and restarted.relisted == set()
+
+    touch(str(root / 'sub' / 'new.gif'))
+    paths = restarted.walk(str(root))
+    assert listed == [str(root / 'sub')] and restarted.relisted == {str(root / 'sub')}
+    assert paths == sorted(first + [str(root / 'sub' / 'new.gif')])
+
+
+def test_probe_and_refresh_changed_directories(tmp_path):
+    root = tmp_path / 'album'
+    make_tree(root)
+    dir_walker = DirectoryWalker(workers=2)
+    dir_walker.walk(str(root))
+    assert dir_walker.probe(str(root)) == []
+
+    os.remove(str(root / 'sub' / 'deep' / 'd.jpeg'))
+    os.rmdir(str(root / 'sub' / 'deep'))
+    touch(str(root / 'sub' / 'more' / 'f.jpg'))
+    assert sorted(dir_walker.probe(str(root))) == [str(root / 'sub'), str(root / 'sub' / 'deep')]
+
+    # 消失的子目录整体移除，新出现的子目录整体列出
+    old_paths, new_paths = dir_walker.refresh([str(root / 'sub')])
+    assert old_paths == [str(root / 'sub' / 'c.webp'), str(root / 'sub' / 'deep' / 'd.jpeg')]
+    assert new_paths == [str(root / 'sub' / 'c.webp'), str(root / 'sub' / 'more' / 'f.jpg')]
+    assert str(root / 'sub' / 'deep') not in dir_walker.cache
+    assert dir_walker.walk(str(root)) == sorted(str(root / name) for name in ('a.jpg', 'b.PNG', 'sub/c.webp',
+                                                                                  'sub/more/f.jpg'))
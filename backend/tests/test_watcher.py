@@ -0,0 +1,91 @@
+import os
+import time
+
+import pytest
+
+from conftest import save_image
+from models.settings import AlbumSettings
+from models.walker import DirectoryWalker
+from models.watcher import FolderWatcher, Inotify, IN_CREATE, IN_CLOSE_WRITE, IN_ISDIR, IN_Q_OVERFLOW
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_changes_are_batched_after_debounce(tmp_path):
+    batches = []
+    watcher = FolderWatcher(str(tmp_path), DirectoryWalker(), lambda dirs: batches.append(dirs) or 1,
+                            mode='poll', debounce=60)
+    watcher.mark(['b', 'a'])
+    watcher.mark(['a'])
+    watcher.flush()
+    assert batches == [] and watcher.stats()['pending_dirs'] == 2
+
+    # 事件平息后，期间变化的目录合并为一批
+    watcher.last_event -= 60
+    watcher.flush()
+    assert batches == [['a', 'b']] and watcher.stats()['batches'] == 1
+
+    # 事件持续不断时，最早的事件等待过久后强制提交
+    watcher.mark(['c'])
+    watcher.first_event -= 600
+    watcher.flush()
+    assert batches[-1] == ['c']
+
+
+def test_inotify_events_map_to_directories(tmp_path):
+    batches = []
+    watcher = FolderWatcher(str(tmp_path), DirectoryWalker(), batches.append, mode='inotify', debounce=0)
+    root = str(tmp_path)
+    watcher.handle([(root, 'notes.txt', IN_CLOSE_WRITE), (root, '.partial.jpg', IN_CLOSE_WRITE)])
+    assert watcher.stats()['pending_dirs'] == 0
+    watcher.handle([(root, 'photo.JPG', IN_CLOSE_WRITE)])
+    watcher.flush()
+    assert batches == [[root]]
+
+    # 事件队列溢出时需要完整扫描
+    watcher.handle([(None, '', IN_Q_OVERFLOW)])
+    watcher.flush()
+    assert batches[-1] is None
+
+
+@pytest.mark.skipif(not Inotify.available(), reason='inotify is only available on Linux')
+def test_new_directories_are_watched(tmp_path):
+    watcher = FolderWatcher(str(tmp_path), DirectoryWalker(), lambda dirs: 0, mode='inotify')
+    watcher.inotify = Inotify()
+    try:
+        watcher.inotify.add(str(tmp_path))
+        os.makedirs(str(tmp_path / 'new' / 'nested'))
+        watcher.handle([(str(tmp_path), 'new', IN_CREATE | IN_ISDIR)])
+        assert set(watcher.inotify.dir_to_wd) == {str(tmp_path), str(tmp_path / 'new'), str(tmp_path / 'new' / 'nested')}
+    finally:
+        watcher.inotify.close()
+
+
+@pytest.mark.parametrize('mode', ['inotify', 'poll'])
+def test_watched_album_is_updated_incrementally(album_dir, make_database, mode):
+    if mode == 'inotify' and not Inotify.available():
+        pytest.skip('inotify is only available on Linux')
+    db = make_database(album_dir, AlbumSettings({'WATCH_MODE': mode, 'WATCH_DEBOUNCE': 0.1,
+                                                 'WATCH_POLL_INTERVAL': 0.1}))
+    try:
+        assert db.watcher is not None
+        added = str(album_dir / 'd2' / 'new.png')
+        removed = str(album_dir / 'd0' / 'img0.png')
+        save_image(added, 50)
+        os.remove(removed)
+
+        # 新图片加入检索索引，删除的图片从索引中移除，不需要手动扫描
+        assert wait_for(lambda: added in db.get_search_index().path_to_index
+                        and removed not in db.get_search_index().path_to_index)
+        assert len(db.get_search_index()) == 12
+        assert wait_for(lambda: db.watcher.stats()['batches'] > 0)
+        assert db.watcher.stats()['backend'] == mode
+    finally:
+        db.stop_watcher()
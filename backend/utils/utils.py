@@ -16,10 +16,17 @@ def synchronized(lock):
     return decorator
 
 
-def convert_results(paths, scores):
+def convert_results(paths, scores, include_images=True):
     # 转换结果
     results = []
     for path, score in zip(paths, scores):
+        if not include_images:
+            results.append({
+                'path': path,
+                'filename': os.path.basename(path),
+                'score': round(score, 4)
+            })
+            continue
         try:
             with Image.open(path) as img:
                 if img.mode != 'RGB':
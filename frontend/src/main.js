@@ -20,6 +20,7 @@ import {
   DataBoard,
   Histogram,
   Document,
+  Loading,
 } from '@element-plus/icons-vue'
 
 console.log('🚀 Vue应用开始初始化...')
@@ -42,6 +43,7 @@ const icons = {
   DataBoard,
   Histogram,
   Document,
+  Loading,
 }
 
 // 注册图标组件
@@ -6,21 +6,25 @@ export const searchService = {
     return api.get(`/images/random?count=${count}`)
   },
 
-  // 文本搜索
-  textSearch(query, k = 20, threshold = 0.) {
+  // 文本搜索（指定 pageSize 时返回分页游标）
+  textSearch(query, k = 20, threshold = 0., pageSize = null) {
     return api.post('/images/search/text', {
       query,
       k,
-      threshold
+      threshold,
+      ...(pageSize ? { page_size: pageSize } : {})
     })
   },
 
-  // 图像搜索
-  imageSearch(imageFile, k = 20, threshold = 0.) {
+  // 图像搜索（指定 pageSize 时返回分页游标）
+  imageSearch(imageFile, k = 20, threshold = 0., pageSize = null) {
     const formData = new FormData()
     formData.append('image', imageFile)
     formData.append('k', k)
     formData.append('threshold', threshold)
+    if (pageSize) {
+      formData.append('page_size', pageSize)
+    }
     
     return api.post('/images/search/image', formData, {
       headers: {
@@ -29,6 +33,72 @@ export const searchService = {
     })
   },
 
+  // 以相册中已有的图片搜索相似图片（使用已存储的特征）
+  similarSearch(path, k = 20, threshold = 0., pageSize = null) {
+    return api.post('/images/search/similar', {
+      path,
+      k,
+      threshold,
+      ...(pageSize ? { page_size: pageSize } : {})
+    })
+  },
+
+  // 随机漫游：返回图片的近邻（余弦相似度）和建议的下一张图片，exclude 为已访问过的图片路径
+  walk(path, count = 12, exclude = []) {
+    return api.post('/images/walk', {
+      path,
+      count,
+      exclude
+    })
+  },
+
+  // 组合搜索：terms 为 [{ text | path | image, weight }]，负权重表示排除，image 为 imageFiles 中的下标
+  composeSearch(terms, k = 20, threshold = 0., imageFiles = []) {
+    if (imageFiles.length === 0) {
+      return api.post('/images/search/compose', { terms, k, threshold })
+    }
+    const formData = new FormData()
+    formData.append('terms', JSON.stringify(terms))
+    formData.append('k', k)
+    formData.append('threshold', threshold)
+    imageFiles.forEach(file => formData.append('images', file))
+    return api.post('/images/search/compose', formData, {
+      headers: {
+        'Content-Type': 'multipart/form-data'
+      }
+    })
+  },
+
+  // 按游标获取分页搜索的下一页
+  getSearchPage(cursor, offset, limit = 20) {
+    return api.get(`/images/search/page?cursor=${cursor}&offset=${offset}&limit=${limit}`)
+  },
+
+  // 批量搜索（多个文本查询一次提交）
+  batchSearch(queries, k = 8, threshold = 0., includeImages = false) {
+    return api.post('/images/search/batch', {
+      queries,
+      k,
+      threshold,
+      include_images: includeImages
+    })
+  },
+
+  // 启动近似重复检测（后台任务，中断后再次启动会从检查点继续）
+  startDuplicateScan(threshold = null) {
+    return api.post('/duplicates/scan', threshold === null ? {} : { threshold })
+  },
+
+  // 停止近似重复检测
+  stopDuplicateScan() {
+    return api.post('/duplicates/stop')
+  },
+
+  // 获取近似重复检测状态和重复组
+  getDuplicates(offset = 0, limit = 10) {
+    return api.get(`/duplicates?offset=${offset}&limit=${limit}`)
+  },
+
   // 获取统计信息
   getStats() {
     return api.get('/images/stats')